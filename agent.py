@@ -1,11 +1,18 @@
 import os
+import time
+import json
+import queue
+import select
+import socket
 import asyncio
-from flask import Blueprint, request, jsonify
-# Asegúrate de que el nombre del paquete sea correcto para la instalación pip
-# y que estas sean las clases correctas de la librería.
-from agents import Agent, Runner 
-# No necesitaríamos RunConfig si solo lo usábamos para el modelo
-# from agents.config import RunConfig 
+import threading
+import concurrent.futures
+from flask import Blueprint, Response, request, jsonify, current_app, session, stream_with_context
+import response_cache
+import outbound
+from models import db, ChatMessage
+# El SDK de agentes (y openai) tarda ~2 s en importarse: se carga con el
+# primer chat (ver load_agents), no al arrancar cada worker
 from dotenv import load_dotenv
 
 # Cargar variables de entorno (si tienes un .env para OPENAI_API_KEY)
@@ -19,62 +26,423 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     print("ADVERTENCIA CRÍTICA: La variable de entorno OPENAI_API_KEY no está configurada. El chatbot no funcionará.")
 
-# Definición del Agente
-try:
-    wingfoil_agent = Agent(
-        name="InstructorWingfoil",
-        instructions=(
-            "Eres un instructor experto en wingfoil. "
-            "Proporciona consejos prácticos y motivacionales para principiantes. "
-            "Responde de manera amigable y accesible, con respuestas concisas de máximo 300 caracteres."
-        ),
-        model="gpt-4o" # Especificando el modelo directamente aquí
-    )
-except Exception as e:
-    print(f"Error al inicializar el Agente: {e}. Asegúrate de que la librería 'openai-agents' está instalada y OPENAI_API_KEY es válida.")
-    wingfoil_agent = None
+# Tiempo máximo (segundos) de una llamada al agente antes de cancelarla
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", 60))
+# Cada cuánto se comprueba si el cliente ha cerrado la conexión
+DISCONNECT_POLL_INTERVAL = 0.5
+# Comentario SSE enviado si no hay tokens, para detectar desconexiones y evitar cortes de proxies
+STREAM_KEEPALIVE = 10
+# Presupuesto (tokens aproximados) del historial que acompaña a cada mensaje
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", 1500))
+# Tamaño máximo del resumen de los turnos antiguos
+CHAT_SUMMARY_CHARS = int(os.getenv("CHAT_SUMMARY_CHARS", 1500))
+# Filas leídas como mucho por petición; acota la consulta aunque falle la compactación
+HISTORY_WINDOW = 60
 
+# Agentes del proceso: (instructor, coach), construidos por load_agents()
+_agents = None
+_agents_lock = threading.Lock()
 
-@agent_bp.route('/api/chat', methods=['POST']) # Ruta dentro del blueprint
-def chat_api():
-    if not wingfoil_agent:
+
+def load_agents():
+    """Importa el SDK y define los agentes la primera vez; devuelve ``(instructor, coach)``.
+
+    Si el SDK no está disponible devuelve ``(None, None)``.
+    """
+    global _agents
+    with _agents_lock:
+        if _agents is None:
+            try:
+                from agents import Agent
+                from agent_tools import TOOLS
+                wingfoil_agent = Agent(
+                    name="InstructorWingfoil",
+                    instructions=(
+                        "Eres un instructor experto en wingfoil. "
+                        "Proporciona consejos prácticos y motivacionales para principiantes. "
+                        "Responde de manera amigable y accesible, con respuestas concisas de máximo 300 caracteres."
+                    ),
+                    model="gpt-4o" # Especificando el modelo directamente aquí
+                )
+                # Con sesión iniciada, el mismo instructor puede consultar los datos del alumno
+                coach_agent = wingfoil_agent.clone(
+                    instructions=wingfoil_agent.instructions + (
+                        " Puedes consultar las sesiones, habilidades, objetivos y material del alumno con tus "
+                        "herramientas; úsalas solo cuando la pregunta dependa de sus datos."
+                    ),
+                    tools=TOOLS,
+                )
+                _agents = (wingfoil_agent, coach_agent)
+            except Exception as e:
+                print(f"Error al inicializar el Agente: {e}. Asegúrate de que la librería 'openai-agents' está instalada y OPENAI_API_KEY es válida.")
+                _agents = (None, None)
+        return _agents
+
+
+class AgentTimeout(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# Bucle de eventos compartido: un hilo por proceso ejecuta todas las llamadas
+# al agente, así un worker multiplexa muchas peticiones en vuelo mientras los
+# hilos de gunicorn (gthread) solo esperan su resultado.
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """Devuelve el bucle del proceso, arrancándolo la primera vez (seguro tras fork)."""
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name='agent-loop', daemon=True).start()
+        return _loop
+
+
+def get_runner():
+    """El Runner del SDK, o el que se configure en ``AGENT_RUNNER`` (p. ej. un falso para pruebas)."""
+    runner = current_app.config.get('AGENT_RUNNER')
+    if runner is None:
+        from agents import Runner
+        runner = Runner
+    return runner
+
+
+def client_disconnected(environ):
+    """True si el cliente ya cerró la conexión (solo detectable bajo gunicorn)."""
+    sock = environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+def run_in_loop(coro, timeout=None, environ=None):
+    """Ejecuta ``coro`` en el bucle compartido y espera su resultado.
+
+    ``coro`` debe aplicar ``timeout`` por sí misma (``outbound.openai.acall(...,
+    timeout=AGENT_TIMEOUT)``), para que el circuito cuente el exceso como un
+    fallo de OpenAI; si aun así sigue corriendo un segundo después, se cancela.
+    Lanza AgentTimeout si se agota el tiempo y ClientDisconnected (cancelando
+    la corrutina) si el cliente se desconecta mientras tanto.
+    """
+    timeout = AGENT_TIMEOUT if timeout is None else timeout
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    deadline = time.monotonic() + timeout + 1
+    while True:
+        try:
+            return future.result(timeout=DISCONNECT_POLL_INTERVAL)
+        except (concurrent.futures.TimeoutError, asyncio.TimeoutError):
+            if future.done():
+                # Fue la propia corrutina quien agotó el tiempo dentro del bucle
+                raise AgentTimeout()
+            if environ is not None and client_disconnected(environ):
+                future.cancel()
+                raise ClientDisconnected()
+            if time.monotonic() > deadline:
+                future.cancel()
+                raise AgentTimeout()
+
+
+def used_tools(result):
+    """True si la ejecución consultó datos del usuario (su respuesta no debe cachearse)."""
+    return any(getattr(item, 'type', None) == 'tool_call_item' for item in getattr(result, 'new_items', None) or [])
+
+
+def extract_reply(result):
+    """Texto de respuesta de un resultado de ``Runner.run``."""
+    if hasattr(result, 'final_output') and result.final_output is not None:
+        return result.final_output
+    print(f"Advertencia: El objeto resultado no tiene 'final_output' o es None. Contenido: {result}")
+    response_text = "No se pudo obtener una respuesta clara del agente."
+    if hasattr(result, 'history') and result.history:
+        last_event = result.history[-1]
+        if hasattr(last_event, 'content'):
+            response_text = str(last_event.content)
+        else:
+            response_text = str(last_event)
+    return response_text
+
+
+# Memoria de conversación: cada usuario con sesión iniciada tiene su historial
+# en la tabla chat_message. Solo se envían al agente los turnos recientes que
+# caben en CHAT_HISTORY_TOKENS; los anteriores se compactan en una única fila
+# 'summary', así el tamaño del prompt no crece con la conversación.
+def estimate_tokens(text):
+    """Estimación barata (~4 caracteres por token) sin tokenizador."""
+    return len(text) // 4 + 4
+
+
+def _recent_rows(user_id):
+    summary = (ChatMessage.query.filter_by(user_id=user_id, role='summary')
+               .order_by(ChatMessage.id.desc()).first())
+    recent = (ChatMessage.query.filter(ChatMessage.user_id == user_id, ChatMessage.role != 'summary')
+              .order_by(ChatMessage.id.desc()).limit(HISTORY_WINDOW).all())
+    budget = CHAT_HISTORY_TOKENS - (summary.tokens if summary else 0)
+    kept = []
+    for row in recent:
+        budget -= row.tokens
+        if budget < 0:
+            break
+        kept.append(row)
+    kept.reverse()
+    # No empezar el historial con una respuesta sin su pregunta
+    while kept and kept[0].role != 'user':
+        kept.pop(0)
+    older = [row for row in reversed(recent) if not kept or row.id < kept[0].id]
+    return summary, kept, older
+
+
+def load_history(user_id):
+    """Mensajes previos del usuario en el formato de entrada del Runner."""
+    summary, kept, _ = _recent_rows(user_id)
+    items = []
+    if summary:
+        items.append({"role": "system",
+                      "content": f"Resumen de la conversación anterior con este alumno:\n{summary.content}"})
+    items.extend({"role": row.role, "content": row.content} for row in kept)
+    return items
+
+
+def _summary_line(row):
+    speaker = 'Alumno' if row.role == 'user' else 'Instructor'
+    text = ' '.join(row.content.split())
+    return f"{speaker}: {text[:200]}{'…' if len(text) > 200 else ''}"
+
+
+def save_turn(user_id, message, reply):
+    """Guarda pregunta y respuesta y compacta lo que ya no cabe en el presupuesto.
+
+    La compactación es determinista (una línea recortada por turno, conservando
+    las más recientes) para no añadir otra llamada al modelo por mensaje.
+    """
+    db.session.add(ChatMessage(user_id=user_id, role='user', content=message, tokens=estimate_tokens(message)))
+    db.session.add(ChatMessage(user_id=user_id, role='assistant', content=reply, tokens=estimate_tokens(reply)))
+    db.session.flush()
+    summary, kept, older = _recent_rows(user_id)
+    if older:
+        lines = (summary.content.split('\n') if summary else []) + [_summary_line(row) for row in older]
+        while len(lines) > 1 and len('\n'.join(lines)) > CHAT_SUMMARY_CHARS:
+            lines.pop(0)
+        content = '\n'.join(lines)[-CHAT_SUMMARY_CHARS:]
+        if summary is None:
+            summary = ChatMessage(user_id=user_id, role='summary')
+            db.session.add(summary)
+        summary.content = content
+        summary.tokens = estimate_tokens(content)
+        # Incluye también las filas que quedaran fuera de HISTORY_WINDOW
+        ChatMessage.query.filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.role != 'summary',
+            ChatMessage.id < (kept[0].id if kept else older[-1].id + 1)
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def agent_for(user_id):
+    """Agente y contexto de ejecución: con herramientas solo para usuarios identificados."""
+    wingfoil_agent, coach_agent = load_agents()
+    if not user_id:
+        return wingfoil_agent, None
+    from agent_tools import ChatContext
+    return coach_agent, ChatContext(current_app._get_current_object(), user_id)
+
+
+def agent_unavailable():
+    """Respuesta de error si el agente no puede usarse, o None."""
+    if not load_agents()[0]:
         return jsonify({"error": "El agente del chatbot no está inicializado correctamente."}), 500
-    
-    if not OPENAI_API_KEY: 
+    # Con un Runner falso configurado no hace falta la clave de OpenAI
+    if not OPENAI_API_KEY and not current_app.config.get('AGENT_RUNNER'):
         return jsonify({"error": "Configuración de API Key faltante en el servidor."}), 500
+    return None
+
+
+@agent_bp.route('/api/chat', methods=['POST']) # Ruta dentro del blueprint
+def chat_api():
+    unavailable = agent_unavailable()
+    if unavailable:
+        return unavailable
 
-    user_message = request.json.get('message', '') 
+    user_message = (request.get_json(silent=True) or {}).get('message', '')
     if not user_message:
         return jsonify({"error": "El campo 'message' es requerido en el JSON."}), 400
     
-    try:
-        # Ejecutar el agente de forma asíncrona compatible con Flask en hilos secundarios
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop = asyncio.get_event_loop()
-        result = loop.run_until_complete(Runner.run(wingfoil_agent, user_message))
-        if hasattr(result, 'final_output') and result.final_output is not None:
-            response_text = result.final_output
-        else:
-            print(f"Advertencia: El objeto resultado no tiene 'final_output' o es None. Contenido: {result}")
-            response_text = "No se pudo obtener una respuesta clara del agente." 
-            if hasattr(result, 'history') and result.history: 
-                last_event = result.history[-1]
-                if hasattr(last_event, 'content'):
-                    response_text = str(last_event.content) 
-                else:
-                    response_text = str(last_event)
+    user_id = session.get('user_id')
+    history = load_history(user_id) if user_id else []
+
+    # Las preguntas repetidas ("¿cómo hago el waterstart?") salen de la caché,
+    # salvo a mitad de conversación, donde la respuesta depende del contexto
+    if not history:
+        cached = response_cache.lookup(user_message)
+        if cached is not None:
+            if user_id:
+                save_turn(user_id, user_message, cached)
+            return jsonify({"reply": cached, "cached": True})
 
-        return jsonify({"reply": response_text})
+    agent_input = history + [{"role": "user", "content": user_message}] if history else user_message
+    chat_agent, context = agent_for(user_id)
+    # Preguntas idénticas sin contexto comparten una sola llamada en vuelo
+    flight_key = response_cache.cache_key(user_message) if context is None and not history else None
+    try:
+        result = run_in_loop(
+            outbound.openai.acall(lambda: get_runner().run(chat_agent, agent_input, context=context),
+                                  key=flight_key, timeout=AGENT_TIMEOUT),
+            environ=request.environ
+        )
+        reply = extract_reply(result)
+        if getattr(result, 'final_output', None) is not None:
+            # Las respuestas basadas en datos del alumno no se comparten
+            if not history and not used_tools(result):
+                response_cache.store(user_message, reply)
+            if user_id:
+                save_turn(user_id, user_message, reply)
+        return jsonify({"reply": reply})
 
+    except AgentTimeout:
+        return jsonify({"error": "El agente tardó demasiado en responder. Inténtalo de nuevo."}), 504
+    except outbound.UpstreamUnavailable:
+        return jsonify({"error": "El instructor está muy solicitado ahora mismo. Inténtalo en unos segundos."}), 503
+    except ClientDisconnected:
+        # Nadie leerá la respuesta; la llamada al agente ya se ha cancelado
+        return '', 499
     except Exception as e:
         error_message_for_log = f"Error en la ejecución del agente: {type(e).__name__} - {str(e)}"
         print(error_message_for_log) 
         return jsonify({"error": "Ocurrió un error al procesar tu mensaje."}), 500
 
+def sse(data, event=None):
+    """Formatea un evento Server-Sent Events."""
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+
+async def stream_agent(runner, chat_agent, agent_input, context, events):
+    """Pasa los fragmentos de texto del agente a ``events`` según llegan."""
+    result = runner.run_streamed(chat_agent, agent_input, context=context)
+    async for event in result.stream_events():
+        if event.type == 'raw_response_event' and getattr(event.data, 'type', None) == 'response.output_text.delta':
+            events.put(('delta', event.data.delta))
+    events.put(('done', (extract_reply(result), result.final_output is not None, used_tools(result))))
+
+
+@agent_bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream_api():
+    """Variante de ``chat_api`` que envía la respuesta token a token (SSE).
+
+    Eventos: ``data: {"delta": ...}`` por fragmento, luego ``event: done`` con
+    la respuesta completa, o ``event: error``. Si el cliente se desconecta,
+    gunicorn cierra el generador y la llamada al agente se cancela.
+    """
+    unavailable = agent_unavailable()
+    if unavailable:
+        return unavailable
+
+    user_message = (request.get_json(silent=True) or {}).get('message', '')
+    if not user_message:
+        return jsonify({"error": "El campo 'message' es requerido en el JSON."}), 400
+
+    user_id = session.get('user_id')
+    history = load_history(user_id) if user_id else []
+
+    if not history:
+        cached = response_cache.lookup(user_message)
+        if cached is not None:
+            if user_id:
+                save_turn(user_id, user_message, cached)
+            return Response(sse({"delta": cached}) + sse({"reply": cached, "cached": True}, 'done'),
+                            mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    agent_input = history + [{"role": "user", "content": user_message}] if history else user_message
+    chat_agent, context = agent_for(user_id)
+    runner = get_runner()
+    events = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        outbound.openai.acall(lambda: stream_agent(runner, chat_agent, agent_input, context, events),
+                              timeout=AGENT_TIMEOUT),
+        get_loop()
+    )
+
+    def generate():
+        idle = 0
+        try:
+            while True:
+                try:
+                    kind, payload = events.get(timeout=DISCONNECT_POLL_INTERVAL)
+                except queue.Empty:
+                    if future.done():
+                        error = future.exception()
+                        if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+                            yield sse({"error": "El agente tardó demasiado en responder. Inténtalo de nuevo."}, 'error')
+                        elif isinstance(error, outbound.UpstreamUnavailable):
+                            yield sse({"error": "El instructor está muy solicitado ahora mismo. Inténtalo en unos segundos."}, 'error')
+                        else:
+                            print(f"Error en la ejecución del agente: {type(error).__name__} - {error}")
+                            yield sse({"error": "Ocurrió un error al procesar tu mensaje."}, 'error')
+                        return
+                    idle += DISCONNECT_POLL_INTERVAL
+                    if idle >= STREAM_KEEPALIVE:
+                        idle = 0
+                        yield ": keep-alive\n\n"
+                    continue
+                idle = 0
+                if kind == 'delta':
+                    yield sse({"delta": payload})
+                else:
+                    reply, complete, personal = payload
+                    if complete:
+                        if not history and not personal:
+                            response_cache.store(user_message, reply)
+                        if user_id:
+                            save_turn(user_id, user_message, reply)
+                    yield sse({"reply": reply}, 'done')
+                    return
+        finally:
+            # No-op si ya terminó; si el cliente se fue, cancela la llamada
+            future.cancel()
+
+    # El generador guarda el turno en la base de datos: necesita el contexto
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@agent_bp.route('/api/cache', methods=['GET', 'DELETE'])
+def cache_api():
+    """Estadísticas de la caché de respuestas (GET) o vaciarla (DELETE). Solo admins."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+    if request.method == 'DELETE':
+        response_cache.clear()
+    return jsonify(response_cache.stats() or {})
+
+@agent_bp.route('/api/history', methods=['GET', 'DELETE'])
+def history_api():
+    """Historial del chat del usuario (GET) o borrarlo (DELETE)."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Inicia sesión para guardar tus conversaciones."}), 401
+    if request.method == 'DELETE':
+        ChatMessage.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+        return jsonify({"success": True})
+    summary, kept, _ = _recent_rows(user_id)
+    return jsonify({
+        "summary": summary.content if summary else None,
+        "messages": [
+            {"role": row.role, "content": row.content, "created_at": row.created_at.isoformat()}
+            for row in kept
+        ],
+    })
+
 # Para probar este archivo directamente (opcional, si no lo registras en una app principal)
 # if __name__ == '__main__':
 #     from flask import Flask
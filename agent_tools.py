@@ -0,0 +1,170 @@
+"""Herramientas del agente sobre los datos del propio usuario.
+
+El modelo decide cuándo llamarlas; cada una hace una consulta acotada (LIMIT)
+sobre un índice por ``user_id`` y devuelve un texto breve, en lugar de meter
+todo el historial de entrenamiento en el prompt.
+
+Las herramientas corren en el bucle de eventos compartido de agent.py, así que
+la consulta se hace en un hilo aparte (``asyncio.to_thread``) con su propio
+contexto de aplicación para no bloquear el resto de llamadas al agente.
+"""
+import asyncio
+from dataclasses import dataclass
+from flask import Flask
+from agents import RunContextWrapper, function_tool
+from models import db, Session, UserSkill, Skill, Goal, Product
+
+MAX_SESSIONS = 10
+MAX_ITEMS = 20
+# Sesiones recientes revisadas para deducir el material del usuario
+EQUIPMENT_SESSIONS = 20
+TEXT_LIMIT = 160
+
+
+@dataclass
+class ChatContext:
+    """Contexto de una ejecución del agente para un usuario con sesión iniciada."""
+    app: Flask
+    user_id: int
+
+
+def _short(text, limit=TEXT_LIMIT):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+async def _query(ctx, fn):
+    """Ejecuta ``fn(user_id)`` fuera del bucle, dentro de un contexto de aplicación."""
+    context = ctx.context
+
+    def run():
+        with context.app.app_context():
+            return fn(context.user_id)
+
+    return await asyncio.to_thread(run)
+
+
+def _recent_sessions(user_id, limit):
+    sessions = (db.session.query(Session)
+                .filter(Session.user_id == user_id)
+                .order_by(Session.date.desc(), Session.id.desc())
+                .limit(limit).all())
+    if not sessions:
+        return "El alumno aún no ha registrado ninguna sesión."
+    lines = []
+    for s in sessions:
+        parts = [s.date.isoformat(), s.sport_type, f"{s.duration} min"]
+        if s.location:
+            parts.append(s.location)
+        if s.rating:
+            parts.append(f"valoración {s.rating}/5")
+        if s.wind_speed:
+            parts.append(f"viento {_short(s.wind_speed, 40)}")
+        for label, value in (('notas', s.notes), ('logros', s.achievements), ('dificultades', s.challenges)):
+            if value:
+                parts.append(f"{label}: {_short(value)}")
+        lines.append(' · '.join(parts))
+    return '\n'.join(lines)
+
+
+@function_tool
+async def recent_sessions(ctx: RunContextWrapper[ChatContext], limit: int = 5) -> str:
+    """Últimas sesiones de entrenamiento del alumno, de la más reciente a la más antigua.
+
+    Args:
+        limit: Número de sesiones a devolver (máximo 10).
+    """
+    limit = max(1, min(limit, MAX_SESSIONS))
+    return await _query(ctx, lambda user_id: _recent_sessions(user_id, limit))
+
+
+def _skills_with_status(user_id, status):
+    # Una consulta por estado sobre (user_id, status), para que uno no agote el límite del otro
+    return (db.session.query(Skill.name, Skill.category)
+            .join(UserSkill, UserSkill.skill_id == Skill.id)
+            .filter(UserSkill.user_id == user_id, UserSkill.status == status)
+            .order_by(UserSkill.updated_at.desc())
+            .limit(MAX_ITEMS).all())
+
+
+def _skills(user_id):
+    in_progress = [f"{name} ({category})" for name, category in _skills_with_status(user_id, 'in_progress')]
+    mastered = [name for name, _ in _skills_with_status(user_id, 'mastered')]
+    if not in_progress and not mastered:
+        return "El alumno no ha marcado ninguna habilidad."
+    return (f"En progreso: {', '.join(in_progress) or 'ninguna'}\n"
+            f"Dominadas: {', '.join(mastered) or 'ninguna'}")
+
+
+@function_tool
+async def skills_in_progress(ctx: RunContextWrapper[ChatContext]) -> str:
+    """Habilidades que el alumno está aprendiendo y las que ya domina."""
+    return await _query(ctx, _skills)
+
+
+def _goals(user_id):
+    goals = (db.session.query(Goal)
+             .filter(Goal.user_id == user_id)
+             .order_by(Goal.id.desc())
+             .limit(MAX_ITEMS).all())
+    if not goals:
+        return "El alumno no tiene objetivos definidos."
+    lines = []
+    for goal in goals:
+        line = goal.title
+        if goal.due_date:
+            line += f" (para el {goal.due_date.date().isoformat()})"
+        if goal.description:
+            line += f": {_short(goal.description)}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+@function_tool
+async def goals(ctx: RunContextWrapper[ChatContext]) -> str:
+    """Objetivos que el alumno se ha marcado, los más recientes primero."""
+    return await _query(ctx, _goals)
+
+
+def _equipment(user_id):
+    rows = (db.session.query(Session.equipment, Session.date)
+            .filter(Session.user_id == user_id)
+            .order_by(Session.date.desc(), Session.id.desc())
+            .limit(EQUIPMENT_SESSIONS).all())
+    seen = {}
+    for equipment, day in rows:
+        equipment = _short(equipment, 80)
+        if equipment and equipment.lower() not in seen:
+            seen[equipment.lower()] = f"{equipment} (usado por última vez el {day.isoformat()})"
+    if not seen:
+        return "El alumno no ha anotado qué material usa."
+    return '\n'.join(seen.values())
+
+
+@function_tool
+async def my_gear(ctx: RunContextWrapper[ChatContext]) -> str:
+    """Material (ala, tabla, foil, neopreno...) que el alumno ha usado en sus últimas sesiones."""
+    return await _query(ctx, _equipment)
+
+
+def _catalogue(search):
+    query = db.session.query(Product.name, Product.price, Product.description).filter(Product.is_available.is_(True))
+    if search:
+        query = query.filter(Product.name.ilike(f"%{search}%"))
+    products = query.order_by(Product.id.desc()).limit(5).all()
+    if not products:
+        return "No hay material disponible que coincida."
+    return '\n'.join(f"{name} · {price} € · {_short(description, 100)}" for name, price, description in products)
+
+
+@function_tool
+async def gear_catalogue(ctx: RunContextWrapper[ChatContext], search: str) -> str:
+    """Material disponible en la tienda de la escuela.
+
+    Args:
+        search: Palabra a buscar en el nombre del producto (vacío para ver los más recientes).
+    """
+    return await _query(ctx, lambda user_id: _catalogue(search.strip()[:50]))
+
+
+TOOLS = [recent_sessions, skills_in_progress, goals, my_gear, gear_catalogue]
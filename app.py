@@ -1,21 +1,37 @@
 import os
 import sqlite3
 import json
+import base64
 import re
-from datetime import datetime
+from datetime import datetime, date as date_type, timedelta, timezone
 import requests
 import functools
+import hashlib
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, g, render_template, request, redirect, url_for, flash, session, jsonify, Blueprint
+from flask import Flask, g, render_template, request, redirect, url_for, flash, session, jsonify, Blueprint, make_response
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from flask.cli import AppGroup
 from werkzeug.utils import secure_filename
 # from chatbot import ask_wingfoil_ai # Old chatbot
 from agent import agent_bp # New agent-based chatbot
-from flask_sqlalchemy import SQLAlchemy
-from models import db, SessionImage, Session, User, Skill, Goal, Level, LearningMaterial, Product
-import boto3
+from weather import get_weather, best_spots, resolve_spot
+import storage
+import media
+import outbound
+import youtube
+import fragment_cache
+import catalogue
+from instrumentation import Instrumentation
+from query_guard import QueryGuard, query_budget
+import db_pool
 from botocore.exceptions import BotoCoreError, ClientError
+from flask_sqlalchemy import SQLAlchemy
+from models import db, SessionImage, Session, User, Skill, Goal, Level, LearningMaterial, Product, ProductImage, TrainingSummary, SessionSkill, UserSkill
 from uuid import uuid4
 from flask_migrate import Migrate
+from sqlalchemy import and_, or_, func, case, cast
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -32,14 +48,25 @@ app.config['S3_KEY']    = os.environ.get('S3_KEY')    # AWS Access Key ID
 app.config['S3_SECRET'] = os.environ.get('S3_SECRET') # AWS Secret Access Key
 app.config['S3_REGION'] = os.environ.get('S3_REGION') # AWS Region
 app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET') # S3 Bucket Name
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL') # Local S3 stand-in (moto/MinIO), unset for AWS
+app.config['S3_DIRECT_UPLOADS'] = os.environ.get('S3_DIRECT_UPLOADS') == '1' # Browser uploads straight to S3 (bucket needs CORS)
 
 # Database URI for SQLAlchemy
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:///{app.config['DATABASE']}")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool size, overflow, pre-ping and recycle from DB_* env vars (see db_pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_pool.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
 # Initialize SQLAlchemy
 db.init_app(app)
 migrate = Migrate(app, db)
+# /health, and fresh connections in every forked worker (see db_pool.py)
+pool_monitor = db_pool.PoolMonitor(db, app)
+
+# Latency/SQL/template metrics at /metrics (see instrumentation.py)
+instrumentation = Instrumentation(app)
+# Flags N+1 queries and over-budget endpoints in debug mode and tests (see query_guard.py)
+query_guard = QueryGuard(app)
 
 # Add Jinja2 filters
 def nl2br(value):
@@ -54,29 +81,99 @@ def from_json(value):
         return json.loads(value)
     return {}
 
+def static_picture(filename, **kwargs):
+    """``picture`` for a file under static/, using its prebuilt derivatives."""
+    variants = media.static_variants(app.static_folder, filename, url_for)
+    return media.picture(url_for('static', filename=filename), variants, **kwargs)
+
 app.jinja_env.filters['nl2br'] = nl2br
 app.jinja_env.filters['from_json'] = from_json
+app.jinja_env.globals['picture'] = media.picture
+app.jinja_env.globals['static_picture'] = static_picture
 
-# S3 upload helper
+# `flask media static` builds derivatives of static/img (run before gunicorn starts)
+media_cli = AppGroup('media', help='Image derivative tools.')
+
+@media_cli.command('static')
+def build_static_media():
+    """Build WebP/thumbnail derivatives for static/img."""
+    built = media.build_static_derivatives(app.static_folder)
+    print(f"Built derivatives for {built} static image(s).")
+
+@media_cli.command('expire-pending')
+def expire_pending_media():
+    """Mark deferred session uploads that never finished as failed."""
+    expired = expire_pending_uploads()
+    db.session.commit()
+    print(f"Marked {expired} stale pending upload(s) as failed.")
+
+app.cli.add_command(media_cli)
+
+# `flask youtube enrich` fills in learning material titles/thumbnails in bulk
+youtube_cli = AppGroup('youtube', help='YouTube learning material tools.')
+
+@youtube_cli.command('enrich')
+@click.option('--refresh', is_flag=True, help='Fetch every linked video again, not just missing ones.')
+def enrich_learning_materials(refresh):
+    """Fetch oEmbed details for learning materials still missing them."""
+    video_ids = youtube.pending_video_ids(refresh=refresh)
+    fetched = youtube.enrich(video_ids, refresh=refresh)
+    print(f"{len(video_ids)} video(s) to enrich, {fetched} oEmbed lookup(s) made.")
+
+app.cli.add_command(youtube_cli)
+
+# S3 upload helpers (pooled client and upload threads live in storage.py)
 def upload_file_to_s3(file_obj, bucket):
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=app.config['S3_KEY'],
-        aws_secret_access_key=app.config['S3_SECRET'],
-        region_name=app.config.get('S3_REGION')
+    return storage.upload_file(file_obj, bucket)
+
+def add_session_images(session_id, files):
+    """Upload media for a session and add its SessionImage rows.
+
+    Returns ``(failed, jobs)``. Inline mode uploads the files concurrently
+    and ``failed`` lists the filenames that did not make it. In deferred mode
+    the rows are added as ``pending`` with their final URL and ``jobs`` must
+    be passed to ``start_session_uploads`` after the caller commits.
+    """
+    bucket = app.config['S3_BUCKET']
+    if storage.UPLOAD_MODE == 'deferred':
+        jobs = storage.defer_uploads(files, bucket)
+        images = [SessionImage(session_id=session_id, url=job.url, status='pending') for job in jobs]
+        db.session.add_all(images)
+        db.session.flush()
+        for job, image in zip(jobs, images):
+            job.row_id = image.id
+        return [], jobs
+    failed = []
+    for f, stored in zip(files, storage.upload_files(files, bucket)):
+        if stored:
+            db.session.add(SessionImage(session_id=session_id, url=stored.url, variants=stored.variants))
+        else:
+            failed.append(f.filename)
+    return failed, []
+
+def start_session_uploads(jobs):
+    if jobs:
+        storage.start_deferred(jobs, finish_session_upload)
+
+def finish_session_upload(job, ok):
+    db.session.query(SessionImage).filter_by(id=job.row_id).update(
+        {'status': 'ready' if ok else 'failed', 'variants': job.variants}
     )
-    filename = secure_filename(f"{uuid4().hex}_{file_obj.filename}")
-    try:
-        s3.upload_fileobj(
-            file_obj,
-            bucket,
-            filename,
-            ExtraArgs={"ContentType": file_obj.content_type}
-        )
-    except (BotoCoreError, ClientError) as e:
-        app.logger.error(f"S3 upload failed: {e}")
-        return None
-    return f"https://{bucket}.s3.{app.config.get('S3_REGION')}.amazonaws.com/{filename}"
+    db.session.commit()
+
+def expire_pending_uploads(session_id=None):
+    """Mark deferred uploads pending for longer than ``S3_PENDING_TIMEOUT`` as failed.
+
+    Their job died with the worker that held it (restart, deploy, OOM), so
+    they would otherwise stay pending forever. Returns how many were expired;
+    the caller commits.
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=storage.PENDING_UPLOAD_TIMEOUT)
+    query = db.session.query(SessionImage).filter(SessionImage.status == 'pending',
+                                                  SessionImage.created_at < cutoff)
+    if session_id is not None:
+        query = query.filter(SessionImage.session_id == session_id)
+    return query.update({'status': 'failed'}, synchronize_session='fetch')
 
 # Login required decorator
 def login_required(view):
@@ -179,17 +276,6 @@ def logout():
 def profile():
     user = db.session.query(User).filter_by(id=session['user_id']).first()
     all_skills = db.session.query(Skill).order_by(Skill.name).all()
-
-    # Parse stored skill lists
-    try:
-        skills_in_progress = json.loads(user.skills_in_progress) if user.skills_in_progress else []
-    except json.JSONDecodeError:
-        skills_in_progress = []
-
-    try:
-        skills_mastered = json.loads(user.skills_mastered) if user.skills_mastered else []
-    except json.JSONDecodeError:
-        skills_mastered = []
     
     if request.method == 'POST':
         if 'profile_picture' in request.files:
@@ -200,14 +286,18 @@ def profile():
                 if ext not in app.config['ALLOWED_EXTENSIONS']:
                     flash('Invalid image file type.', 'danger')
                     return redirect(url_for('profile.profile'))
-                upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(upload_path)
                 # Remove old profile picture if it exists
                 if user.profile_picture:
                     old_filepath = os.path.join(app.config['UPLOAD_FOLDER'], user.profile_picture)
                     if os.path.exists(old_filepath):
                         os.remove(old_filepath)
+                    media.remove_local_derivatives(old_filepath)
+                upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                file.save(upload_path)
                 user.profile_picture = filename
+                user.profile_picture_variants = media.save_local_derivatives(
+                    upload_path, url_for('static', filename=f'uploads/profile_pictures/{filename}')
+                ) if media.is_image(filename) else None
                 db.session.commit()
                 flash('Profile picture updated successfully', 'success')
                 return redirect(url_for('profile.profile'))
@@ -233,13 +323,13 @@ def profile():
             user.location = location
             user.wingfoiling_since = wingfoiling_since
             user.wingfoil_level_id = wingfoil_level_id
-            user.skills_in_progress = json.dumps([int(s) for s in skills_in_progress_sel]) if skills_in_progress_sel else json.dumps([])
-            user.skills_mastered = json.dumps([int(s) for s in skills_mastered_sel]) if skills_mastered_sel else json.dumps([])
+            set_user_skills(user, skills_in_progress_sel, skills_mastered_sel)
             db.session.commit()
             flash('Profile updated successfully', 'success')
             return redirect(url_for('profile.profile'))
     session_count = db.session.query(Session).filter_by(user_id=session['user_id']).count()
     levels = db.session.query(Level).order_by(Level.code).all()
+    skills_in_progress, skills_mastered = user_skill_lists(user.id)
 
     return render_template(
         'pages/auth/profile.html',
@@ -247,9 +337,208 @@ def profile():
         user=user,
         session_count=session_count,
         levels=levels,
-
+        all_skills=all_skills,
+        skills_in_progress=skills_in_progress,
+        skills_mastered=skills_mastered,
+        in_progress_ids=[sk['id'] for sk in skills_in_progress],
+        mastered_ids=[sk['id'] for sk in skills_mastered],
     )
 
+# Training summary helpers
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def update_training_summary(sess, sign):
+    """Add (sign=1) or remove (sign=-1) a session from its owner's TrainingSummary row.
+
+    Call with -1 before changing or deleting a session and with 1 after
+    creating or changing it. The update is a single atomic UPDATE so
+    concurrent requests for the same user do not lose counts.
+    """
+    key = {'user_id': sess.user_id, 'sport_type': sess.sport_type, 'location': sess.location or ''}
+    rating = _as_int(sess.rating)
+    minutes = (_as_int(sess.duration) or 0) * sign
+    rating_sum = (rating or 0) * sign
+    rated = (1 if rating is not None else 0) * sign
+    updated = db.session.query(TrainingSummary).filter_by(**key).update({
+        TrainingSummary.sessions: TrainingSummary.sessions + sign,
+        TrainingSummary.minutes: TrainingSummary.minutes + minutes,
+        TrainingSummary.rating_sum: TrainingSummary.rating_sum + rating_sum,
+        TrainingSummary.rated_sessions: TrainingSummary.rated_sessions + rated,
+    }, synchronize_session=False)
+    if not updated and sign > 0:
+        db.session.add(TrainingSummary(sessions=1, minutes=minutes, rating_sum=rating_sum,
+                                       rated_sessions=rated, **key))
+
+def training_summary_totals(user_id):
+    """Dashboard totals for a user from the summary table (one small query)."""
+    rows = db.session.query(TrainingSummary).filter_by(user_id=user_id).all()
+    locations = {}
+    for row in rows:
+        # Rows are decremented, not deleted, when sessions go; skip the emptied ones
+        if row.location and row.sessions > 0:
+            locations[row.location] = locations.get(row.location, 0) + row.sessions
+    rated = sum(r.rated_sessions for r in rows)
+    return {
+        'sessions': sum(r.sessions for r in rows),
+        'minutes': sum(r.minutes for r in rows),
+        'avg_rating': round(sum(r.rating_sum for r in rows) / rated, 1) if rated else None,
+        'top_location': max(locations, key=locations.get) if locations else None,
+        'rows': rows,
+    }
+
+def session_period(period):
+    """SQL expression labelling Session.date by ISO week (``2026-W01``) or month (``2026-01``).
+
+    Weeks run Monday to Sunday and belong to the ISO year of their Thursday,
+    so the labels and boundaries are the same on Postgres and SQLite.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        fmt = 'IYYY-"W"IW' if period == 'week' else 'YYYY-MM'
+        return func.to_char(Session.date, fmt)
+    if period != 'week':
+        return func.strftime('%Y-%m', Session.date)
+    # SQLite before 3.46 has no %G/%V: take the Thursday of the date's week,
+    # whose year is the ISO year and whose day of year gives the ISO week
+    thursday = func.date(Session.date, '-3 days', 'weekday 4')
+    week = (cast(func.strftime('%j', thursday), db.Integer) + 6) // 7
+    return func.printf('%s-W%02d', func.strftime('%Y', thursday), week)
+
+def parse_date(value):
+    """Parse a ``YYYY-MM-DD`` form/query value into a date, or None."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def session_date_window(args):
+    """``from``/``to`` query args as Session.date filters (inclusive).
+
+    Returns ``(filters, error)``; with the (user_id, date) index these are
+    range scans rather than full-table sorts.
+    """
+    filters = []
+    for key, op in (('from', Session.date.__ge__), ('to', Session.date.__le__)):
+        value = args.get(key)
+        if not value:
+            continue
+        parsed = parse_date(value)
+        if parsed is None:
+            return None, f"Invalid '{key}' date, expected YYYY-MM-DD"
+        filters.append(op(parsed))
+    return filters, None
+
+# Skill helpers
+def skill_ratings_from_form(form):
+    """Read practiced skills and their ratings from a session form.
+
+    Skills come as repeated ``skills`` fields (or a JSON list); ratings as
+    ``skill_rating_<id>`` fields or a ``skill_ratings`` JSON object.
+    Returns ``{skill_id: rating or None}`` for existing skills only.
+    """
+    ids = []
+    for value in form.getlist('skills'):
+        try:
+            parsed = json.loads(value)
+        except json.JSONDecodeError:
+            continue
+        ids.extend(parsed if isinstance(parsed, list) else [parsed])
+    try:
+        json_ratings = json.loads(form.get('skill_ratings') or '{}')
+    except json.JSONDecodeError:
+        json_ratings = {}
+    if not isinstance(json_ratings, dict):
+        json_ratings = {}
+    ratings = {}
+    for raw_id in ids:
+        skill_id = _as_int(raw_id)
+        if skill_id is None:
+            continue
+        rating = _as_int(form.get(f'skill_rating_{skill_id}'))
+        if rating is None:
+            rating = _as_int(json_ratings.get(str(skill_id)))
+        ratings[skill_id] = rating
+    if not ratings:
+        return {}
+    existing = {row[0] for row in db.session.query(Skill.id).filter(Skill.id.in_(list(ratings)))}
+    return {skill_id: rating for skill_id, rating in ratings.items() if skill_id in existing}
+
+def set_session_skills(sess, ratings):
+    """Make ``sess.skill_links`` match ``{skill_id: rating}``, updating rows in place."""
+    existing = {link.skill_id: link for link in sess.skill_links}
+    for skill_id, link in existing.items():
+        if skill_id not in ratings:
+            sess.skill_links.remove(link)
+    for skill_id, rating in ratings.items():
+        if skill_id in existing:
+            existing[skill_id].rating = rating
+        else:
+            sess.skill_links.append(SessionSkill(skill_id=skill_id, rating=rating))
+
+def session_skill_context(session_id):
+    """Template data for the skills practiced in a session.
+
+    Returns ``(skills, practiced_skill_ids, skill_ratings)``: skill dicts with
+    their rating, the ids as strings and a ``{str(id): rating}`` map.
+    """
+    rows = db.session.query(Skill, SessionSkill.rating).join(
+        SessionSkill, SessionSkill.skill_id == Skill.id
+    ).filter(SessionSkill.session_id == session_id).order_by(Skill.name).all()
+    skills = []
+    skill_ratings = {}
+    for skill_row, rating in rows:
+        skill = {'id': skill_row.id, 'name': skill_row.name, 'category': skill_row.category,
+                 'description': skill_row.description, 'rating': rating}
+        if rating is not None:
+            skill_ratings[str(skill_row.id)] = rating
+        skills.append(skill)
+    practiced_skill_ids = [str(skill['id']) for skill in skills]
+    return skills, practiced_skill_ids, skill_ratings
+
+def set_user_skills(user, in_progress_ids, mastered_ids):
+    """Replace a user's skill statuses; a skill in both lists counts as mastered."""
+    statuses = {}
+    for raw_id in in_progress_ids:
+        if _as_int(raw_id) is not None:
+            statuses[_as_int(raw_id)] = 'in_progress'
+    for raw_id in mastered_ids:
+        if _as_int(raw_id) is not None:
+            statuses[_as_int(raw_id)] = 'mastered'
+    if statuses:
+        existing_skills = {row[0] for row in db.session.query(Skill.id).filter(Skill.id.in_(list(statuses)))}
+        statuses = {k: v for k, v in statuses.items() if k in existing_skills}
+    current = {link.skill_id: link for link in user.skill_statuses}
+    for skill_id, link in current.items():
+        if skill_id not in statuses:
+            user.skill_statuses.remove(link)
+    for skill_id, status in statuses.items():
+        if skill_id in current:
+            current[skill_id].status = status
+        else:
+            user.skill_statuses.append(UserSkill(skill_id=skill_id, status=status))
+
+def user_skill_lists(user_id):
+    """Skills in progress and mastered, each with the user's average session rating."""
+    avg_ratings = db.session.query(
+        SessionSkill.skill_id.label('skill_id'), func.avg(SessionSkill.rating).label('avg')
+    ).join(Session, Session.id == SessionSkill.session_id).filter(
+        Session.user_id == user_id
+    ).group_by(SessionSkill.skill_id).subquery()
+    rows = db.session.query(Skill.id, Skill.name, Skill.category, UserSkill.status, avg_ratings.c.avg).join(
+        UserSkill, UserSkill.skill_id == Skill.id
+    ).outerjoin(avg_ratings, avg_ratings.c.skill_id == Skill.id).filter(
+        UserSkill.user_id == user_id
+    ).order_by(Skill.name).all()
+    in_progress, mastered = [], []
+    for skill_id, name, category, status, avg in rows:
+        entry = {'id': skill_id, 'name': name, 'category': category,
+                 'avg': round(float(avg), 1) if avg is not None else '-'}
+        (mastered if status == 'mastered' else in_progress).append(entry)
+    return in_progress, mastered
+
 # Training routes
 @training_bp.route('/', methods=['GET', 'POST'])
 @login_required
@@ -257,43 +546,180 @@ def stats():
     user_id = session.get('user_id')
     user = db.session.query(User).filter_by(id=user_id).first()
     if request.method == 'POST':
-        user.skills_in_progress = request.form.get('skills_in_progress', '')
-        user.skills_mastered = request.form.get('skills_mastered', '')
+        set_user_skills(user, request.form.getlist('skills_in_progress'), request.form.getlist('skills_mastered'))
         db.session.commit()
         flash('Skills updated successfully', 'success')
         return redirect(url_for('training.stats'))
-    sessions = db.session.query(Session).filter_by(user_id=user_id).order_by(Session.date.desc()).all()
+    # Dashboard totals come from the summary table; the session list itself
+    # is paged in by the page through api_sessions
+    totals = training_summary_totals(user_id)
     goals = db.session.query(Goal).filter_by(user_id=user_id).order_by(Goal.id.desc()).all()
     all_skills = db.session.query(Skill).order_by(Skill.name).all()
-    skills_in_progress = []
-    if user.skills_in_progress:
-        skills_in_progress = [s.strip() for s in user.skills_in_progress.split(',') if s.strip()]
-    skills_mastered = []
-    if user.skills_mastered:
-        skills_mastered = [s.strip() for s in user.skills_mastered.split(',') if s.strip()]
-    result = render_template('pages/training/stats.html', sessions=sessions, user=user, goals=goals,
+    skills_in_progress, skills_mastered = user_skill_lists(user_id)
+    result = render_template('pages/training/stats.html', user=user, goals=goals,
                              all_skills=all_skills, skills_in_progress=skills_in_progress,
-                             skills_mastered=skills_mastered)
+                             skills_mastered=skills_mastered,
+                             in_progress_ids=[sk['id'] for sk in skills_in_progress],
+                             mastered_ids=[sk['id'] for sk in skills_mastered], total_sessions=totals['sessions'],
+                             total_hours=round(totals['minutes'] / 60), top_location=totals['top_location'])
     return result
 
+# Columns the sessions API may return; id and date are always included
+# because the pagination cursor is built from them
+SESSION_API_FIELDS = {
+    'id', 'date', 'sport_type', 'duration', 'rating', 'location', 'notes',
+    'achievements', 'challenges', 'conditions', 'weather', 'wind_speed',
+    'equipment', 'water_conditions', 'instructor_feedback', 'student_feedback',
+}
+SESSION_API_DEFAULT_FIELDS = ['id', 'date', 'location', 'duration', 'conditions', 'achievements', 'challenges', 'notes']
+SESSION_API_MAX_LIMIT = 200
+
+def encode_cursor(date, session_id):
+    payload = json.dumps([date.isoformat(), session_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+def decode_cursor(cursor):
+    date, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return date_type.fromisoformat(date), int(session_id)
+
 @training_bp.route('/api/sessions', methods=['GET'])
 @login_required
 def api_sessions():
+    """Page through the user's sessions, newest first.
+
+    Keyset pagination on ``(date, id)``: pass the ``next_cursor`` of one page
+    as ``cursor`` to get the next. ``fields=date,duration`` limits the columns
+    selected, ``limit`` caps the page size, ``skill_id`` keeps only the
+    sessions where that skill was practiced and ``from``/``to`` restrict the
+    date window.
+    """
     user_id = session.get('user_id')
-    sessions_query = db.session.query(Session).filter_by(user_id=user_id).order_by(Session.date.desc()).all()
-    sessions_list = []
-    for sess in sessions_query:
-        sessions_list.append({
-            'id': sess.id,
-            'date': sess.date,
-            'location': sess.location,
-            'duration': sess.duration,
-            'conditions': sess.conditions,
-            'achievements': sess.achievements,
-            'challenges': sess.challenges,
-            'notes': sess.notes
-        })
-    return jsonify({'success': True, 'sessions': sessions_list})
+    limit = max(1, min(request.args.get('limit', 50, type=int), SESSION_API_MAX_LIMIT))
+
+    fields = request.args.get('fields')
+    if fields:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in SESSION_API_FIELDS]
+        if unknown:
+            return jsonify({'success': False, 'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    else:
+        fields = list(SESSION_API_DEFAULT_FIELDS)
+    for required in ('date', 'id'):
+        if required not in fields:
+            fields.insert(0, required)
+
+    window, error = session_date_window(request.args)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    query = db.session.query(*[getattr(Session, f) for f in fields]).filter(Session.user_id == user_id, *window)
+    skill_id = request.args.get('skill_id', type=int)
+    if skill_id:
+        query = query.join(SessionSkill, SessionSkill.session_id == Session.id).filter(SessionSkill.skill_id == skill_id)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_date, cursor_id = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        query = query.filter(or_(
+            Session.date < cursor_date,
+            and_(Session.date == cursor_date, Session.id < cursor_id)
+        ))
+    rows = query.order_by(Session.date.desc(), Session.id.desc()).limit(limit + 1).all()
+
+    sessions_list = [dict(zip(fields, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = sessions_list[-1]
+        next_cursor = encode_cursor(last['date'], last['id'])
+    for item in sessions_list:
+        item['date'] = item['date'].isoformat()
+    return jsonify({'success': True, 'sessions': sessions_list, 'next_cursor': next_cursor})
+
+@training_bp.route('/api/skills/<int:skill_id>/progress', methods=['GET'])
+@login_required
+def api_skill_progress(skill_id):
+    """Ratings the user gave a skill over time, oldest session first."""
+    user_id = session.get('user_id')
+    skill = db.session.query(Skill).filter_by(id=skill_id).first()
+    if not skill:
+        return jsonify({'success': False, 'error': 'Skill not found'}), 404
+    rows = db.session.query(Session.id, Session.date, SessionSkill.rating).join(
+        SessionSkill, SessionSkill.session_id == Session.id
+    ).filter(SessionSkill.skill_id == skill_id, Session.user_id == user_id).order_by(Session.date, Session.id).all()
+    return jsonify({
+        'success': True,
+        'skill': {'id': skill.id, 'name': skill.name, 'category': skill.category},
+        'progress': [{'session_id': sid, 'date': date.isoformat(), 'rating': rating} for sid, date, rating in rows],
+    })
+
+@training_bp.route('/api/stats', methods=['GET'])
+@login_required
+def api_stats():
+    """Aggregated training statistics for the logged-in user.
+
+    Totals, per-sport and per-location figures come from TrainingSummary;
+    the weekly and monthly series are GROUP BY queries over the user's
+    sessions in the last ``weeks``/``months`` periods, read as a range scan
+    on the (user_id, date) index.
+    """
+    user_id = session.get('user_id')
+    weeks = max(1, min(request.args.get('weeks', 12, type=int), 104))
+    months = max(1, min(request.args.get('months', 12, type=int), 60))
+    totals = training_summary_totals(user_id)
+
+    by_sport = {}
+    by_location = {}
+    for row in totals['rows']:
+        for bucket, label in ((by_sport, row.sport_type), (by_location, row.location or None)):
+            if label is None:
+                continue
+            entry = bucket.setdefault(label, {'sessions': 0, 'minutes': 0, 'rating_sum': 0, 'rated': 0})
+            entry['sessions'] += row.sessions
+            entry['minutes'] += row.minutes
+            entry['rating_sum'] += row.rating_sum
+            entry['rated'] += row.rated_sessions
+
+    def summarize(bucket, key):
+        return [{
+            key: label,
+            'sessions': e['sessions'],
+            'minutes': e['minutes'],
+            'avg_rating': round(e['rating_sum'] / e['rated'], 1) if e['rated'] else None,
+        } for label, e in sorted(bucket.items(), key=lambda item: item[1]['sessions'], reverse=True)
+            if e['sessions'] > 0]
+
+    today = date_type.today()
+    week_start = today - timedelta(days=today.weekday() + 7 * (weeks - 1))
+    month_index = today.year * 12 + today.month - 1 - (months - 1)
+    month_start = date_type(month_index // 12, month_index % 12 + 1, 1)
+
+    def series(period, since):
+        label = session_period(period).label('period')
+        rows = db.session.query(
+            label, func.count(Session.id), func.sum(Session.duration), func.avg(Session.rating)
+        ).filter(Session.user_id == user_id, Session.date >= since).group_by(label).order_by(label.desc()).all()
+        return [{
+            'period': p,
+            'sessions': count,
+            'minutes': int(minutes or 0),
+            'avg_rating': round(float(avg), 1) if avg is not None else None,
+        } for p, count, minutes, avg in reversed(rows)]
+
+    return jsonify({
+        'success': True,
+        'totals': {
+            'sessions': totals['sessions'],
+            'minutes': totals['minutes'],
+            'hours': round(totals['minutes'] / 60, 1),
+            'avg_rating': totals['avg_rating'],
+        },
+        'top_location': totals['top_location'],
+        'by_sport': summarize(by_sport, 'sport_type'),
+        'by_location': summarize(by_location, 'location'),
+        'by_week': series('week', week_start),
+        'by_month': series('month', month_start),
+    })
 
 @training_bp.route('/log', methods=['GET', 'POST'])
 @login_required
@@ -316,16 +742,11 @@ def log_session():
         instructor_feedback = request.form.get('instructor_feedback', '')
         student_feedback = request.form.get('student_feedback', '')
         
-        # Process skills
-        skills_json = request.form.get('skills', '[]')
-        try:
-            skills = json.loads(skills_json)
-        except json.JSONDecodeError:
-            skills = []
-        
-        skill_ratings = {}
+        # Process skills and their ratings
+        skill_ratings = skill_ratings_from_form(request.form)
         
         # Validate required fields
+        date = parse_date(date)
         if not date or not sport_type or not duration:
             if request.headers.get('Accept') == 'application/json':
                 return jsonify({'success': False, 'error': 'Date, sport type, and duration are required!'})
@@ -336,30 +757,28 @@ def log_session():
         new_session = Session(
             user_id=session.get('user_id'), date=date,
             sport_type=sport_type, duration=duration,
-            rating=rating, location=location, notes=notes,
-            skills=json.dumps(skills), skill_ratings=json.dumps(skill_ratings),
+            rating=_as_int(rating), location=location, notes=notes,
             achievements=achievements, challenges=challenges,
             conditions=conditions, weather=weather, wind_speed=wind_speed,
             equipment=equipment, water_conditions=water_conditions,
             instructor_feedback=instructor_feedback, student_feedback=student_feedback
         )
+        set_session_skills(new_session, skill_ratings)
         db.session.add(new_session)
+        update_training_summary(new_session, 1)
         db.session.commit()
         session_id = new_session.id
         
-        # Depuración: loggear archivos recibidos
-        print('Archivos recibidos:', request.files)
-        print('Lista de imágenes:', request.files.getlist('images'))
         # Handle images
-        for f in request.files.getlist('images'):
-            print('Procesando archivo:', f.filename)
-            if f and allowed_file(f.filename):
-                url = upload_file_to_s3(f, app.config['S3_BUCKET'])
-                print('URL subida:', url)
-                if url:
-                    img = SessionImage(session_id=session_id, url=url)
-                    db.session.add(img)
+        files = [f for f in request.files.getlist('images') if f and allowed_file(f.filename)]
+        failed, jobs = add_session_images(session_id, files)
+        attach_failed, attached = attach_form_uploads(session_id)
+        failed += attach_failed
         db.session.commit()
+        start_session_uploads(jobs)
+        derive_uploaded_media(attached)
+        for filename in failed:
+            app.logger.warning(f"Upload of {filename} for session {session_id} failed")
         
         if request.headers.get('Accept') == 'application/json':
             return jsonify({
@@ -394,38 +813,14 @@ def session_detail(session_id):
     if not session_data:
         flash('Session not found or you do not have permission to view it', 'danger')
         return redirect(url_for('training.stats'))
+
+    cutoff = datetime.utcnow() - timedelta(minutes=storage.PENDING_UPLOAD_TIMEOUT)
+    if any(img.status == 'pending' and img.created_at and img.created_at < cutoff for img in session_data.images):
+        expire_pending_uploads(session_data.id)
+        db.session.commit()
     
     # Get skills practiced in this session
-    practiced_skill_ids = []
-    skill_ratings = {}
-    
-    if session_data.skills:
-        try:
-            practiced_skill_ids = json.loads(session_data.skills)
-            # Convert all IDs to strings for consistent comparison
-            practiced_skill_ids = [str(skill_id) for skill_id in practiced_skill_ids]
-        except:
-            practiced_skill_ids = []
-    
-    if session_data.skill_ratings:
-        try:
-            skill_ratings = json.loads(session_data.skill_ratings)
-        except:
-            skill_ratings = {}
-    
-    # Initialize skills as an empty list
-    skills = []
-    
-    if practiced_skill_ids and len(practiced_skill_ids) > 0:
-        skills_rows = db.session.query(Skill).filter(Skill.id.in_(practiced_skill_ids)).all()
-        
-        # Convert to list of dicts
-        for skill_row in skills_rows:
-            skill = skill_row.__dict__
-            skill_id = str(skill['id'])
-            if skill_id in skill_ratings:
-                skill['rating'] = skill_ratings[skill_id]
-            skills.append(skill)
+    skills, practiced_skill_ids, skill_ratings = session_skill_context(session_data.id)
     
     # Get all skills for the edit form
     all_skills = db.session.query(Skill).order_by(Skill.category, Skill.name).all()
@@ -467,10 +862,10 @@ def update_session():
     student_feedback = request.form.get('student_feedback', '')
     
     # Get skills and skill ratings
-    skills = request.form.getlist('skills')
-    skill_ratings = request.form.get('skill_ratings', '{}')
+    skill_ratings = skill_ratings_from_form(request.form)
     
     # Validate required fields
+    date = parse_date(date)
     if not all([session_id, date, sport_type, duration]):
         flash('Please fill in all required fields', 'danger')
         return redirect(url_for('training.session_detail', session_id=session_id))
@@ -482,14 +877,14 @@ def update_session():
         return redirect(url_for('training.stats'))
     
     # Update session in database
+    update_training_summary(session_data, -1)
     session_data.date = date
     session_data.sport_type = sport_type
     session_data.duration = duration
-    session_data.rating = rating
+    session_data.rating = _as_int(rating)
     session_data.location = location
     session_data.notes = notes
-    session_data.skills = json.dumps(skills)
-    session_data.skill_ratings = skill_ratings
+    set_session_skills(session_data, skill_ratings)
     session_data.achievements = achievements
     session_data.challenges = challenges
     session_data.conditions = conditions
@@ -499,10 +894,23 @@ def update_session():
     session_data.water_conditions = water_conditions
     session_data.instructor_feedback = instructor_feedback
     session_data.student_feedback = student_feedback
+    update_training_summary(session_data, 1)
     db.session.commit()
     flash('Session updated successfully', 'success')
     return redirect(url_for('training.session_detail', session_id=session_id))
 
+@training_bp.route('/session/delete', methods=['POST'])
+@login_required
+def delete_session():
+    session_id = request.form.get('session_id')
+    session_data = db.session.query(Session).filter_by(id=session_id, user_id=session['user_id']).first()
+    if not session_data:
+        return jsonify({'success': False, 'error': 'Session not found or you do not have permission to delete it'}), 404
+    update_training_summary(session_data, -1)
+    db.session.delete(session_data)
+    db.session.commit()
+    return jsonify({'success': True})
+
 # Route to add a new goal
 @training_bp.route('/goals/add', methods=['POST'])
 @login_required
@@ -549,11 +957,102 @@ def skills_index():
 def levels_index():
     return render_template('pages/levels/index.html')
 
+# Product markup only changes when an admin edits the catalogue, so the
+# rendered grids are cached per catalogue version (see fragment_cache.py);
+# every write to products or their images must call catalogue.changed()
+_template_digests = {}
+
+def template_digest(*names):
+    """Digest of the templates' source, so cached markup follows template changes."""
+    digest = None if app.debug else _template_digests.get(names)
+    if digest is None:
+        sha = hashlib.sha256()
+        for name in names:
+            sha.update(app.jinja_env.loader.get_source(app.jinja_env, name)[0].encode())
+        digest = _template_digests[names] = sha.hexdigest()[:16]
+    return digest
+
+def cached_fragment(part, current, render, *templates):
+    """Markup for fragment ``part`` at catalogue version ``current``, rendered by ``render`` on a miss."""
+    return Markup(fragment_cache.render(catalogue.CATALOGUE, current, part, render, salt=template_digest(*templates)))
+
+def catalogue_validators(current, *templates):
+    """ETag and Last-Modified for a response built from the catalogue, ``templates`` and the URL.
+
+    ``(None, None)`` when a pending flash message or an unavailable cache
+    makes the response unpredictable.
+    """
+    if current is None or '_flashes' in session:
+        return None, None
+    # Besides the catalogue, pages only vary with who is logged in (navbar)
+    identity = f"{session.get('user_id')}:{session.get('name')}:{session.get('username')}"
+    key = f'{current[0]}:{template_digest(*templates)}:{identity}:{request.full_path}'
+    return hashlib.sha256(key.encode()).hexdigest()[:32], datetime.fromtimestamp(int(current[1]), timezone.utc)
+
+def conditional_response(etag, last_modified, build):
+    """304 if the client's copy matches ``etag``/``last_modified``, otherwise ``build()``."""
+    if etag and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    if etag:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+    # Browsers and proxies keep the page but revalidate it on every visit
+    response.cache_control.no_cache = True
+    if session.get('user_id'):
+        response.cache_control.private = True
+    return response
+
 # Gear page route
 @main_bp.route('/gear')
+@query_budget(4)
 def gear():
-    products = db.session.query(Product).filter_by(is_available=True).order_by(Product.created_at.desc()).all()
-    return render_template('pages/gear.html', title='Gear', products=products)
+    filters, error = catalogue.parse_filters(request.args)
+    if error:
+        flash(error, 'warning')
+        return redirect(url_for('main.gear'))
+    current = catalogue.version()
+    etag, last_modified = catalogue_validators(
+        current, 'base.html', 'pages/gear.html', 'pages/gear_grid.html', 'pages/gear_cards.html')
+
+    def render_grid():
+        products, has_more = catalogue.page(filters)
+        return render_template('pages/gear_grid.html', products=products, has_more=has_more,
+                               filters=filters, categories=catalogue.categories())
+
+    def render():
+        # Only the plain first page is cached; filtered and later pages are rendered as asked
+        if request.args:
+            grid = Markup(render_grid())
+        else:
+            grid = cached_fragment('gear', current, render_grid, 'pages/gear_grid.html', 'pages/gear_cards.html')
+        return render_template('pages/gear.html', title='Gear', product_grid=grid)
+    return conditional_response(etag, last_modified, render)
+
+@main_bp.route('/api/catalogue')
+@query_budget(3)
+def api_catalogue():
+    """Available products for the gear page, one page at a time.
+
+    Takes the same ``category``, ``min_price``, ``max_price``, ``page`` and
+    ``limit`` args as /gear; ``html`` has the rendered cards to append.
+    """
+    filters, error = catalogue.parse_filters(request.args)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    etag, last_modified = catalogue_validators(catalogue.version(), 'pages/gear_cards.html')
+
+    def render():
+        products, has_more = catalogue.page(filters)
+        return jsonify({
+            'success': True,
+            'page': filters['page'],
+            'next_page': filters['page'] + 1 if has_more else None,
+            'products': [catalogue.as_dict(p) for p in products],
+            'html': render_template('pages/gear_cards.html', products=products),
+        })
+    return conditional_response(etag, last_modified, render)
 
 # Community routes
 @community_bp.route('/')
@@ -563,75 +1062,196 @@ def index():
 # Home page route
 @main_bp.route('/')
 def index():
-    # Fetch Tarifa weather via Met.no free API
-    lat, lon = 36.0111, -5.6077
-    
-    # Define a mapping from Met.no symbol codes to Bootstrap Icons
-    # (Add more mappings as needed based on https://api.met.no/weatherapi/weathericon/2.0/documentation)
-    symbol_to_icon = {
-        'clearsky_day': 'bi-sun-fill',
-        'clearsky_night': 'bi-moon-stars-fill',
-        'fair_day': 'bi-cloud-sun-fill',
-        'fair_night': 'bi-cloud-moon-fill',
-        'partlycloudy_day': 'bi-cloud-sun-fill',
-        'partlycloudy_night': 'bi-cloud-moon-fill',
-        'cloudy': 'bi-cloud-fill',
-        'rain': 'bi-cloud-rain-fill',
-        'lightrain': 'bi-cloud-drizzle-fill',
-        'heavyrain': 'bi-cloud-rain-heavy-fill',
-        'sleet': 'bi-cloud-sleet-fill',
-        'snow': 'bi-cloud-snow-fill',
-        'fog': 'bi-cloud-fog2-fill',
-        # Add more complex conditions if desired
-        'rainshowers_day': 'bi-cloud-rain-fill',
-        'rainshowers_night': 'bi-cloud-rain-fill',
-        'snowshowers_day': 'bi-cloud-snow-fill',
-        'snowshowers_night': 'bi-cloud-snow-fill',
-    }
-    default_icon = 'bi-thermometer-half' # Fallback icon
+    # Tarifa weather comes from the shared cache; the network is only hit by
+    # the background refresher in weather.py
+    weather, fetched_at = get_weather()
+    # When the forecast was fetched, not the time of this request
+    updated_at = (fetched_at or datetime.now()).strftime('%H:%M')
+    ranking = best_spots(user_spot_slugs(session.get('user_id')), hours=48)
+    best_spot = ranking[0] if ranking and ranking[0]['window'] else None
+    # Up to 4 available products, rendered once per catalogue version
+    def render_featured():
+        return render_template('pages/gear_featured.html', products=catalogue.featured(4))
+    featured_products = cached_fragment('featured', catalogue.version(), render_featured,
+                                        'pages/gear_featured.html')
+    response = make_response(render_template(
+        'pages/index_updated.html', title='Home',
+        weather=weather, updated_at=updated_at,
+        featured_products=featured_products, best_spot=best_spot
+    ))
+    # Weather and the best spot change on their own, so the ETag is the body's hash
+    response.add_etag()
+    response.cache_control.no_cache = True
+    if session.get('user_id'):
+        response.cache_control.private = True
+    return response.make_conditional(request)
 
-    # Default weather fallback
-    weather = {
-        'current': {'icon': default_icon, 'temp': '--', 'description': 'Unavailable'},
-        'wind':    {'icon': 'bi-wind',  'speed': '--', 'direction': '--'},
-        'water':   {'icon': 'bi-water', 'temp': '--', 'wave_height': '--'}
-    }
+def user_spot_slugs(user_id):
+    """Forecast spots tied to a user's profile location and logged sessions."""
+    if not user_id:
+        return None
+    locations = [row[0] for row in db.session.query(Session.location).filter_by(user_id=user_id).distinct()]
+    user = db.session.query(User).filter_by(id=user_id).first()
+    if user and user.location:
+        locations.append(user.location)
+    slugs = {resolve_spot(loc) for loc in locations}
+    slugs.discard(None)
+    return sorted(slugs) or None
+
+@main_bp.route('/api/forecast/best-spot')
+def api_best_spot():
+    """Rank spots by their best rideable wind window in the next hours.
+
+    ``?spots=tarifa,bolonia`` restricts the ranking; otherwise a logged-in
+    user gets the spots from their profile and sessions, and everyone else
+    gets all known spots.
+    """
+    hours = min(request.args.get('hours', 48, type=int), 72)
+    requested = request.args.get('spots')
+    if requested:
+        slugs = [s.strip() for s in requested.split(',') if s.strip()]
+    else:
+        slugs = user_spot_slugs(session.get('user_id'))
+    ranking = best_spots(slugs, hours=hours)
+    best = ranking[0] if ranking and ranking[0]['window'] else None
+    return jsonify({'success': True, 'hours': hours, 'best': best, 'spots': ranking})
+# Direct-to-S3 uploads (see storage.py). The browser asks for a presigned
+# upload, sends the bytes to S3 itself and then calls /complete, which is the
+# only point where a SessionImage/ProductImage row is written.
+def attach_uploaded_media(key, target, target_id):
+    """Create the row for an object uploaded directly to S3.
+
+    Returns ``(row, error)``; the key must sit under the current user's
+    prefix and the target must be theirs (or any, for admins).
+    """
+    user_id = session['user_id']
+    bucket = app.config['S3_BUCKET']
+    if not storage.owns_key(user_id, key):
+        return None, 'Unknown upload'
+    if target == 'session':
+        query = db.session.query(Session).filter_by(id=target_id)
+        if not session.get('is_admin'):
+            query = query.filter_by(user_id=user_id)
+        if query.first() is None:
+            return None, 'Session not found'
+    elif target == 'product':
+        if not session.get('is_admin'):
+            return None, 'Only admins can add product images'
+        if db.session.query(Product).filter_by(id=target_id).first() is None:
+            return None, 'Product not found'
+    else:
+        return None, "target must be 'session' or 'product'"
+    url = storage.object_url(bucket, key)
+    # Keys are unique per presign, so a second row could only come from a repeated completion
+    if db.session.query(SessionImage.id).filter_by(url=url).first() is not None or \
+            db.session.query(ProductImage.id).filter_by(image_url=url).first() is not None:
+        return None, 'Upload already attached'
+    if storage.stat_object(bucket, key) is None:
+        return None, 'Upload not found in storage'
+    if target == 'session':
+        row = SessionImage(session_id=target_id, url=url)
+    else:
+        row = ProductImage(product_id=target_id, image_url=url)
+    db.session.add(row)
+    return row, None
+
+def attach_form_uploads(session_id):
+    """Attach the ``uploaded_keys`` a direct-upload form posted.
+
+    Returns ``(failed, rows)``; pass ``rows`` to ``derive_uploaded_media``
+    once they are committed.
+    """
+    failed, rows = [], []
+    for key in request.form.getlist('uploaded_keys'):
+        row, error = attach_uploaded_media(key, 'session', session_id)
+        if error:
+            app.logger.warning(f"Direct upload {key} not attached to session {session_id}: {error}")
+            failed.append(key.rsplit('/', 1)[-1])
+        else:
+            rows.append((row, key))
+    return failed, rows
+
+def derive_uploaded_media(rows):
+    """Build image derivatives for committed direct uploads in the background."""
+    for row, key in rows:
+        model, row_id = type(row), row.id
+
+        def record(variants, model=model, row_id=row_id):
+            db.session.query(model).filter_by(id=row_id).update({'variants': variants})
+            db.session.commit()
+            if model is ProductImage:
+                catalogue.changed()
+
+        storage.start_derivatives(app.config['S3_BUCKET'], key, record)
+
+@main_bp.route('/api/uploads/presign', methods=['POST'])
+@login_required
+def api_presign_upload():
+    """Presigned POST (or multipart PUTs) for a file of ``size`` bytes."""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    content_type = data.get('content_type') or 'application/octet-stream'
+    size = _as_int(data.get('size'))
+    if not app.config.get('S3_BUCKET'):
+        return jsonify({'success': False, 'error': 'Direct uploads are not configured'}), 503
+    if not allowed_file(filename):
+        return jsonify({'success': False, 'error': 'File type not allowed'}), 400
+    if not size or size < 0 or size > storage.MAX_DIRECT_UPLOAD_BYTES:
+        return jsonify({'success': False, 'error': 'Invalid file size'}), 400
+    key = storage.direct_upload_key(session['user_id'], filename)
     try:
-        headers = {'User-Agent': 'WingmanApp/1.0 (contact@wingman.example)'}
-        resp = requests.get(
-            'https://api.met.no/weatherapi/locationforecast/2.0/compact',
-            params={'lat': lat, 'lon': lon}, headers=headers, timeout=5
-        )
-        data = resp.json()
-        times = data.get('properties', {}).get('timeseries', [])
-        if times:
-            inst = times[0]['data']['instant']['details']
-            next_hour_summary = times[0]['data'].get('next_1_hours', {}).get('summary', {})
-            symbol_code = next_hour_summary.get('symbol_code')
-            
-            # Determine description and icon
-            # Simplified description for now, could map symbol_code to text later
-            description = symbol_code.replace('_', ' ').capitalize() if symbol_code else 'Current Conditions'
-            icon_class = symbol_to_icon.get(symbol_code, default_icon)
-            
-            temp = round(inst.get('air_temperature', 0))
-            ws = round(inst.get('wind_speed', 0) * 3.6)
-            wd = round(inst.get('wind_from_direction', 0))
-            weather = {
-                'current': {'icon': icon_class, 'temp': temp, 'description': description},
-                'wind':    {'icon': 'bi-wind', 'speed': ws, 'direction': f"{wd}°"},
-                'water':   {'icon': 'bi-water', 'temp': '--', 'wave_height': '--'}
-            }
-    except Exception as e:
-        app.logger.error(f"Weather fetch error: {e}")
-    current_time = datetime.now().strftime('%H:%M')
-    # Fetch up to 4 available products for the home page
-    featured_products = Product.query.filter_by(is_available=True).order_by(Product.created_at.desc()).limit(4).all()
-    return render_template(
-        'pages/index_updated.html', title='Home',
-        weather=weather, current_time=current_time,
-        featured_products=featured_products
-    )
+        upload = storage.presign_upload(app.config['S3_BUCKET'], key, content_type, size)
+    except (BotoCoreError, ClientError) as e:
+        app.logger.error(f"Presigning upload for {filename} failed: {e}")
+        return jsonify({'success': False, 'error': 'Could not start upload'}), 502
+    return jsonify({'success': True, **upload})
+
+@main_bp.route('/api/uploads/complete', methods=['POST'])
+@login_required
+def api_complete_upload():
+    """Finish a direct upload and optionally attach it to a session or product.
+
+    Multipart uploads send ``upload_id`` and ``parts`` to be completed first.
+    Without ``target`` the upload is only verified, for forms that post the
+    key along with a new session.
+    """
+    data = request.get_json(silent=True) or {}
+    key = data.get('key') or ''
+    bucket = app.config['S3_BUCKET']
+    if not storage.owns_key(session['user_id'], key):
+        return jsonify({'success': False, 'error': 'Unknown upload'}), 400
+    if data.get('upload_id'):
+        try:
+            storage.complete_multipart(bucket, key, data['upload_id'], data.get('parts') or [])
+        except (BotoCoreError, ClientError, KeyError, TypeError, ValueError) as e:
+            app.logger.error(f"Completing multipart upload {key} failed: {e}")
+            return jsonify({'success': False, 'error': 'Could not complete upload'}), 400
+    if not data.get('target'):
+        if storage.stat_object(bucket, key) is None:
+            return jsonify({'success': False, 'error': 'Upload not found in storage'}), 400
+        return jsonify({'success': True, 'key': key, 'url': storage.object_url(bucket, key)})
+    row, error = attach_uploaded_media(key, data['target'], _as_int(data.get('target_id')))
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    db.session.commit()
+    if data['target'] == 'product':
+        catalogue.changed()
+    derive_uploaded_media([(row, key)])
+    return jsonify({'success': True, 'key': key, 'id': row.id, 'url': storage.object_url(bucket, key)})
+
+@main_bp.route('/api/uploads/abort', methods=['POST'])
+@login_required
+def api_abort_upload():
+    data = request.get_json(silent=True) or {}
+    key = data.get('key') or ''
+    if not storage.owns_key(session['user_id'], key) or not data.get('upload_id'):
+        return jsonify({'success': False, 'error': 'Unknown upload'}), 400
+    try:
+        storage.abort_multipart(app.config['S3_BUCKET'], key, data['upload_id'])
+    except (BotoCoreError, ClientError) as e:
+        app.logger.error(f"Aborting multipart upload {key} failed: {e}")
+    return jsonify({'success': True})
+
 app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(main_bp)
 app.register_blueprint(training_bp, url_prefix='/training')
@@ -672,48 +1292,110 @@ def admin_index():
 
 @admin_bp.route('/dashboard')
 @login_required
+@query_budget(5)
 def admin_dashboard():
     if not session.get('is_admin'):
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
-    users = db.session.query(User).all()
-    users_data = []
-    for u in users:
-        sess_list = db.session.query(Session).filter_by(user_id=u.id).all()
-        total_sessions = len(sess_list)
-        instr_comments = sum(1 for s in sess_list if s.instructor_feedback)
-        stud_comments = sum(1 for s in sess_list if s.student_feedback)
-        users_data.append({'user': u, 'total_sessions': total_sessions, 'instructor_comments': instr_comments, 'student_comments': stud_comments})
-    return render_template('pages/admin/dashboard.html', users_data=users_data)
+    # One grouped aggregate per page instead of a Session query per user
+    def non_empty(column):
+        return func.sum(case((and_(column.isnot(None), column != ''), 1), else_=0))
+
+    counts = db.session.query(
+        Session.user_id.label('user_id'),
+        func.count(Session.id).label('total_sessions'),
+        non_empty(Session.instructor_feedback).label('instructor_comments'),
+        non_empty(Session.student_feedback).label('student_comments'),
+    ).group_by(Session.user_id).subquery()
+    total_sessions = func.coalesce(counts.c.total_sessions, 0)
+    instructor_comments = func.coalesce(counts.c.instructor_comments, 0)
+    student_comments = func.coalesce(counts.c.student_comments, 0)
+
+    query = db.session.query(User, total_sessions, instructor_comments, student_comments).outerjoin(
+        counts, counts.c.user_id == User.id
+    )
+    q = request.args.get('q', '').strip()
+    if q:
+        pattern = f"%{q}%"
+        query = query.filter(or_(User.username.ilike(pattern), User.name.ilike(pattern), User.email.ilike(pattern)))
+
+    sort_columns = {
+        'username': User.username,
+        'name': User.name,
+        'email': User.email,
+        'sessions': total_sessions,
+        'instructor_comments': instructor_comments,
+        'student_comments': student_comments,
+    }
+    sort = request.args.get('sort', 'username')
+    if sort not in sort_columns:
+        sort = 'username'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    sort_column = sort_columns[sort].desc() if order == 'desc' else sort_columns[sort].asc()
+
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    total_users = query.order_by(None).count()
+    pages = max(1, -(-total_users // per_page))
+    page = max(1, min(request.args.get('page', 1, type=int), pages))
+    rows = query.order_by(sort_column, User.id).offset((page - 1) * per_page).limit(per_page).all()
+    users_data = [
+        {'user': u, 'total_sessions': sessions_count, 'instructor_comments': instr, 'student_comments': stud}
+        for u, sessions_count, instr, stud in rows
+    ]
+    return render_template('pages/admin/dashboard.html', users_data=users_data, q=q, sort=sort, order=order,
+                           page=page, pages=pages, per_page=per_page, total_users=total_users)
+
+@admin_bp.route('/api/upstreams')
+@login_required
+def admin_upstreams():
+    """Rate limit, coalescing and circuit breaker counters for outbound APIs (this worker only)."""
+    if not session.get('is_admin'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return jsonify({'success': True, 'pid': os.getpid(), 'upstreams': outbound.metrics()})
+
+@admin_bp.route('/api/db-pool')
+@login_required
+def admin_db_pool():
+    """Connection pool usage and checkout waits (this worker only)."""
+    if not session.get('is_admin'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return jsonify({'success': True, 'pid': os.getpid(), 'pool': db_pool.pool_stats(db.engine)})
 
 @admin_bp.route('/sessions', defaults={'user_id': None})
 @admin_bp.route('/sessions/user/<int:user_id>')
 @login_required
+@query_budget(5)
 def admin_sessions(user_id):
     if not session.get('is_admin'):
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
+    window, error = session_date_window(request.args)
+    if error:
+        flash(error, 'warning')
+        window = []
+    query = db.session.query(Session).options(db.joinedload(Session.user)).filter(*window)
     if user_id:
-        sessions = db.session.query(Session).filter_by(user_id=user_id).all()
-    else:
-        sessions = db.session.query(Session).all()
-    return render_template('pages/admin/sessions.html', sessions=sessions)
+        query = query.filter(Session.user_id == user_id)
+    sessions = query.order_by(Session.date.desc(), Session.id.desc()).all()
+    return render_template('pages/admin/sessions.html', sessions=sessions, user_id=user_id,
+                           date_from=request.args.get('from', ''), date_to=request.args.get('to', ''))
 
 from sqlalchemy.orm import joinedload
 
 @admin_bp.route('/session/<int:session_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(15)
 def admin_session_detail(session_id):
     # Ensure user is admin
     if not session.get('is_admin'):
         flash('Access denied: Admins only.', 'danger')
         return redirect(url_for('main.index'))
 
-    session_data = db.session.query(Session).options(
+    # learning_materials is a dynamic relationship, queried by the template
+    session_data = db.session.get(Session, session_id, options=[
         db.joinedload(Session.user),
         db.joinedload(Session.images),
-        db.joinedload(Session.learning_materials) # Load learning materials
-    ).get(session_id)
+    ])
 
     if not session_data:
         flash('Session not found.', 'danger')
@@ -721,71 +1403,60 @@ def admin_session_detail(session_id):
 
     if request.method == 'POST':
         # Update session fields from form data
+        update_training_summary(session_data, -1)
         session_data.achievements = request.form.get('achievements', session_data.achievements)
         session_data.challenges = request.form.get('challenges', session_data.challenges)
         session_data.conditions = request.form.get('conditions', session_data.conditions)
-        session_data.date = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date() if request.form.get('date') else session_data.date
+        session_data.date = parse_date(request.form.get('date')) or session_data.date
         session_data.sport_type = request.form.get('sport_type', session_data.sport_type)
         session_data.duration = int(request.form.get('duration')) if request.form.get('duration') else session_data.duration
         session_data.rating = int(request.form.get('rating')) if request.form.get('rating') else session_data.rating
         session_data.location = request.form.get('location', session_data.location)
         session_data.notes = request.form.get('notes', session_data.notes)
+        update_training_summary(session_data, 1)
 
         # Handle image uploads
-        if 'images' in request.files:
-            for f in request.files.getlist('images'):
-                if f and f.filename != '' and allowed_file(f.filename):
-                    try:
-                        url = upload_file_to_s3(f, app.config['S3_BUCKET'])
-                        if url:
-                            new_image = SessionImage(session_id=session_data.id, url=url)
-                            db.session.add(new_image)
-                        else:
-                            flash(f'Failed to upload {f.filename}.', 'warning')
-                    except Exception as e:
-                        app.logger.error(f"Error uploading file {f.filename}: {e}")
-                        flash(f'An error occurred while uploading {f.filename}.', 'danger')
-                elif f and f.filename != '': # File exists but is not allowed
-                    flash(f'File type not allowed for {f.filename}.', 'warning')
-
-        # Handle new Learning Material (YouTube link)
+        upload_jobs, attached = [], []
+        files = []
+        for f in request.files.getlist('images'):
+            if f and f.filename != '' and allowed_file(f.filename):
+                files.append(f)
+            elif f and f.filename != '': # File exists but is not allowed
+                flash(f'File type not allowed for {f.filename}.', 'warning')
+        try:
+            failed, upload_jobs = add_session_images(session_data.id, files)
+            # Files the browser already sent straight to S3
+            attach_failed, attached = attach_form_uploads(session_data.id)
+            failed += attach_failed
+            for filename in failed:
+                flash(f'Failed to upload {filename}.', 'warning')
+        except Exception as e:
+            app.logger.error(f"Error uploading files for session {session_data.id}: {e}")
+            flash('An error occurred while uploading the files.', 'danger')
+
+        # Handle new Learning Material (YouTube link); details are filled in
+        # from the oEmbed cache or in the background, never during the request
         new_youtube_url = request.form.get('new_learning_material_url')
+        new_material = None
         if new_youtube_url:
-            # Basic validation (could be more robust)
-            if 'youtube.com/watch?v=' in new_youtube_url or 'youtu.be/' in new_youtube_url:
-                try:
-                    # Use YouTube oEmbed to get title and thumbnail
-                    oembed_url = f"https://www.youtube.com/oembed?url={new_youtube_url}&format=json"
-                    response = requests.get(oembed_url)
-                    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                    data = response.json()
-                    title = data.get('title')
-                    thumbnail_url = data.get('thumbnail_url')
-
-                    if title and thumbnail_url:
-                        new_material = LearningMaterial(
-                            session_id=session_data.id,
-                            url=new_youtube_url,
-                            title=title,
-                            thumbnail_url=thumbnail_url
-                        )
-                        db.session.add(new_material)
-                    else:
-                        flash('Could not fetch YouTube video details.', 'warning')
-                except requests.exceptions.RequestException as e:
-                    app.logger.error(f"Error fetching YouTube oEmbed for {new_youtube_url}: {e}")
-                    flash('Error fetching YouTube video details. Please check the URL.', 'danger')
-                except Exception as e:
-                    app.logger.error(f"Error processing YouTube link {new_youtube_url}: {e}")
-                    flash('An unexpected error occurred while adding the YouTube link.', 'danger')
+            new_material = youtube.new_material(session_data.id, new_youtube_url)
+            if new_material:
+                db.session.add(new_material)
             else:
                 flash('Invalid YouTube URL provided.', 'warning')
 
-        # Note: Handling updates/deletions for skills and goals would require more complex logic here.
-        # Focusing on core session details and image uploads for now.
+        # Skills practiced; the edit form always posts skill_ratings via JS
+        if 'skill_ratings' in request.form:
+            set_session_skills(session_data, skill_ratings_from_form(request.form))
+
+        # Note: Handling updates/deletions for goals would require more complex logic here.
 
         try:
             db.session.commit()
+            start_session_uploads(upload_jobs)
+            derive_uploaded_media(attached)
+            if new_material and new_material.title is None:
+                youtube.start_enrichment([new_material.video_id])
             flash('Session updated successfully!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -795,40 +1466,13 @@ def admin_session_detail(session_id):
         return redirect(url_for('admin.admin_session_detail', session_id=session_id))
 
     # GET request - Prepare data for the template (existing logic)
-    session_skills_data = {}
-    practiced_skill_ids = []
-    skill_ratings = {}
-    if session_data.skills:
-        try:
-            practiced_skill_ids = json.loads(session_data.skills)
-            practiced_skill_ids = [str(skill_id) for skill_id in practiced_skill_ids]
-        except:
-            practiced_skill_ids = []
-    if session_data.skill_ratings:
-        try:
-            skill_ratings = json.loads(session_data.skill_ratings)
-        except:
-            skill_ratings = {}
-    skills = []
-    if practiced_skill_ids:
-        skills_rows = db.session.query(Skill).filter(Skill.id.in_(practiced_skill_ids)).all()
-        for skill_row in skills_rows:
-            skill = skill_row.__dict__
-            skill_id = str(skill['id'])
-            if skill_id in skill_ratings:
-                skill['rating'] = skill_ratings[skill_id]
-            skills.append(skill)
+    skills, practiced_skill_ids, skill_ratings = session_skill_context(session_data.id)
     all_skills = db.session.query(Skill).order_by(Skill.category, Skill.name).all()
     skill_categories = {}
     for skill in all_skills:
         category = skill.category
         skill_categories.setdefault(category, []).append(skill.__dict__)
     goals = db.session.query(Goal).filter_by(user_id=session_data.user_id).order_by(Goal.id.desc()).all()
-    goals_data = []
-    for goal in goals:
-        goal_data = goal.__dict__
-        goal_data['skill_name'] = goal.skill.name if goal.skill else 'N/A'
-        goals_data.append(goal_data)
     return render_template('pages/training/session_detail.html', 
                           title=f"Admin Edit: Session {session_id}", 
                           session=session_data, 
@@ -836,7 +1480,7 @@ def admin_session_detail(session_id):
                           skill_categories=skill_categories,
                           practiced_skill_ids=practiced_skill_ids,
                           skill_ratings=skill_ratings,
-                          goals=goals_data,
+                          goals=goals,
                           config=app.config) # Pass config to template
 
 # --- Admin Product Management ---
@@ -844,11 +1488,69 @@ from flask import abort
 
 @admin_bp.route('/products')
 @login_required
+@query_budget(3)
 def products():
     if not session.get('is_admin'):
         abort(403)
-    products = db.session.query(Product).order_by(Product.created_at.desc()).all()
-    return render_template('pages/admin/products.html', products=products)
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    query = db.session.query(Product)
+    total_products = query.count()
+    pages = max(1, -(-total_products // per_page))
+    page = max(1, min(request.args.get('page', 1, type=int), pages))
+    products = (query.order_by(Product.created_at.desc(), Product.id.desc())
+                .offset((page - 1) * per_page).limit(per_page).all())
+    return render_template('pages/admin/products.html', products=products, page=page, pages=pages,
+                           per_page=per_page, total_products=total_products)
+
+def store_product_images(files):
+    """Store product images; returns a StoredFile per file (None where an upload failed).
+
+    In production the files go to S3 concurrently; locally they are saved
+    under static/uploads. Either way the resized derivatives are built too.
+    """
+    is_production = os.environ.get('FLASK_ENV') == 'production' or os.environ.get('RAILWAY_STATIC_URL') or os.environ.get('RAILWAY_ENVIRONMENT')
+    if is_production and app.config.get('S3_BUCKET'):
+        return storage.upload_files(files, app.config['S3_BUCKET'])
+    stored = []
+    for f in files:
+        filename = secure_filename(f.filename)
+        upload_path = os.path.join(app.root_path, 'static', 'uploads', filename)
+        f.save(upload_path)
+        url = url_for('static', filename=f'uploads/{filename}')
+        variants = media.save_local_derivatives(upload_path, url) if media.is_image(filename) else None
+        stored.append(storage.StoredFile(url, variants))
+    return stored
+
+def product_image_files():
+    """The main and extra image uploads of the product form, validated.
+
+    Returns ``(main_file, extra_files, error)``; invalid extra images are
+    flashed and skipped, an invalid main image is returned as ``error``.
+    """
+    file = request.files.get('image_file')
+    if not (file and file.filename):
+        file = None
+    elif secure_filename(file.filename).rsplit('.', 1)[-1].lower() not in app.config['ALLOWED_EXTENSIONS']:
+        return None, [], 'Invalid image file type.'
+    extra_files = []
+    for extra_file in request.files.getlist('extra_images'):
+        if extra_file and extra_file.filename:
+            ext = extra_file.filename.rsplit('.', 1)[-1].lower()
+            if ext not in app.config['ALLOWED_EXTENSIONS']:
+                flash(f'Archivo de imagen adicional inválido: {extra_file.filename}', 'danger')
+                continue
+            extra_files.append(extra_file)
+    return file, extra_files, None
+
+def stored_extra_images(extra_files, stored_files):
+    """``(url, variants)`` of the extra images that were stored; flashes the ones that failed."""
+    images = []
+    for extra_file, stored in zip(extra_files, stored_files):
+        if not stored:
+            flash(f'No se pudo subir la imagen adicional {extra_file.filename} a S3.', 'danger')
+            continue
+        images.append((stored.url, stored.variants))
+    return images
 
 @admin_bp.route('/products/add', methods=['GET', 'POST'])
 @login_required
@@ -860,54 +1562,29 @@ def add_product():
         description = request.form['description']
         price = request.form['price']
         image_url = request.form['image_url']
+        category = request.form.get('category', '').strip()[:50] or None
         is_available = request.form.get('is_available', '1') == '1'
-        # Handle main image file upload
-        file = request.files.get('image_file')
-        if file and file.filename:
-            filename = secure_filename(file.filename)
-            ext = filename.rsplit('.', 1)[-1].lower()
-            if ext not in app.config['ALLOWED_EXTENSIONS']:
-                flash('Invalid image file type.', 'danger')
-                return render_template('pages/admin/product_form.html', product=None)
-            is_production = os.environ.get('FLASK_ENV') == 'production' or os.environ.get('RAILWAY_STATIC_URL') or os.environ.get('RAILWAY_ENVIRONMENT')
-            if is_production and app.config.get('S3_BUCKET'):
-                s3_url = upload_file_to_s3(file, app.config['S3_BUCKET'])
-                if not s3_url:
-                    flash('Failed to upload image to S3.', 'danger')
-                    return render_template('pages/admin/product_form.html', product=None)
-                image_url = s3_url
-            else:
-                upload_path = os.path.join(app.root_path, 'static', 'uploads', filename)
-                file.save(upload_path)
-                image_url = url_for('static', filename=f'uploads/{filename}')
-        product = Product(name=name, description=description, price=price, image_url=image_url, is_available=is_available)
-        db.session.add(product)
-        db.session.commit()
-        # Handle multiple extra images
-        extra_images = request.files.getlist('extra_images')
-        for extra_file in extra_images:
-            if extra_file and extra_file.filename:
-                ext = extra_file.filename.rsplit('.', 1)[-1].lower()
-                if ext not in app.config['ALLOWED_EXTENSIONS']:
-                    flash(f'Archivo de imagen adicional inválido: {extra_file.filename}', 'danger')
-                    continue
-                if is_production and app.config.get('S3_BUCKET'):
-                    s3_url = upload_file_to_s3(extra_file, app.config['S3_BUCKET'])
-                    if not s3_url:
-                        flash(f'No se pudo subir la imagen adicional {extra_file.filename} a S3.', 'danger')
-                        continue
-                    img_url = s3_url
-                else:
-                    filename = secure_filename(extra_file.filename)
-                    upload_path = os.path.join(app.root_path, 'static', 'uploads', filename)
-                    extra_file.save(upload_path)
-                    img_url = url_for('static', filename=f'uploads/{filename}')
-                from product_model import ProductImage
-                db.session.add(ProductImage(product_id=product.id, image_url=img_url))
+        file, extra_files, error = product_image_files()
+        if error:
+            flash(error, 'danger')
+            return render_template('pages/admin/product_form.html', product=None, categories=catalogue.categories(available_only=False))
+        # Main and extra images are uploaded together, in parallel
+        stored_files = store_product_images(([file] if file else []) + extra_files)
+        image_variants = None
+        if file:
+            main = stored_files.pop(0)
+            if not main:
+                flash('Failed to upload image to S3.', 'danger')
+                return render_template('pages/admin/product_form.html', product=None, categories=catalogue.categories(available_only=False))
+            image_url, image_variants = main.url, main.variants
+        catalogue.create_product(
+            stored_extra_images(extra_files, stored_files), name=name, description=description, price=price,
+            image_url=image_url, image_variants=image_variants, category=category, is_available=is_available)
         db.session.commit()
+        catalogue.changed()
         flash('Product added!', 'success')
         return redirect(url_for('admin.products'))
-    return render_template('pages/admin/product_form.html', product=None)
+    return render_template('pages/admin/product_form.html', product=None, categories=catalogue.categories(available_only=False))
 
 @admin_bp.route('/products/edit/<int:product_id>', methods=['GET', 'POST'])
 @login_required
@@ -918,57 +1595,36 @@ def edit_product(product_id):
     if not product:
         abort(404)
     if request.method == 'POST':
-        is_production = os.environ.get('FLASK_ENV') == 'production' or os.environ.get('RAILWAY_STATIC_URL') or os.environ.get('RAILWAY_ENVIRONMENT')
         product.name = request.form['name']
         product.description = request.form['description']
         product.price = request.form['price']
+        product.category = request.form.get('category', '').strip()[:50] or None
         product.is_available = request.form.get('is_available', '1') == '1'
         image_url = request.form['image_url']
-        file = request.files.get('image_file')
-        if file and file.filename:
-            filename = secure_filename(file.filename)
-            ext = filename.rsplit('.', 1)[-1].lower()
-            if ext not in app.config['ALLOWED_EXTENSIONS']:
-                flash('Invalid image file type.', 'danger')
-                return render_template('pages/admin/product_form.html', product=product)
-            # is_production is now defined at the top of the POST block
-            if is_production and app.config.get('S3_BUCKET'):
-                s3_url = upload_file_to_s3(file, app.config['S3_BUCKET'])
-                if not s3_url:
-                    flash('Failed to upload image to S3.', 'danger')
-                    return render_template('pages/admin/product_form.html', product=product)
-                image_url = s3_url
-            else:
-                upload_path = os.path.join(app.root_path, 'static', 'uploads', filename)
-                file.save(upload_path)
-                image_url = url_for('static', filename=f'uploads/{filename}')
+        file, extra_files, error = product_image_files()
+        if error:
+            flash(error, 'danger')
+            return render_template('pages/admin/product_form.html', product=product, categories=catalogue.categories(available_only=False))
+        # Main and extra images are uploaded together, in parallel
+        stored_files = store_product_images(([file] if file else []) + extra_files)
+        if file:
+            main = stored_files.pop(0)
+            if not main:
+                flash('Failed to upload image to S3.', 'danger')
+                return render_template('pages/admin/product_form.html', product=product, categories=catalogue.categories(available_only=False))
+            image_url = main.url
+            product.image_variants = main.variants
+        elif image_url != product.image_url:
+            # A pasted URL has no derivatives
+            product.image_variants = None
         product.image_url = image_url
+        catalogue.remove_images(product.id, request.form.getlist('remove_image_ids', type=int))
+        catalogue.add_images(product, stored_extra_images(extra_files, stored_files))
         db.session.commit()
-        # Handle multiple extra images
-        extra_images = request.files.getlist('extra_images')
-        for extra_file in extra_images:
-            if extra_file and extra_file.filename:
-                ext = extra_file.filename.rsplit('.', 1)[-1].lower()
-                if ext not in app.config['ALLOWED_EXTENSIONS']:
-                    flash(f'Archivo de imagen adicional inválido: {extra_file.filename}', 'danger')
-                    continue
-                if is_production and app.config.get('S3_BUCKET'):
-                    s3_url = upload_file_to_s3(extra_file, app.config['S3_BUCKET'])
-                    if not s3_url:
-                        flash(f'No se pudo subir la imagen adicional {extra_file.filename} a S3.', 'danger')
-                        continue
-                    img_url = s3_url
-                else:
-                    filename = secure_filename(extra_file.filename)
-                    upload_path = os.path.join(app.root_path, 'static', 'uploads', filename)
-                    extra_file.save(upload_path)
-                    img_url = url_for('static', filename=f'uploads/{filename}')
-                from product_model import ProductImage
-                db.session.add(ProductImage(product_id=product.id, image_url=img_url))
-        db.session.commit()
+        catalogue.changed()
         flash('Product updated!', 'success')
         return redirect(url_for('admin.products'))
-    return render_template('pages/admin/product_form.html', product=product)
+    return render_template('pages/admin/product_form.html', product=product, categories=catalogue.categories(available_only=False))
 
 @admin_bp.route('/products/delete/<int:product_id>', methods=['POST'])
 @login_required
@@ -980,6 +1636,7 @@ def delete_product(product_id):
         abort(404)
     db.session.delete(product)
     db.session.commit()
+    catalogue.changed()
     flash('Product deleted!', 'success')
     return redirect(url_for('admin.products'))
 
@@ -988,11 +1645,9 @@ def delete_product(product_id):
 def delete_product_image(image_id, product_id):
     if not session.get('is_admin'):
         abort(403)
-    from product_model import ProductImage
-    img = db.session.query(ProductImage).get(image_id)
-    if img:
-        db.session.delete(img)
+    if catalogue.remove_images(product_id, [image_id]):
         db.session.commit()
+        catalogue.changed()
         flash('Imagen eliminada.', 'success')
     else:
         flash('No se encontró la imagen.', 'danger')
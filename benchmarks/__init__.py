@@ -0,0 +1 @@
+"""Benchmarks for the core endpoints; run ``python -m benchmarks --help``."""
@@ -0,0 +1,218 @@
+"""Benchmark harness for the core endpoints.
+
+    python -m benchmarks seed [--users 2000 --sessions-per-user 100 --reset]
+    python -m benchmarks run [--duration 30 --concurrency 8 --label "my change"]
+    python -m benchmarks compare [BASELINE.json [CANDIDATE.json]]
+    python -m benchmarks startup [--runs 5 --workers 4]
+
+The database is ``BENCH_DATABASE_URL`` (default: ``bench.db`` next to the
+app), never ``DATABASE_URL``, so a benchmark cannot seed production by
+accident. Point it at a scratch Postgres to measure what Railway runs.
+
+``run`` prints p50/p95/p99 latency, throughput and queries per request per
+endpoint and saves them with the current commit to ``benchmarks/results/``;
+``compare`` diffs two saved runs (by default the last two). ``startup``
+times ``import app`` and gunicorn boots with and without ``preload_app``
+and saves them to ``benchmarks/results/startup/``.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def _configure_environment(args):
+    # Must run before app.py is imported: it reads these at import time
+    scratch = tempfile.mkdtemp(prefix='wingman-bench-')
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['WEATHER_CACHE_PATH'] = os.path.join(scratch, 'weather_cache.db')
+    os.environ['CHAT_CACHE_PATH'] = os.path.join(scratch, 'chat_cache.db')
+    os.environ['FRAGMENT_CACHE_PATH'] = os.path.join(scratch, 'fragment_cache.db')
+    os.environ['METRICS_DIR'] = os.path.join(scratch, 'metrics')
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def _load_app():
+    import app as app_module
+    return app_module.app, app_module.db
+
+
+def cmd_seed(args):
+    from benchmarks.seed import seed
+    app, db = _load_app()
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        from models import User
+        if db.session.query(User).first() is not None:
+            sys.exit('The benchmark database already has data; use --reset to start over.')
+        counts = seed(db, users=args.users, sessions_per_user=args.sessions_per_user,
+                      skills=args.skills, products=args.products)
+    print(json.dumps(counts, indent=2))
+
+
+def _git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT) != 0
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cmd_run(args):
+    from benchmarks import stubs, traffic
+    app, db = _load_app()
+    # Query counts for the report; repeated-statement warnings would only add noise
+    app.config.update(SQL_N_PLUS_ONE='warn', SQL_REPEAT_THRESHOLD=0)
+    stubs.install(app, args.agent_latency)
+    with app.app_context():
+        from models import User, Session
+        user_count = db.session.query(User).count()
+        session_count = db.session.query(Session).count()
+    if user_count < 2:
+        sys.exit('Seed the benchmark database first: python -m benchmarks seed')
+
+    if args.warmup:
+        traffic.replay(app, user_count, args.warmup, args.concurrency)
+    samples, wall = traffic.replay(app, user_count, args.duration, args.concurrency)
+    report = traffic.summarize(samples, wall)
+    result = {
+        'label': args.label,
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'data': {'users': user_count, 'sessions': session_count},
+        'config': {'duration': args.duration, 'concurrency': args.concurrency, 'agent_latency': args.agent_latency},
+        **report,
+    }
+    _print_report(result)
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{result['timestamp'].replace(':', '')}-{result['commit'] or 'nogit'}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved to {os.path.relpath(path, ROOT)}")
+
+
+def _print_report(result):
+    print(f"{result['commit']} · {result['database']} · {result['data']['users']} users, "
+          f"{result['data']['sessions']} sessions · {result['config']['concurrency']} clients")
+    print(f"{'endpoint':<22}{'reqs':>7}{'err':>5}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    rows = list(result['endpoints'].items()) + [('TOTAL', result['total'])]
+    for name, s in rows:
+        queries = '-' if s.get('queries_per_request') is None else f"{s['queries_per_request']:.1f}"
+        print(f"{name:<22}{s['requests']:>7}{s['errors']:>5}{s['throughput_rps']:>8}"
+              f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{queries:>9}")
+
+
+def cmd_compare(args):
+    paths = args.files
+    if len(paths) < 2:
+        saved = sorted(os.path.join(args.out, name) for name in os.listdir(args.out) if name.endswith('.json'))
+        paths = (paths + saved[-2:])[-2:] if paths else saved[-2:]
+    if len(paths) < 2:
+        sys.exit('Need two saved runs to compare.')
+    with open(paths[0]) as f:
+        base = json.load(f)
+    with open(paths[1]) as f:
+        new = json.load(f)
+    print(f"baseline {base['commit']} ({base['timestamp']})  →  candidate {new['commit']} ({new['timestamp']})")
+    print(f"{'endpoint':<22}{'p50 ms':>24}{'p95 ms':>24}{'p99 ms':>24}{'rps':>20}{'queries':>14}")
+    names = list(dict.fromkeys(list(base['endpoints']) + list(new['endpoints']))) + ['TOTAL']
+    for name in names:
+        a = base['total'] if name == 'TOTAL' else base['endpoints'].get(name)
+        b = new['total'] if name == 'TOTAL' else new['endpoints'].get(name)
+        if not a or not b:
+            continue
+        cells = [_delta(a[k], b[k], width) for k, width in
+                 (('p50_ms', 24), ('p95_ms', 24), ('p99_ms', 24), ('throughput_rps', 20))]
+        queries = '-'
+        if a.get('queries_per_request') is not None and b.get('queries_per_request') is not None:
+            queries = f"{a['queries_per_request']:.1f}→{b['queries_per_request']:.1f}"
+        print(f"{name:<22}{''.join(cells)}{queries:>14}")
+
+
+def _delta(old, new, width):
+    change = f"{(new - old) / old * 100:+.0f}%" if old else 'n/a'
+    return f"{old}→{new} {change}".rjust(width)
+
+
+def cmd_startup(args):
+    from benchmarks import startup
+    result = {
+        'label': args.label,
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'import': startup.import_app(args.runs),
+        'gunicorn': [startup.serve(preload, args.workers, preload_sdks=sdks)
+                     for preload, sdks in ((False, False), (True, False), (True, True))],
+    }
+    imported = result['import']
+    print(f"import app: {imported['median_seconds']}s median of {imported['runs']} "
+          f"(min {imported['min_seconds']}s), {imported['max_rss_mb']} MB RSS, "
+          f"agents loaded: {imported['agents_loaded']}, boto3 loaded: {imported['boto3_loaded']}")
+    print(f"{'gunicorn':<24}{'workers':>8}{'ready s':>9}{'master MB':>11}{'worker MB':>11}{'total MB':>10}")
+    for run in result['gunicorn']:
+        name = ('preload' if run['preload'] else 'no preload') + (' + SDKs' if run['preload_sdks'] else '')
+        print(f"{name:<24}{run['workers']:>8}{run['first_response_seconds']:>9}"
+              f"{str(run['master_pss_mb']):>11}{str(run['worker_pss_mb']):>11}{str(run['total_pss_mb']):>10}")
+    out = os.path.join(args.out, 'startup')
+    os.makedirs(out, exist_ok=True)
+    path = os.path.join(out, f"{result['timestamp'].replace(':', '')}-{result['commit'] or 'nogit'}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved to {os.path.relpath(path, ROOT)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default=os.environ.get(
+        'BENCH_DATABASE_URL', f"sqlite:///{os.path.join(ROOT, 'bench.db')}"))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed = commands.add_parser('seed', help='Create and fill the benchmark database.')
+    seed.add_argument('--users', type=int, default=2000)
+    seed.add_argument('--sessions-per-user', type=int, default=100)
+    seed.add_argument('--skills', type=int, default=60)
+    seed.add_argument('--products', type=int, default=40)
+    seed.add_argument('--reset', action='store_true', help='Drop all tables first.')
+    seed.set_defaults(func=cmd_seed)
+
+    run = commands.add_parser('run', help='Replay the traffic mix and report latencies.')
+    run.add_argument('--duration', type=float, default=30)
+    run.add_argument('--warmup', type=float, default=3)
+    run.add_argument('--concurrency', type=int, default=8)
+    run.add_argument('--agent-latency', type=float, default=0.2, help='Seconds the stubbed agent takes.')
+    run.add_argument('--label', default='')
+    run.add_argument('--out', default=RESULTS_DIR)
+    run.set_defaults(func=cmd_run)
+
+    compare = commands.add_parser('compare', help='Diff two saved runs (default: the last two).')
+    compare.add_argument('files', nargs='*')
+    compare.add_argument('--out', default=RESULTS_DIR)
+    compare.set_defaults(func=cmd_compare)
+
+    startup = commands.add_parser('startup', help='Time app import and gunicorn boot, with and without preload.')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--workers', type=int, default=4)
+    startup.add_argument('--label', default='')
+    startup.add_argument('--out', default=RESULTS_DIR)
+    startup.set_defaults(func=cmd_startup)
+
+    args = parser.parse_args(argv)
+    if args.command != 'compare':
+        _configure_environment(args)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
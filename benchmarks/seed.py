@@ -0,0 +1,118 @@
+"""Fill the benchmark database with realistic volumes.
+
+Rows are written with bulk INSERTs in chunks, with explicit ids so sessions
+can be linked to skills without reading them back; the Postgres sequences
+are moved past them afterwards. Training summaries are rebuilt with the
+same aggregate query as their migration.
+"""
+import random
+from datetime import date, timedelta
+from sqlalchemy import insert, text
+from werkzeug.security import generate_password_hash
+
+CHUNK = 5000
+SPORTS = ['wingfoil'] * 6 + ['windsurf', 'kitesurf', 'surf']
+LOCATIONS = ['Tarifa', 'Los Lances, Tarifa', 'Valdevaqueros', 'Bolonia', 'Palmones', 'El Palmar',
+             'Cádiz', 'Conil', 'Algeciras', None]
+SKILL_CATEGORIES = ['Basics', 'Riding', 'Turns', 'Jumps', 'Safety']
+PRODUCT_CATEGORIES = ['Wings', 'Boards', 'Foils', 'Wetsuits', None]
+NOTES = ['Good session, stayed on foil for longer runs.', 'Gusty wind, hard to get going.',
+         'Worked on pumping and touch-and-gos.', 'Tried my first jibe, fell a lot.', '']
+
+
+def _chunks(rows):
+    for i in range(0, len(rows), CHUNK):
+        yield rows[i:i + CHUNK]
+
+
+def _bulk(db, model, rows):
+    for chunk in _chunks(rows):
+        db.session.execute(insert(model), chunk)
+
+
+def seed(db, users=2000, sessions_per_user=100, skills=60, products=40, seed_value=42, log=print):
+    """Create users, sessions, skills, goals and products; return row counts."""
+    from models import (User, Session, Skill, SessionSkill, UserSkill, Goal, Product, ProductImage,
+                        Level, TrainingSummary)
+    rng = random.Random(seed_value)
+    password = generate_password_hash('bench')
+    today = date.today()
+
+    levels = [{'id': i + 1, 'code': f'L{i + 1}', 'name': f'Level {i + 1}'} for i in range(6)]
+    _bulk(db, Level, levels)
+
+    user_rows = [{'id': 1, 'username': 'bench-admin', 'email': 'admin@bench.local', 'password': password,
+                  'is_admin': True, 'location': 'Tarifa'}]
+    for i in range(2, users + 1):
+        user_rows.append({
+            'id': i, 'username': f'rider{i}', 'email': f'rider{i}@bench.local', 'password': password,
+            'name': f'Rider {i}', 'location': rng.choice(LOCATIONS), 'is_admin': False,
+            'wingfoil_level_id': rng.randint(1, 6),
+        })
+    _bulk(db, User, user_rows)
+    log(f"users: {len(user_rows)}")
+
+    skill_rows = [{'id': i + 1, 'name': f'Skill {i + 1}', 'category': SKILL_CATEGORIES[i % len(SKILL_CATEGORIES)],
+                   'description': 'Benchmark skill'} for i in range(skills)]
+    _bulk(db, Skill, skill_rows)
+
+    session_id = 0
+    session_rows, session_skill_rows = [], []
+    total_sessions = 0
+    for user_id in range(1, users + 1):
+        count = max(1, int(rng.gauss(sessions_per_user, sessions_per_user / 3)))
+        for _ in range(count):
+            session_id += 1
+            session_rows.append({
+                'id': session_id, 'user_id': user_id, 'date': today - timedelta(days=rng.randint(0, 3 * 365)),
+                'sport_type': rng.choice(SPORTS), 'duration': rng.randint(20, 180),
+                'rating': rng.choice([None, 1, 2, 3, 4, 5, 4, 3]), 'location': rng.choice(LOCATIONS),
+                'notes': rng.choice(NOTES), 'wind_speed': f"{rng.randint(10, 30)} kn",
+                'equipment': rng.choice(['Wing 5m, board 90L', 'Wing 4m, board 75L', None]),
+            })
+            for skill_id in rng.sample(range(1, skills + 1), rng.randint(0, 2)):
+                session_skill_rows.append({'session_id': session_id, 'skill_id': skill_id,
+                                           'rating': rng.randint(1, 5)})
+        if len(session_rows) >= CHUNK * 4:
+            _bulk(db, Session, session_rows)
+            _bulk(db, SessionSkill, session_skill_rows)
+            total_sessions += len(session_rows)
+            session_rows, session_skill_rows = [], []
+    _bulk(db, Session, session_rows)
+    _bulk(db, SessionSkill, session_skill_rows)
+    total_sessions += len(session_rows)
+    log(f"sessions: {total_sessions}")
+
+    user_skill_rows, goal_rows = [], []
+    for user_id in range(1, users + 1):
+        for skill_id in rng.sample(range(1, skills + 1), min(skills, 10)):
+            user_skill_rows.append({'user_id': user_id, 'skill_id': skill_id,
+                                    'status': rng.choice(['in_progress', 'mastered'])})
+        for g in range(rng.randint(0, 3)):
+            goal_rows.append({'user_id': user_id, 'title': f'Goal {g + 1}', 'description': 'Benchmark goal'})
+    _bulk(db, UserSkill, user_skill_rows)
+    _bulk(db, Goal, goal_rows)
+
+    product_rows, image_rows = [], []
+    for i in range(1, products + 1):
+        product_rows.append({'id': i, 'name': f'Wing {i}', 'description': 'Benchmark product',
+                             'price': rng.randint(300, 2000), 'image_url': f'/static/img/products/{i}.jpg',
+                             'category': rng.choice(PRODUCT_CATEGORIES), 'is_available': rng.random() > 0.2})
+        for j in range(3):
+            image_rows.append({'product_id': i, 'image_url': f'/static/img/products/{i}-{j}.jpg'})
+    _bulk(db, Product, product_rows)
+    _bulk(db, ProductImage, image_rows)
+
+    db.session.execute(text(
+        "INSERT INTO training_summary (user_id, sport_type, location, sessions, minutes, rating_sum, rated_sessions) "
+        "SELECT user_id, sport_type, COALESCE(location, ''), COUNT(id), COALESCE(SUM(duration), 0), "
+        "COALESCE(SUM(rating), 0), COUNT(rating) "
+        "FROM session GROUP BY user_id, sport_type, COALESCE(location, '')"
+    ))
+    if db.engine.dialect.name == 'postgresql':
+        for table in ('level', 'user', 'skill', 'session', 'product'):
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), (SELECT MAX(id) FROM \"{table}\"))"))
+    db.session.commit()
+    return {'users': len(user_rows), 'sessions': total_sessions, 'skills': skills, 'products': products,
+            'training_summaries': db.session.query(TrainingSummary).count()}
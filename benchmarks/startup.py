@@ -0,0 +1,120 @@
+"""Startup cost: importing the app, and gunicorn with and without preloading.
+
+Each measurement runs in fresh processes with the environment set up by
+__main__.py. Memory is PSS (proportional set size) from /proc, which splits
+pages shared copy-on-write between the processes sharing them, so summing
+it over the master and workers gives the real footprint. Linux only for the
+memory numbers.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import statistics
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = (
+    "import time, sys, json, resource\n"
+    "started = time.perf_counter()\n"
+    "import app\n"
+    "elapsed = time.perf_counter() - started\n"
+    "print(json.dumps({'seconds': elapsed,"
+    " 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,"
+    " 'agents_loaded': 'agents' in sys.modules, 'boto3_loaded': 'boto3' in sys.modules}))\n"
+)
+
+
+def import_app(runs=5):
+    """Median time and peak RSS of ``import app`` in a new interpreter."""
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=ROOT, capture_output=True, text=True,
+                             check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        'runs': runs,
+        'median_seconds': round(statistics.median(s['seconds'] for s in samples), 3),
+        'min_seconds': round(min(s['seconds'] for s in samples), 3),
+        'max_rss_mb': round(statistics.median(s['max_rss_mb'] for s in samples), 1),
+        'agents_loaded': samples[-1]['agents_loaded'],
+        'boto3_loaded': samples[-1]['boto3_loaded'],
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return children
+
+
+def _pss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def serve(preload, workers=4, settle=3.0, timeout=60.0, preload_sdks=False):
+    """Start gunicorn with gunicorn.conf.py; time to the first healthy response and memory once settled."""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               GUNICORN_PRELOAD='1' if preload else '0', PRELOAD_SDKS='1' if preload_sdks else '0')
+    started = time.perf_counter()
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:application'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = None
+        while time.perf_counter() - started < timeout:
+            if master.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with status {master.returncode}')
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=2) as response:
+                    if response.status == 200:
+                        ready = time.perf_counter() - started
+                        break
+            except OSError:
+                time.sleep(0.05)
+        if ready is None:
+            raise RuntimeError('gunicorn did not become healthy in time')
+        # Let the remaining workers finish booting before measuring memory
+        time.sleep(settle)
+        worker_pids = _children(master.pid)
+        worker_pss = [_pss_mb(pid) for pid in worker_pids]
+        master_pss = _pss_mb(master.pid)
+        known = [p for p in worker_pss if p is not None]
+        return {
+            'preload': preload,
+            'preload_sdks': preload_sdks,
+            'workers': len(worker_pids),
+            'first_response_seconds': round(ready, 3),
+            'master_pss_mb': round(master_pss, 1) if master_pss is not None else None,
+            'worker_pss_mb': round(statistics.mean(known), 1) if known else None,
+            'total_pss_mb': round(master_pss + sum(known), 1) if master_pss is not None and known else None,
+        }
+    finally:
+        master.terminate()
+        try:
+            master.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            master.kill()
@@ -0,0 +1,95 @@
+"""Canned upstreams so benchmarks never leave the machine.
+
+Met.no and YouTube are stubbed at the transport level (``Upstream.mount``),
+so the outbound layer, the weather refresher and the oEmbed code all run as
+in production. The agent is replaced through the ``AGENT_RUNNER`` hook with a
+runner that waits ``latency`` seconds like a model would.
+"""
+import json
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+def metno_forecast(hours=72):
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    timeseries = []
+    for hour in range(hours):
+        timeseries.append({
+            'time': (start + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'data': {
+                'instant': {'details': {
+                    'air_temperature': 18 + (hour % 24) / 4,
+                    'wind_speed': 4 + (hour % 12),
+                    'wind_from_direction': (90 + hour * 15) % 360,
+                }},
+                'next_1_hours': {'summary': {'symbol_code': 'fair_day'}},
+            },
+        })
+    return {'properties': {'timeseries': timeseries}}
+
+
+class StubAdapter(BaseAdapter):
+    """Answers Met.no forecast and YouTube oEmbed requests locally."""
+
+    def __init__(self):
+        super().__init__()
+        self.forecast = json.dumps(metno_forecast()).encode()
+
+    def send(self, request, **kwargs):
+        if 'met.no' in request.url:
+            body, headers = self.forecast, {
+                'Expires': (datetime.now(timezone.utc) + timedelta(hours=1)).strftime('%a, %d %b %Y %H:%M:%S GMT'),
+            }
+        elif 'youtube.com/oembed' in request.url:
+            body, headers = json.dumps({'title': 'Wingfoil tutorial',
+                                        'thumbnail_url': 'https://i.ytimg.com/vi/x/hqdefault.jpg'}).encode(), {}
+        else:
+            body, headers = b'', {}
+        response = requests.Response()
+        response.status_code = 200 if body else 404
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json', **headers})
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class StubRunner:
+    """Stands in for ``agents.Runner``: sleeps, then answers."""
+
+    latency = 0.2
+
+    @classmethod
+    async def run(cls, agent, agent_input, context=None):
+        await asyncio.sleep(cls.latency)
+        return SimpleNamespace(final_output='Mantén el ala alta y la mirada al frente.', history=[], new_items=[])
+
+    @classmethod
+    def run_streamed(cls, agent, agent_input, context=None):
+        result = SimpleNamespace(final_output=None, history=[], new_items=[])
+
+        async def stream_events():
+            for word in ('Mantén ', 'el ', 'ala ', 'alta.'):
+                await asyncio.sleep(cls.latency / 4)
+                yield SimpleNamespace(type='raw_response_event',
+                                      data=SimpleNamespace(type='response.output_text.delta', delta=word))
+            result.final_output = 'Mantén el ala alta.'
+
+        result.stream_events = stream_events
+        return result
+
+
+def install(app, agent_latency):
+    import outbound
+    adapter = StubAdapter()
+    outbound.metno.mount(adapter)
+    outbound.youtube.mount(adapter)
+    StubRunner.latency = agent_latency
+    app.config['AGENT_RUNNER'] = StubRunner
@@ -0,0 +1,116 @@
+"""Scripted traffic against the app, in-process, from several client threads.
+
+Each thread has its own test client and picks the next request from a
+weighted mix; requests go through the full WSGI stack, database and
+templates, with upstreams stubbed (see stubs.py). Query counts come from
+the ``X-SQL-Queries`` header added by query_guard.py.
+"""
+import time
+import random
+import threading
+from datetime import date, timedelta
+
+QUESTIONS = ['¿Cómo hago el waterstart?', '¿Qué tamaño de ala necesito con 15 nudos?',
+             '¿Cómo mejoro el pumping?', '¿Cómo hago una trasluchada?', '¿Qué foil es mejor para empezar?',
+             '¿Cómo me pongo de pie en la tabla?', '¿Qué hago si me caigo lejos de la orilla?',
+             '¿Cuánto viento hace falta para volar?']
+
+
+def _sessions_page(rng):
+    start = date.today() - timedelta(days=rng.randint(30, 900))
+    return f'/training/api/sessions?from={start.isoformat()}&to={(start + timedelta(days=90)).isoformat()}'
+
+
+# name, weight, role ('anon', 'user', 'admin'), method, path or callable(rng), JSON body or callable(rng)
+SCENARIOS = [
+    ('home', 20, 'user', 'GET', '/', None),
+    ('training', 15, 'user', 'GET', '/training/', None),
+    ('api_sessions', 20, 'user', 'GET', '/training/api/sessions', None),
+    ('api_sessions_window', 10, 'user', 'GET', _sessions_page, None),
+    ('admin_dashboard', 5, 'admin', 'GET', '/admin/dashboard', None),
+    ('gear', 15, 'anon', 'GET', '/gear', None),
+    ('agent_chat', 10, 'user', 'POST', '/agent/api/chat', lambda rng: {'message': rng.choice(QUESTIONS)}),
+    ('agent_chat_anon', 5, 'anon', 'POST', '/agent/api/chat', lambda rng: {'message': rng.choice(QUESTIONS)}),
+]
+
+
+def _client_loop(app, user_count, rng, deadline, samples):
+    client = app.test_client()
+    names = [s[0] for s in SCENARIOS]
+    weights = [s[1] for s in SCENARIOS]
+    by_name = {s[0]: s for s in SCENARIOS}
+    current = None
+    while time.monotonic() < deadline:
+        name, _, role, method, path, body = by_name[rng.choices(names, weights)[0]]
+        user_id = None if role == 'anon' else 1 if role == 'admin' else rng.randint(2, user_count)
+        if user_id != current:
+            with client.session_transaction() as sess:
+                sess.clear()
+                if user_id:
+                    sess['user_id'] = user_id
+                    sess['is_admin'] = role == 'admin'
+            current = user_id
+        url = path(rng) if callable(path) else path
+        started = time.perf_counter()
+        if method == 'POST':
+            response = client.post(url, json=body(rng) if callable(body) else body)
+        else:
+            response = client.get(url)
+        elapsed = time.perf_counter() - started
+        queries = response.headers.get('X-SQL-Queries')
+        samples.append((name, elapsed, response.status_code, int(queries) if queries else None))
+        response.close()
+
+
+def replay(app, user_count, duration, concurrency, seed_value=1):
+    """Run the traffic mix for ``duration`` seconds; return ``(samples, wall_seconds)``."""
+    samples = []
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=_client_loop, args=(app, user_count, random.Random(seed_value + i), deadline, samples))
+        for i in range(concurrency)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - started
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(samples, wall_seconds):
+    endpoints = {}
+    for name in dict.fromkeys(s[0] for s in SCENARIOS):
+        rows = [s for s in samples if s[0] == name]
+        if rows:
+            endpoints[name] = _stats(rows, wall_seconds)
+    return {'endpoints': endpoints, 'total': _stats(samples, wall_seconds) if samples else {}}
+
+
+def _stats(rows, wall_seconds):
+    latencies = sorted(r[1] * 1000 for r in rows)
+    queries = [r[3] for r in rows if r[3] is not None]
+    statuses = {}
+    for r in rows:
+        statuses[str(r[2])] = statuses.get(str(r[2]), 0) + 1
+    return {
+        'requests': len(rows),
+        'errors': sum(1 for r in rows if r[2] >= 500),
+        'statuses': statuses,
+        'throughput_rps': round(len(rows) / wall_seconds, 1),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
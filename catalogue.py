@@ -0,0 +1,108 @@
+"""Gear catalogue: the product queries and writes behind /gear, the catalogue
+API and the admin product pages.
+
+Everything runs on the one ``db`` session from models.py; the write helpers
+only flush, so each view still commits once. After committing a change,
+call ``changed()`` so the cached product markup is rebuilt (see
+fragment_cache.py).
+"""
+from decimal import Decimal, InvalidOperation
+import fragment_cache
+from models import db, Product, ProductImage
+
+# Name of the fragment cache group holding the rendered product grids
+CATALOGUE = 'catalogue'
+PAGE_SIZE = 12
+MAX_PAGE_SIZE = 48
+
+
+def version():
+    """``(version, updated_at)`` of the catalogue, or None if the cache is unavailable."""
+    return fragment_cache.version(CATALOGUE)
+
+
+def changed():
+    fragment_cache.bump(CATALOGUE)
+
+
+def parse_filters(args):
+    """Catalogue filters and page from query args; returns ``(filters, error)``."""
+    filters = {'category': args.get('category', '').strip() or None}
+    for name in ('min_price', 'max_price'):
+        value = args.get(name, '').strip()
+        try:
+            filters[name] = Decimal(value) if value else None
+        except InvalidOperation:
+            return None, f'Invalid {name}'
+        if filters[name] is not None and not filters[name].is_finite():
+            return None, f'Invalid {name}'
+    filters['page'] = max(1, args.get('page', 1, type=int))
+    filters['limit'] = max(1, min(args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    return filters, None
+
+
+def page(filters):
+    """Available products matching ``filters``, newest first; returns ``(products, has_more)``.
+
+    The images of the whole page come in one extra query.
+    """
+    query = db.session.query(Product).options(db.selectinload(Product.images)).filter_by(is_available=True)
+    if filters['category']:
+        query = query.filter(Product.category == filters['category'])
+    if filters['min_price'] is not None:
+        query = query.filter(Product.price >= filters['min_price'])
+    if filters['max_price'] is not None:
+        query = query.filter(Product.price <= filters['max_price'])
+    limit = filters['limit']
+    rows = (query.order_by(Product.created_at.desc(), Product.id.desc())
+            .offset((filters['page'] - 1) * limit).limit(limit + 1).all())
+    return rows[:limit], len(rows) > limit
+
+
+def featured(limit=4):
+    return db.session.query(Product).filter_by(is_available=True).order_by(Product.created_at.desc()).limit(limit).all()
+
+
+def categories(available_only=True):
+    query = db.session.query(Product.category).filter(Product.category.isnot(None))
+    if available_only:
+        query = query.filter_by(is_available=True)
+    return [row[0] for row in query.distinct().order_by(Product.category)]
+
+
+def as_dict(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': float(product.price),
+        'category': product.category,
+        'image_url': product.image_url,
+        'images': [img.image_url for img in product.images],
+    }
+
+
+def create_product(images=(), **fields):
+    """New product with its extra ``images`` (``(url, variants)`` pairs), written in one flush."""
+    product = Product(**fields)
+    product.images.extend(ProductImage(image_url=url, variants=variants) for url, variants in images)
+    db.session.add(product)
+    db.session.flush()
+    return product
+
+
+def add_images(product, images):
+    """Attach ``images`` (``(url, variants)`` pairs) to ``product`` in one flush; returns the new rows."""
+    rows = [ProductImage(image_url=url, variants=variants) for url, variants in images]
+    product.images.extend(rows)
+    db.session.flush()
+    return rows
+
+
+def remove_images(product_id, image_ids):
+    """Delete the listed images of ``product_id`` in one statement; returns how many went."""
+    if not image_ids:
+        return 0
+    return (db.session.query(ProductImage)
+            .filter(ProductImage.product_id == product_id, ProductImage.id.in_(image_ids))
+            .delete(synchronize_session='fetch'))
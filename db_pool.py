@@ -0,0 +1,129 @@
+"""Database connection pool settings and health.
+
+``engine_options(uri)`` builds ``SQLALCHEMY_ENGINE_OPTIONS`` from the
+environment; every gunicorn worker gets its own pool of this size:
+
+- ``DB_POOL_SIZE`` (5) connections kept open, plus up to
+  ``DB_MAX_OVERFLOW`` (10) extra ones under load;
+- ``DB_POOL_TIMEOUT`` (10) seconds a request waits for a free connection
+  before failing;
+- ``DB_POOL_RECYCLE`` (1800) seconds after which a connection is replaced,
+  and ``DB_POOL_PRE_PING`` (1) to test each connection on checkout, so
+  connections dropped while Railway idled are replaced instead of failing
+  the request;
+- ``DB_CONNECT_TIMEOUT`` (5) seconds for a new Postgres connection.
+
+``PoolMonitor(app)`` serves ``/health`` (a ``SELECT 1``, for load balancer
+checks) and discards connections inherited from a parent process after a
+fork, so workers of a preloaded gunicorn app never share sockets with the
+master or each other.
+"""
+import os
+import time
+import threading
+from flask import jsonify
+from sqlalchemy import exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that also records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waits = {'checkouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'timeouts': 0}
+
+    def _do_get(self):
+        # Includes opening a new connection when the pool is below its limit
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.waits['checkouts'] += 1
+                self.waits['wait_seconds'] += waited
+                self.waits['max_wait_seconds'] = max(self.waits['max_wait_seconds'], waited)
+                self.waits['timeouts'] += timed_out
+
+
+def engine_options(uri):
+    """SQLAlchemy engine options for ``uri`` from the ``DB_*`` environment variables."""
+    url = make_url(uri)
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+    }
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # In-memory SQLite keeps its single shared connection
+        return options
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=_env_int('DB_POOL_SIZE', 5),
+        max_overflow=_env_int('DB_MAX_OVERFLOW', 10),
+        pool_timeout=_env_int('DB_POOL_TIMEOUT', 10),
+    )
+    if url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'connect_timeout': _env_int('DB_CONNECT_TIMEOUT', 5)}
+    return options
+
+
+def pool_stats(engine):
+    """Checked-out connections, overflow and checkout waits of this worker's pool."""
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            # Connections opened beyond ``size``; negative while the pool is still filling up
+            overflow=pool.overflow(),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+        )
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            waits = dict(pool.waits)
+        waits['mean_wait_seconds'] = waits['wait_seconds'] / waits['checkouts'] if waits['checkouts'] else None
+        stats.update({k: round(v, 6) if isinstance(v, float) else v for k, v in waits.items()})
+    return stats
+
+
+class PoolMonitor:
+    def __init__(self, db, app=None):
+        self.db = db
+        self.engines = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with app.app_context():
+            self.engines = list(self.db.engines.values())
+        os.register_at_fork(after_in_child=self.after_fork)
+        app.add_url_rule('/health', 'health', self.health_view)
+        app.extensions['db_pool'] = self
+
+    def after_fork(self):
+        # close=False leaves the parent's connections alone; the child just
+        # forgets them and opens its own
+        for engine in self.engines:
+            engine.dispose(close=False)
+
+    def health_view(self):
+        try:
+            with self.engines[0].connect() as conn:
+                conn.execute(text('SELECT 1'))
+        except exc.SQLAlchemyError as e:
+            return jsonify({'status': 'error', 'database': type(e).__name__}), 503
+        return jsonify({'status': 'ok', 'database': 'ok'})
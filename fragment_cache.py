@@ -0,0 +1,101 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Shared cache file: every gunicorn worker reads and writes the same SQLite db
+FRAGMENT_CACHE_PATH = os.environ.get(
+    'FRAGMENT_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fragment_cache.db')
+)
+
+
+def _connect():
+    conn = sqlite3.connect(FRAGMENT_CACHE_PATH, timeout=5, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS fragment_version ('
+        ' name TEXT PRIMARY KEY,'
+        ' version INTEGER NOT NULL,'
+        ' updated_at REAL NOT NULL)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS fragment ('
+        ' key TEXT PRIMARY KEY,'
+        ' name TEXT NOT NULL,'
+        ' html TEXT NOT NULL)'
+    )
+    return conn
+
+
+def version(name):
+    """``(version, updated_at)`` of a group of fragments, e.g. ``'catalogue'``.
+
+    A group seen for the first time starts at version 0, modified now.
+    """
+    try:
+        conn = _connect()
+        try:
+            conn.execute('INSERT OR IGNORE INTO fragment_version (name, version, updated_at) VALUES (?, 0, ?)',
+                         (name, time.time()))
+            return conn.execute('SELECT version, updated_at FROM fragment_version WHERE name = ?',
+                                (name,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Fragment cache version error: {e}")
+        return None
+
+
+def bump(name):
+    """Invalidate every fragment of ``name``; call after committing a change to its data."""
+    try:
+        conn = _connect()
+        try:
+            conn.execute(
+                'INSERT INTO fragment_version (name, version, updated_at) VALUES (?, 1, ?) '
+                'ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at',
+                (name, time.time())
+            )
+            conn.execute('DELETE FROM fragment WHERE name = ?', (name,))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Fragment cache bump error: {e}")
+
+
+def render(name, current, part, render_fn, salt=''):
+    """Cached HTML of fragment ``part`` of group ``name``, rendering it on a miss.
+
+    ``current`` is the group's ``version()``; ``salt`` should change whenever
+    the markup would (e.g. a digest of the template source), so a deploy
+    never serves fragments rendered by the previous templates. Without a
+    version (the cache is unavailable) the fragment is simply rendered.
+    """
+    if current is None:
+        return render_fn()
+    key = hashlib.sha256(f'{name}:{current[0]}:{part}:{salt}'.encode()).hexdigest()
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute('SELECT html FROM fragment WHERE key = ?', (key,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Fragment cache read error: {e}")
+        return render_fn()
+    if row is not None:
+        return row[0]
+    html = render_fn()
+    try:
+        conn = _connect()
+        try:
+            # A bump since ``current`` was read leaves this row unreachable until the next bump clears it
+            conn.execute('INSERT OR REPLACE INTO fragment (key, name, html) VALUES (?, ?, ?)', (key, name, html))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Fragment cache write error: {e}")
+    return html
@@ -0,0 +1,38 @@
+"""Gunicorn serving profile: ``gunicorn -c gunicorn.conf.py wsgi:application``.
+
+The app is imported once in the master (``preload_app``) and the workers are
+forked from it: they start without importing anything, and share the
+master's memory copy-on-write. Everything that must not be shared is
+created per process after the fork: database connections (db_pool.py),
+the agent's event loop, upload/oEmbed thread pools and the weather
+refresher.
+
+The agents SDK and boto3 are imported on the first chat / upload in each
+worker (see agent.py and storage.py). ``PRELOAD_SDKS=1`` imports them in
+the master instead: slower deploys, but one shared copy for all workers.
+
+Environment: ``PORT``, ``WEB_CONCURRENCY`` (workers, 4), ``GUNICORN_THREADS``
+(16), ``GUNICORN_PRELOAD`` (1), ``PRELOAD_SDKS`` (0).
+"""
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5009')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# instrumentation.py keys the metrics directory on the parent pid, which for a
+# preloaded app is the master's parent; key it on this master instead so a
+# restarted master never merges the snapshots of the previous one's workers
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'wingman-metrics', str(os.getpid())))
+
+
+def when_ready(server):
+    # Runs in the master once the app is loaded, before the workers are forked
+    if preload_app and os.environ.get('PRELOAD_SDKS') == '1':
+        import agent
+        import boto3  # noqa: F401
+        agent.load_agents()
+        server.log.info("Agents SDK and boto3 preloaded in the master")
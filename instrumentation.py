@@ -0,0 +1,362 @@
+"""Request metrics in Prometheus text format, plus a sampling profiler for slow requests.
+
+``Instrumentation(app)`` records, per endpoint:
+
+- request latency (histogram) and a request counter by status code;
+- SQL queries per request (histogram) and time spent in SQL, from
+  SQLAlchemy cursor events;
+- time spent rendering templates, per template, from Flask's signals;
+- outbound API time per upstream, reported by outbound.py.
+
+Each gunicorn worker keeps its own numbers and writes a snapshot to
+``METRICS_DIR`` at most every ``METRICS_FLUSH_INTERVAL`` seconds; ``/metrics``
+adds up the snapshots of every worker. The endpoint names, latencies and
+upstream error rates it shows are not for the public: it answers 404 unless
+``METRICS_TOKEN`` is set and sent as ``Authorization: Bearer <token>``, or
+the request comes from the machine itself (local scrapers, benchmarks).
+
+With ``SLOW_REQUEST_PROFILE_MS`` set, a background thread samples the stack
+of every in-flight request every ``PROFILE_INTERVAL_MS``; requests slower than
+the threshold have their samples written to ``PROFILE_DIR`` as folded stacks
+(one ``frame;frame;... count`` line per stack, ready for flamegraph.pl or
+speedscope).
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import tempfile
+import threading
+from collections import Counter
+from flask import Response, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import outbound
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Snapshots of all workers of one gunicorn master share a directory
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(
+    tempfile.gettempdir(), 'wingman-metrics', str(os.getppid()))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Without a token, /metrics only answers these
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+SLOW_REQUEST_PROFILE_MS = float(os.environ.get('SLOW_REQUEST_PROFILE_MS', 0))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'wingman-profiles')
+# Oldest dumps are deleted beyond this many
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+
+HELP = {
+    'wingman_http_request_duration_seconds': ('histogram', 'Request latency by endpoint.'),
+    'wingman_http_requests_total': ('counter', 'Requests by endpoint and status code.'),
+    'wingman_request_sql_queries': ('histogram', 'SQL queries per request.'),
+    'wingman_sql_duration_seconds_total': ('counter', 'Time spent in SQL, by endpoint.'),
+    'wingman_template_render_seconds': ('histogram', 'Template render time, by template.'),
+    'wingman_outbound_request_duration_seconds': ('histogram', 'Outbound API call latency, by upstream.'),
+    'wingman_outbound_events_total': ('counter', 'Outbound calls, coalesced, throttled and rejected, by upstream.'),
+    'wingman_slow_request_profiles_total': ('counter', 'Slow requests profiled, by endpoint.'),
+}
+
+
+class Registry:
+    """Counters and histograms of this process, keyed by metric name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, _label_key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets),
+                                               'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, dict(hist, counts=list(hist['counts']))]
+                               for (name, labels), hist in self.histograms.items()],
+            }
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class _RequestStats(threading.local):
+    def __init__(self):
+        self.active = False
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.outbound_time = 0.0
+        self.render_starts = []
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of registered threads from one background thread."""
+
+    def __init__(self, interval, directory):
+        self.interval = interval
+        self.directory = directory
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def begin(self):
+        self._ensure_thread()
+        with self.lock:
+            self.active[threading.get_ident()] = Counter()
+
+    def end(self):
+        with self.lock:
+            return self.active.pop(threading.get_ident(), None)
+
+    def _ensure_thread(self):
+        # Started lazily so each gunicorn worker gets its own after forking
+        if self.thread is None or self.pid != os.getpid():
+            with self.lock:
+                if self.thread is None or self.pid != os.getpid():
+                    self.pid = os.getpid()
+                    self.thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_folded(frame)] += 1
+
+    def dump(self, samples, endpoint, duration):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}-{int(duration * 1000)}ms.folded"
+        with open(os.path.join(self.directory, name.replace('/', '_')), 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        dumps = sorted(os.listdir(self.directory))
+        for old in dumps[:max(0, len(dumps) - PROFILE_KEEP)]:
+            os.remove(os.path.join(self.directory, old))
+
+
+def _folded(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Instrumentation:
+    def __init__(self, app=None):
+        self.registry = Registry()
+        self.stats = _RequestStats()
+        self.profiler = (SlowRequestProfiler(PROFILE_INTERVAL_MS / 1000, PROFILE_DIR)
+                         if SLOW_REQUEST_PROFILE_MS > 0 else None)
+        self.last_flush = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._rendered, app)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        outbound.observers.append(self._outbound_call)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['instrumentation'] = self
+
+    # --- per-request hooks ---
+
+    def _before_request(self):
+        stats = self.stats
+        stats.active = True
+        stats.started = time.perf_counter()
+        stats.sql_count = 0
+        stats.sql_time = stats.render_time = stats.outbound_time = 0.0
+        stats.status = 500
+        if self.profiler:
+            self.profiler.begin()
+
+    def _after_request(self, response):
+        self.stats.status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        stats = self.stats
+        if not stats.active:
+            return
+        stats.active = False
+        duration = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint == 'metrics':
+            if self.profiler:
+                self.profiler.end()
+            return
+        labels = {'endpoint': endpoint, 'method': request.method}
+        registry = self.registry
+        registry.observe('wingman_http_request_duration_seconds', labels, duration)
+        registry.inc('wingman_http_requests_total', dict(labels, status=str(stats.status)))
+        registry.observe('wingman_request_sql_queries', {'endpoint': endpoint}, stats.sql_count,
+                         QUERY_COUNT_BUCKETS)
+        registry.inc('wingman_sql_duration_seconds_total', {'endpoint': endpoint}, stats.sql_time)
+        if self.profiler:
+            samples = self.profiler.end()
+            if samples and duration * 1000 >= SLOW_REQUEST_PROFILE_MS:
+                self.profiler.dump(samples, endpoint, duration)
+                registry.inc('wingman_slow_request_profiles_total', {'endpoint': endpoint})
+        if time.monotonic() - self.last_flush >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if not starts or not self.stats.active:
+            if starts:
+                starts.pop()
+            return
+        self.stats.sql_count += 1
+        self.stats.sql_time += time.perf_counter() - starts.pop()
+
+    def _before_render(self, sender, template, context, **extra):
+        self.stats.render_starts.append(time.perf_counter())
+
+    def _rendered(self, sender, template, context, **extra):
+        if not self.stats.render_starts:
+            return
+        elapsed = time.perf_counter() - self.stats.render_starts.pop()
+        self.registry.observe('wingman_template_render_seconds', {'template': template.name or 'string'}, elapsed)
+        if self.stats.active:
+            self.stats.render_time += elapsed
+
+    def _outbound_call(self, upstream, elapsed, ok):
+        self.registry.observe('wingman_outbound_request_duration_seconds',
+                              {'upstream': upstream, 'result': 'ok' if ok else 'error'}, elapsed)
+        if self.stats.active:
+            self.stats.outbound_time += elapsed
+
+    def current(self):
+        """SQL/render/outbound totals of the request in progress (for logging)."""
+        stats = self.stats
+        return {'sql_queries': stats.sql_count, 'sql_seconds': stats.sql_time,
+                'render_seconds': stats.render_time, 'outbound_seconds': stats.outbound_time}
+
+    # --- exposition ---
+
+    def _snapshot(self):
+        snapshot = self.registry.snapshot()
+        # outbound.py keeps its own cumulative counters; export them as-is
+        for upstream, values in outbound.metrics().items():
+            for name in ('calls', 'coalesced', 'throttled', 'rate_limited', 'circuit_rejected', 'failures'):
+                snapshot['counters'].append(
+                    ['wingman_outbound_events_total', [['event', name], ['upstream', upstream]], values[name]])
+        return snapshot
+
+    def flush(self):
+        """Write this worker's snapshot where ``/metrics`` can merge it."""
+        self.last_flush = time.monotonic()
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def collect(self):
+        """Merged counters and histograms of every worker that has flushed."""
+        self.flush()
+        counters, histograms = {}, {}
+        try:
+            names = [name for name in os.listdir(METRICS_DIR) if name.endswith('.json')]
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                with open(os.path.join(METRICS_DIR, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, value in snapshot['counters']:
+                key = (metric, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for metric, labels, hist in snapshot['histograms']:
+                key = (metric, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, {'buckets': hist['buckets'],
+                                                     'counts': [0] * len(hist['buckets']), 'sum': 0.0, 'count': 0})
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], hist['counts'])]
+                merged['sum'] += hist['sum']
+                merged['count'] += hist['count']
+        return counters, histograms
+
+    def render(self):
+        counters, histograms = self.collect()
+        by_name = {}
+        for (metric, labels), value in counters.items():
+            by_name.setdefault(metric, []).append(f"{metric}{_labels(labels)} {_number(value)}")
+        for (metric, labels), hist in histograms.items():
+            lines = by_name.setdefault(metric, [])
+            for bound, count in zip(hist['buckets'], hist['counts']):
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {hist['count']}")
+            lines.append(f"{metric}_sum{_labels(labels)} {_number(hist['sum'])}")
+            lines.append(f"{metric}_count{_labels(labels)} {hist['count']}")
+        out = []
+        for metric in sorted(by_name):
+            kind, help_text = HELP.get(metric, ('untyped', metric))
+            out += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}", *by_name[metric]]
+        return '\n'.join(out) + '\n'
+
+    def metrics_view(self):
+        if METRICS_TOKEN:
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+                return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        elif request.remote_addr not in LOCAL_ADDRESSES:
+            return Response('Not Found\n', status=404, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
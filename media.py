@@ -0,0 +1,194 @@
+"""Image derivatives: responsive WebP sizes and a JPEG thumbnail.
+
+Uploaded photos are stored at full size as before, plus a WebP copy at each
+width in ``WIDTHS`` (never upscaled) and a small JPEG ``thumb`` for browsers
+without WebP. The URLs are recorded on the row as JSON::
+
+    {"thumb": "<url>", "webp": [[320, "<url>"], [640, "<url>"], ...]}
+
+and templates render them through the ``picture`` Jinja global.
+"""
+import io
+import os
+import json
+import functools
+from PIL import Image, ImageOps
+from markupsafe import Markup, escape
+
+WIDTHS = (320, 640, 1280)
+THUMB_WIDTH = 320
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+
+def is_image(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def variant_name(path, name):
+    """``photo.jpg`` -> ``photo.w640.webp`` / ``photo.thumb.jpg``."""
+    return f"{path.rsplit('.', 1)[0]}.{name}"
+
+
+def _encode(image, fmt, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+def _resized(image, width):
+    if image.width <= width:
+        return image
+    height = round(image.height * width / image.width)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def make_derivatives(data):
+    """Return ``[(name, bytes, content_type, width), ...]`` for an image.
+
+    ``name`` is ``w<width>.webp`` or ``thumb.jpg``. Animated GIFs and files
+    Pillow cannot read produce no derivatives and are served as uploaded.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        if getattr(image, 'is_animated', False):
+            return []
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return []
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    derivatives = []
+    for width in WIDTHS:
+        # Always keep the smallest size; skip larger ones that would only upscale
+        if width > WIDTHS[0] and width >= image.width * 1.1:
+            break
+        resized = _resized(image, width)
+        derivatives.append((f'w{width}.webp', _encode(resized, 'WEBP', quality=WEBP_QUALITY, method=4),
+                            'image/webp', resized.width))
+    thumb = _resized(image, THUMB_WIDTH).convert('RGB')
+    derivatives.append(('thumb.jpg', _encode(thumb, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True),
+                        'image/jpeg', thumb.width))
+    return derivatives
+
+
+def variants_from(derivatives, url_for_name):
+    """Build the stored variants dict; ``url_for_name(name)`` gives each URL."""
+    if not derivatives:
+        return None
+    variants = {'webp': []}
+    for name, _, _, width in derivatives:
+        if name == 'thumb.jpg':
+            variants['thumb'] = url_for_name(name)
+        else:
+            variants['webp'].append([width, url_for_name(name)])
+    return variants
+
+
+def save_local_derivatives(path, url):
+    """Write derivatives next to a locally saved image; return its variants JSON."""
+    with open(path, 'rb') as f:
+        derivatives = make_derivatives(f.read())
+    for name, data, _, _ in derivatives:
+        with open(variant_name(path, name), 'wb') as f:
+            f.write(data)
+    variants = variants_from(derivatives, lambda name: variant_name(url, name))
+    return json.dumps(variants) if variants else None
+
+
+def remove_local_derivatives(path):
+    for width in WIDTHS:
+        _remove(variant_name(path, f'w{width}.webp'))
+    _remove(variant_name(path, 'thumb.jpg'))
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _loads(variants):
+    if isinstance(variants, str):
+        try:
+            return json.loads(variants)
+        except ValueError:
+            return None
+    return variants
+
+
+def picture(url, variants=None, sizes='100vw', alt='', thumb=False, **attrs):
+    """Jinja global: a ``<picture>`` with a WebP srcset and a fallback ``<img>``.
+
+    With ``thumb=True`` the JPEG thumbnail is the fallback instead of the
+    original, for small renders. Extra keyword arguments become attributes
+    of the ``<img>`` (``class_`` for ``class``); images are lazy-loaded
+    unless ``loading`` says otherwise.
+    """
+    variants = _loads(variants) or {}
+    src = variants.get('thumb') if thumb and variants.get('thumb') else url
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    img_attrs = ''.join(
+        f' {escape(name.rstrip("_").replace("_", "-"))}="{escape(value)}"' for name, value in attrs.items()
+    )
+    img = Markup(f'<img src="{escape(src)}" alt="{escape(alt)}"{img_attrs}>')
+    webp = variants.get('webp')
+    if not webp:
+        return img
+    srcset = ', '.join(f'{escape(u)} {int(w)}w' for w, u in webp)
+    return Markup(f'<picture><source type="image/webp" srcset="{srcset}" sizes="{escape(sizes)}">{img}</picture>')
+
+
+# Static images (logo, hero) get the same treatment ahead of time via
+# ``flask media static``; derivatives live in static/img/derived/.
+STATIC_DERIVED_DIR = 'img/derived'
+
+
+def build_static_derivatives(static_folder, source_dir='img'):
+    """Create derivatives for every image in ``static/<source_dir>``; skip up-to-date ones."""
+    source = os.path.join(static_folder, source_dir)
+    target = os.path.join(static_folder, STATIC_DERIVED_DIR)
+    os.makedirs(target, exist_ok=True)
+    built = 0
+    for filename in sorted(os.listdir(source)):
+        path = os.path.join(source, filename)
+        if not (os.path.isfile(path) and is_image(filename)):
+            continue
+        manifest = os.path.join(target, variant_name(filename, 'json'))
+        if os.path.exists(manifest) and os.path.getmtime(manifest) >= os.path.getmtime(path):
+            continue
+        with open(path, 'rb') as f:
+            derivatives = make_derivatives(f.read())
+        for name, data, _, _ in derivatives:
+            with open(os.path.join(target, variant_name(filename, name)), 'wb') as f:
+                f.write(data)
+        variants = variants_from(derivatives, lambda name: variant_name(filename, name)) or {}
+        with open(manifest, 'w') as f:
+            json.dump(variants, f)
+        built += 1
+    return built
+
+
+@functools.lru_cache(maxsize=64)
+def _static_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def static_variants(static_folder, filename, url_for):
+    """Variants for ``static/<filename>`` built by ``build_static_derivatives``, or None."""
+    variants = _static_manifest(os.path.join(static_folder, STATIC_DERIVED_DIR,
+                                             variant_name(os.path.basename(filename), 'json')))
+    if not variants:
+        return None
+    to_url = lambda name: url_for('static', filename=f'{STATIC_DERIVED_DIR}/{name}')
+    result = {'webp': [[w, to_url(name)] for w, name in variants.get('webp', [])]}
+    if variants.get('thumb'):
+        result['thumb'] = to_url(variants['thumb'])
+    return result
@@ -0,0 +1,34 @@
+"""Add chat_message for per-user agent conversation history
+
+Revision ID: 20261006_add_chat_message
+Revises: 20261005_add_image_variants
+Create Date: 2026-10-06
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261006_add_chat_message'
+down_revision = '20261005_add_image_variants'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chat_message',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('role', sa.String(length=10), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_chat_message_user_id_id', 'chat_message', ['user_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_chat_message_user_id_id', table_name='chat_message')
+    op.drop_table('chat_message')
@@ -0,0 +1,36 @@
+"""Add image variant columns for resized WebP/thumbnail derivatives
+
+Revision ID: 20261005_add_image_variants
+Revises: 20261004_session_image_status
+Create Date: 2026-10-05
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261005_add_image_variants'
+down_revision = '20261004_session_image_status'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_picture_variants', sa.Text(), nullable=True))
+    with op.batch_alter_table('session_image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('variants', sa.Text(), nullable=True))
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_variants', sa.Text(), nullable=True))
+    with op.batch_alter_table('product_image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('variants', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('product_image', schema=None) as batch_op:
+        batch_op.drop_column('variants')
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('image_variants')
+    with op.batch_alter_table('session_image', schema=None) as batch_op:
+        batch_op.drop_column('variants')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('profile_picture_variants')
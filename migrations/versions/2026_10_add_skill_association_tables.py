@@ -0,0 +1,142 @@
+"""Replace JSON skill columns with session_skill and user_skill tables
+
+Revision ID: 20261002_add_skill_association_tables
+Revises: 20261001_add_training_summary
+Create Date: 2026-10-02
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261002_add_skill_association_tables'
+down_revision = '20261001_add_training_summary'
+branch_labels = None
+depends_on = None
+
+
+def _parse_skill_refs(value, skill_by_name, skill_ids):
+    """Skill ids from a JSON list of ids, or a comma separated list of ids/names."""
+    if not value:
+        return []
+    try:
+        refs = json.loads(value)
+        if not isinstance(refs, list):
+            refs = [refs]
+    except (ValueError, TypeError):
+        refs = value.split(',')
+    ids = []
+    for ref in refs:
+        ref = str(ref).strip()
+        if ref.isdigit() and int(ref) in skill_ids:
+            ids.append(int(ref))
+        elif ref.lower() in skill_by_name:
+            ids.append(skill_by_name[ref.lower()])
+    return list(dict.fromkeys(ids))
+
+
+def _parse_ratings(value):
+    try:
+        ratings = json.loads(value) if value else {}
+    except (ValueError, TypeError):
+        return {}
+    if not isinstance(ratings, dict):
+        return {}
+    parsed = {}
+    for key, rating in ratings.items():
+        try:
+            parsed[int(key)] = int(rating)
+        except (ValueError, TypeError):
+            continue
+    return parsed
+
+
+def upgrade():
+    session_skill = op.create_table(
+        'session_skill',
+        sa.Column('session_id', sa.Integer(), sa.ForeignKey('session.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('skill_id', sa.Integer(), sa.ForeignKey('skill.id'), nullable=False),
+        sa.Column('rating', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('session_id', 'skill_id')
+    )
+    op.create_index('ix_session_skill_skill_id_session_id', 'session_skill', ['skill_id', 'session_id'])
+    user_skill = op.create_table(
+        'user_skill',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('skill_id', sa.Integer(), sa.ForeignKey('skill.id'), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id', 'skill_id')
+    )
+    op.create_index('ix_user_skill_user_id_status', 'user_skill', ['user_id', 'status'])
+
+    # Backfill from the JSON / comma separated text columns
+    conn = op.get_bind()
+    skills = conn.execute(sa.text('SELECT id, name FROM skill')).fetchall()
+    skill_ids = {row[0] for row in skills}
+    skill_by_name = {row[1].strip().lower(): row[0] for row in skills}
+
+    session_rows = []
+    for session_id, skills_json, ratings_json in conn.execute(
+            sa.text('SELECT id, skills, skill_ratings FROM session')):
+        ratings = _parse_ratings(ratings_json)
+        for skill_id in _parse_skill_refs(skills_json, skill_by_name, skill_ids):
+            session_rows.append({'session_id': session_id, 'skill_id': skill_id, 'rating': ratings.get(skill_id)})
+    if session_rows:
+        op.bulk_insert(session_skill, session_rows)
+
+    user_rows = []
+    for user_id, in_progress, mastered in conn.execute(
+            sa.text('SELECT id, skills_in_progress, skills_mastered FROM "user"')):
+        statuses = {}
+        for skill_id in _parse_skill_refs(in_progress, skill_by_name, skill_ids):
+            statuses[skill_id] = 'in_progress'
+        # A skill listed as both counts as mastered
+        for skill_id in _parse_skill_refs(mastered, skill_by_name, skill_ids):
+            statuses[skill_id] = 'mastered'
+        user_rows.extend({'user_id': user_id, 'skill_id': skill_id, 'status': status}
+                         for skill_id, status in statuses.items())
+    if user_rows:
+        op.bulk_insert(user_skill, user_rows)
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.drop_column('skill_ratings')
+        batch_op.drop_column('skills')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('skills_mastered')
+        batch_op.drop_column('skills_in_progress')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('skills_in_progress', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('skills_mastered', sa.Text(), nullable=True))
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('skills', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('skill_ratings', sa.Text(), nullable=True))
+
+    conn = op.get_bind()
+    by_session = {}
+    for session_id, skill_id, rating in conn.execute(
+            sa.text('SELECT session_id, skill_id, rating FROM session_skill')):
+        by_session.setdefault(session_id, {})[str(skill_id)] = rating
+    for session_id, ratings in by_session.items():
+        conn.execute(
+            sa.text('UPDATE session SET skills = :skills, skill_ratings = :ratings WHERE id = :id'),
+            {'skills': json.dumps([int(k) for k in ratings]),
+             'ratings': json.dumps({k: v for k, v in ratings.items() if v is not None}),
+             'id': session_id}
+        )
+    by_user = {}
+    for user_id, skill_id, status in conn.execute(sa.text('SELECT user_id, skill_id, status FROM user_skill')):
+        by_user.setdefault(user_id, {'in_progress': [], 'mastered': []})[status].append(skill_id)
+    for user_id, lists in by_user.items():
+        conn.execute(
+            sa.text('UPDATE "user" SET skills_in_progress = :in_progress, skills_mastered = :mastered WHERE id = :id'),
+            {'in_progress': json.dumps(lists['in_progress']), 'mastered': json.dumps(lists['mastered']), 'id': user_id}
+        )
+
+    op.drop_index('ix_user_skill_user_id_status', table_name='user_skill')
+    op.drop_table('user_skill')
+    op.drop_index('ix_session_skill_skill_id_session_id', table_name='session_skill')
+    op.drop_table('session_skill')
@@ -0,0 +1,39 @@
+"""Add training_summary table with per-user session totals
+
+Revision ID: 20261001_add_training_summary
+Revises: 83a9e7010de6
+Create Date: 2026-10-01
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261001_add_training_summary'
+down_revision = '83a9e7010de6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'training_summary',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+        sa.Column('sport_type', sa.String(), nullable=False),
+        sa.Column('location', sa.String(), nullable=False, server_default=''),
+        sa.Column('sessions', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('minutes', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('rating_sum', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('rated_sessions', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('user_id', 'sport_type', 'location')
+    )
+    # Backfill from the existing sessions
+    op.execute(
+        "INSERT INTO training_summary (user_id, sport_type, location, sessions, minutes, rating_sum, rated_sessions) "
+        "SELECT user_id, sport_type, COALESCE(location, ''), COUNT(id), COALESCE(SUM(duration), 0), "
+        "COALESCE(SUM(rating), 0), COUNT(rating) "
+        "FROM session GROUP BY user_id, sport_type, COALESCE(location, '')"
+    )
+
+
+def downgrade():
+    op.drop_table('training_summary')
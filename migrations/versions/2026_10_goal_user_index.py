@@ -0,0 +1,21 @@
+"""Index goals by user for the profile, admin and agent lookups
+
+Revision ID: 20261007_goal_user_index
+Revises: 20261006_add_chat_message
+Create Date: 2026-10-07
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '20261007_goal_user_index'
+down_revision = '20261006_add_chat_message'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_goal_user_id_id', 'goal', ['user_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_goal_user_id_id', table_name='goal')
@@ -0,0 +1,30 @@
+"""Add product.category and the indexes behind the paginated catalogue
+
+Revision ID: 20261009_product_catalogue
+Revises: 20261008_youtube_video_cache
+Create Date: 2026-10-09
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261009_product_catalogue'
+down_revision = '20261008_youtube_video_cache'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('category', sa.String(length=50), nullable=True))
+    op.create_index('ix_product_available_created', 'product', ['is_available', 'created_at'])
+    op.create_index('ix_product_category_created', 'product', ['category', 'created_at'])
+    op.create_index('ix_product_image_product_id', 'product_image', ['product_id'])
+
+
+def downgrade():
+    op.drop_index('ix_product_image_product_id', table_name='product_image')
+    op.drop_index('ix_product_category_created', table_name='product')
+    op.drop_index('ix_product_available_created', table_name='product')
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('category')
@@ -0,0 +1,91 @@
+"""Convert session.date to a DATE column with a (user_id, date) index
+
+Revision ID: 20261003_session_date_type
+Revises: 20261002_add_skill_association_tables
+Create Date: 2026-10-03
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261003_session_date_type'
+down_revision = '20261002_add_skill_association_tables'
+branch_labels = None
+depends_on = None
+
+# Formats seen in session.date: the HTML date input (YYYY-MM-DD), stray
+# timestamps starting with one, and DD/MM/YYYY. Anything else becomes
+# 1970-01-01: an unreadable date is better than losing the session.
+UNREADABLE = "'1970-01-01'"
+
+
+def _sqlite_valid(iso):
+    # date() alone accepts days up to 31 in any month; a +0 days shift normalises them
+    return f"CASE WHEN date({iso}, '+0 days') = {iso} THEN {iso} END"
+
+
+SQLITE_CONVERT = f"""
+UPDATE session SET date_value = COALESCE(
+    {_sqlite_valid("substr(trim(date), 1, 10)")},
+    CASE WHEN trim(date) GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]' THEN
+        {_sqlite_valid("substr(trim(date), 7, 4) || '-' || substr(trim(date), 4, 2) || '-' || substr(trim(date), 1, 2)")}
+    END,
+    {UNREADABLE})
+"""
+
+# to_date raises on a day the month does not have; the first of the month
+# plus the days never does, and days past the end of the month spill over
+# into the next one and fail the check
+POSTGRES_CONVERT = f"""
+UPDATE session SET date_value = COALESCE(
+    CASE WHEN EXTRACT(DAY FROM p.month_start + (p.day_of_month - 1)) = p.day_of_month
+         THEN p.month_start + (p.day_of_month - 1) END,
+    DATE {UNREADABLE})
+FROM (
+    SELECT id,
+           make_date(CAST(COALESCE(iso[1], dmy[3]) AS INTEGER), CAST(COALESCE(iso[2], dmy[2]) AS INTEGER), 1)
+               AS month_start,
+           CAST(COALESCE(iso[3], dmy[1]) AS INTEGER) AS day_of_month
+    FROM (
+        SELECT id,
+               regexp_match(trim(CAST(date AS VARCHAR)),
+                            '^([1-9][0-9]{{3}})-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])') AS iso,
+               regexp_match(trim(CAST(date AS VARCHAR)),
+                            '^(0[1-9]|[12][0-9]|3[01])/(0[1-9]|1[0-2])/([1-9][0-9]{{3}})$') AS dmy
+        FROM session
+    ) matches
+) p
+WHERE p.id = session.id
+"""
+
+
+def upgrade():
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('date_value', sa.Date(), nullable=True))
+
+    # One set-based UPDATE rather than a round trip per session
+    conn = op.get_bind()
+    conn.execute(sa.text(POSTGRES_CONVERT if conn.dialect.name == 'postgresql' else SQLITE_CONVERT))
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.drop_column('date')
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.alter_column('date_value', new_column_name='date', existing_type=sa.Date(), nullable=False)
+
+    op.create_index('ix_session_user_id_date', 'session', ['user_id', 'date'])
+
+
+def downgrade():
+    op.drop_index('ix_session_user_id_date', table_name='session')
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('date_text', sa.String(), nullable=True))
+
+    op.execute('UPDATE session SET date_text = CAST(date AS VARCHAR)')
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.drop_column('date')
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.alter_column('date_text', new_column_name='date', existing_type=sa.String(), nullable=False)
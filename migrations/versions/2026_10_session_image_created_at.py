@@ -0,0 +1,26 @@
+"""Add session_image.created_at so stale pending uploads can be expired
+
+Revision ID: 20261010_session_image_created_at
+Revises: 20261009_product_catalogue
+Create Date: 2026-10-10
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261010_session_image_created_at'
+down_revision = '20261009_product_catalogue'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite cannot add a column with a CURRENT_TIMESTAMP default, so fill it afterwards
+    with op.batch_alter_table('session_image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE session_image SET created_at = CURRENT_TIMESTAMP')
+
+
+def downgrade():
+    with op.batch_alter_table('session_image', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
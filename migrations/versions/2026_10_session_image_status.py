@@ -0,0 +1,24 @@
+"""Add session_image.status for deferred uploads
+
+Revision ID: 20261004_session_image_status
+Revises: 20261003_session_date_type
+Create Date: 2026-10-04
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261004_session_image_status'
+down_revision = '20261003_session_date_type'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('session_image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=10), nullable=False, server_default='ready'))
+
+
+def downgrade():
+    with op.batch_alter_table('session_image', schema=None) as batch_op:
+        batch_op.drop_column('status')
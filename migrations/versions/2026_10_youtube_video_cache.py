@@ -0,0 +1,62 @@
+"""Add youtube_video oEmbed cache and learning_material.video_id
+
+Revision ID: 20261008_youtube_video_cache
+Revises: 20261007_goal_user_index
+Create Date: 2026-10-08
+"""
+import re
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261008_youtube_video_cache'
+down_revision = '20261007_goal_user_index'
+branch_labels = None
+depends_on = None
+
+# Same forms as youtube.video_id: watch?v=, youtu.be/, /shorts/, /embed/, /live/
+VIDEO_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+
+def upgrade():
+    op.create_table(
+        'youtube_video',
+        sa.Column('video_id', sa.String(length=20), nullable=False),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('thumbnail_url', sa.String(), nullable=True),
+        sa.Column('status', sa.String(length=10), nullable=False, server_default='ok'),
+        sa.Column('fetched_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('video_id')
+    )
+    with op.batch_alter_table('learning_material', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('video_id', sa.String(length=20), nullable=True))
+    op.create_index('ix_learning_material_video_id', 'learning_material', ['video_id'])
+
+    # Backfill ids, and seed the cache with titles already fetched so the
+    # bulk enrichment command only has to look up what is missing
+    conn = op.get_bind()
+    seeded = set()
+    rows = conn.execute(sa.text('SELECT id, url, title, thumbnail_url FROM learning_material')).fetchall()
+    for material_id, url, title, thumbnail_url in rows:
+        match = VIDEO_ID_RE.search(url or '')
+        if not match:
+            continue
+        video_id = match.group(1)
+        conn.execute(sa.text('UPDATE learning_material SET video_id = :video_id WHERE id = :id'),
+                     {'video_id': video_id, 'id': material_id})
+        if title and video_id not in seeded:
+            seeded.add(video_id)
+            conn.execute(
+                sa.text('INSERT INTO youtube_video (video_id, title, thumbnail_url, status, fetched_at) '
+                        'VALUES (:video_id, :title, :thumbnail_url, :status, :fetched_at)'),
+                {'video_id': video_id, 'title': title, 'thumbnail_url': thumbnail_url,
+                 'status': 'ok', 'fetched_at': datetime.utcnow()}
+            )
+
+
+def downgrade():
+    op.drop_index('ix_learning_material_video_id', table_name='learning_material')
+    with op.batch_alter_table('learning_material', schema=None) as batch_op:
+        batch_op.drop_column('video_id')
+    op.drop_table('youtube_video')
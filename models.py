@@ -15,6 +15,7 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     name = db.Column(db.String(100))
     profile_picture = db.Column(db.String(200))
+    profile_picture_variants = db.Column(db.Text)  # JSON, see media.py
     is_admin = db.Column(db.Boolean, nullable=False, default=False)
     nationality = db.Column(db.String(100))
     age = db.Column(db.Integer)
@@ -22,28 +23,28 @@ class User(db.Model):
     location = db.Column(db.String)
     wingfoiling_since = db.Column(db.String)
     wingfoil_level = db.Column(db.String)
-    # JSON array of skill IDs currently being learned
-    skills_in_progress = db.Column(db.Text)
-    skills_mastered = db.Column(db.Text)
     # Link to levels table
     wingfoil_level_id = db.Column(db.Integer, db.ForeignKey('level.id'), nullable=True)
     level = db.relationship('Level', backref=db.backref('users', lazy=True))
     # One user has many sessions
     sessions = db.relationship('Session', backref='user', cascade='all, delete-orphan')
+    training_summary = db.relationship('TrainingSummary', cascade='all, delete-orphan')
+    # Skills the user is learning or has mastered
+    skill_statuses = db.relationship('UserSkill', backref='user', cascade='all, delete-orphan')
+    # Chat history, only ever queried directly (see agent.py)
+    chat_messages = db.relationship('ChatMessage', cascade='all, delete-orphan', lazy='dynamic')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Session(db.Model):
     __tablename__ = 'session'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    date = db.Column(db.String, nullable=False)
+    date = db.Column(db.Date, nullable=False)
     sport_type = db.Column(db.String, nullable=False)
     duration = db.Column(db.Integer, nullable=False)
     rating = db.Column(db.Integer)
     location = db.Column(db.String)
     notes = db.Column(db.Text)
-    skills = db.Column(db.Text)
-    skill_ratings = db.Column(db.Text)
     achievements = db.Column(db.Text)
     challenges = db.Column(db.Text)
     conditions = db.Column(db.Text)
@@ -54,16 +55,38 @@ class Session(db.Model):
     # Feedback fields
     instructor_feedback = db.Column(db.Text)
     student_feedback = db.Column(db.Text)
+    # Skills practiced in this session, with their ratings
+    skill_links = db.relationship('SessionSkill', backref='session', cascade='all, delete-orphan')
     # Relationship to session images
     images = db.relationship('SessionImage', backref='session', cascade='all, delete-orphan')
     # Relationship to learning materials
     learning_materials = db.relationship('LearningMaterial', backref='session', lazy='dynamic', cascade='all, delete-orphan')
+    # Per-user listings and date windows are range scans on this index
+    __table_args__ = (db.Index('ix_session_user_id_date', 'user_id', 'date'),)
+
+# Per-user running totals of sessions, one row per (sport_type, location).
+# Kept up to date incrementally when sessions are logged, edited or deleted
+# so the training dashboard never aggregates the full history.
+class TrainingSummary(db.Model):
+    __tablename__ = 'training_summary'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    sport_type = db.Column(db.String, primary_key=True)
+    location = db.Column(db.String, primary_key=True, default='')
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rated_sessions = db.Column(db.Integer, nullable=False, default=0)
 
 class SessionImage(db.Model):
     __tablename__ = 'session_image'
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('session.id'), nullable=False)
     url = db.Column(db.String, nullable=False)
+    # 'pending' while a deferred upload is still in flight, then 'ready' or 'failed'
+    status = db.Column(db.String(10), nullable=False, default='ready', server_default='ready')
+    variants = db.Column(db.Text)  # JSON: resized WebP/thumbnail URLs, see media.py
+    # Pending rows older than storage.PENDING_UPLOAD_TIMEOUT are given up on
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 # Skill model
 class Skill(db.Model):
@@ -74,6 +97,26 @@ class Skill(db.Model):
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Skill practiced in a session, with the student's 1-5 rating
+class SessionSkill(db.Model):
+    __tablename__ = 'session_skill'
+    session_id = db.Column(db.Integer, db.ForeignKey('session.id', ondelete='CASCADE'), primary_key=True)
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill.id'), primary_key=True)
+    rating = db.Column(db.Integer)
+    skill = db.relationship('Skill')
+    # "Sessions where I practiced X" looks up by skill first
+    __table_args__ = (db.Index('ix_session_skill_skill_id_session_id', 'skill_id', 'session_id'),)
+
+# Skill status for a user: 'in_progress' or 'mastered'
+class UserSkill(db.Model):
+    __tablename__ = 'user_skill'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill.id'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    skill = db.relationship('Skill')
+    __table_args__ = (db.Index('ix_user_skill_user_id_status', 'user_id', 'status'),)
+
 # Goal model: track user-defined goals
 class Goal(db.Model):
     __tablename__ = 'goal'
@@ -84,6 +127,8 @@ class Goal(db.Model):
     due_date = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref=db.backref('goals', lazy=True))
+    # Goals are always listed per user, newest first
+    __table_args__ = (db.Index('ix_goal_user_id_id', 'user_id', 'id'),)
 
 # Level model: track wingfoil progression
 class Level(db.Model):
@@ -100,10 +145,23 @@ class LearningMaterial(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('session.id'), nullable=False)
     url = db.Column(db.String, nullable=False) # YouTube URL
+    # Parsed from url; title/thumbnail are filled from YouTubeVideo in the background
+    video_id = db.Column(db.String(20), index=True)
     title = db.Column(db.String) # Extracted title
     thumbnail_url = db.Column(db.String) # Extracted thumbnail
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# oEmbed details per YouTube video, fetched once and shared by every
+# LearningMaterial linking to it (see youtube.py)
+class YouTubeVideo(db.Model):
+    __tablename__ = 'youtube_video'
+    video_id = db.Column(db.String(20), primary_key=True)
+    title = db.Column(db.String)
+    thumbnail_url = db.Column(db.String)
+    # 'ok', or 'missing' when oEmbed says the video is private or gone
+    status = db.Column(db.String(10), nullable=False, default='ok')
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # Product (Gear) model for sport equipment
 class Product(db.Model):
     __tablename__ = 'product'
@@ -112,15 +170,37 @@ class Product(db.Model):
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Numeric(10, 2), nullable=False)
     image_url = db.Column(db.String(255), nullable=True)
+    image_variants = db.Column(db.Text)  # JSON, see media.py
+    category = db.Column(db.String(50))
     is_available = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     # Relationship: one product has many images
     images = db.relationship('ProductImage', backref='product', cascade='all, delete-orphan', lazy=True)
+    # The catalogue lists available products newest first, optionally by category
+    __table_args__ = (
+        db.Index('ix_product_available_created', 'is_available', 'created_at'),
+        db.Index('ix_product_category_created', 'category', 'created_at'),
+    )
 
 # Product Image model
 class ProductImage(db.Model):
     __tablename__ = 'product_image'
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    image_url = db.Column(db.String, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False, index=True)
+    image_url = db.Column(db.Text, nullable=False)
+    variants = db.Column(db.Text)  # JSON, see media.py
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Chat history with the instructor agent. role is 'user', 'assistant' or
+# 'summary' (a single compacted digest of older turns, see agent.py)
+class ChatMessage(db.Model):
+    __tablename__ = 'chat_message'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    role = db.Column(db.String(10), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # History is always read newest-first for one user
+    __table_args__ = (db.Index('ix_chat_message_user_id_id', 'user_id', 'id'),)
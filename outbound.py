@@ -0,0 +1,322 @@
+"""Shared layer for calls to third-party APIs (Met.no, YouTube oEmbed, OpenAI).
+
+Every upstream gets, per worker process:
+
+- a token bucket, so a burst of traffic is smoothed to ``rate`` calls per
+  second (``burst`` at once) instead of hitting the upstream all together;
+- single-flight coalescing: identical calls already in flight are joined
+  rather than repeated, and every caller gets the same result;
+- a circuit breaker that fails fast for ``reset_timeout`` seconds after
+  ``failure_threshold`` consecutive failures, then lets one trial call through;
+- a pooled ``requests.Session`` for HTTP upstreams;
+- counters exposed by ``metrics()``.
+
+Limits are per process, so the effective limit is ``rate`` times the number
+of gunicorn workers. Each can be tuned with ``<NAME>_RATE``, ``<NAME>_BURST``
+and ``<NAME>_MAX_WAIT`` environment variables, e.g. ``YOUTUBE_RATE=2``.
+"""
+import os
+import time
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """Call refused locally: circuit open or rate limit wait too long.
+
+    A ``RequestException`` so existing ``except RequestException`` handlers
+    treat it like any other failed request.
+    """
+
+
+class CircuitOpen(UpstreamUnavailable):
+    pass
+
+
+class RateLimited(UpstreamUnavailable):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """Take a token; return how long to wait before using it, or None if over ``max_wait``."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open trial slot whose call never reached the upstream."""
+        with self._lock:
+            self._trial = False
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                # A failed trial call re-opens the circuit for another period
+                self.opened_at = time.monotonic()
+
+
+# Called as ``observer(upstream_name, seconds, ok)`` after every call (see instrumentation.py)
+observers = []
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Upstream:
+    def __init__(self, name, rate, burst, max_wait=2.0, failure_threshold=5, reset_timeout=30,
+                 pool_size=10):
+        prefix = name.upper()
+        self.name = name
+        self.bucket = TokenBucket(float(os.environ.get(f'{prefix}_RATE', rate)),
+                                  float(os.environ.get(f'{prefix}_BURST', burst)))
+        self.max_wait = float(os.environ.get(f'{prefix}_MAX_WAIT', max_wait))
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.pool_size = pool_size
+        self._session = None
+        self._session_pid = None
+        self._adapter = None
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('calls', 'coalesced', 'throttled', 'rate_limited', 'circuit_rejected',
+             'successes', 'failures'), 0)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def session(self):
+        # Created after fork so workers never share sockets
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = self._adapter or HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session, self._session_pid = session, os.getpid()
+            return self._session
+
+    def mount(self, adapter):
+        """Send this upstream's HTTP calls through ``adapter`` (e.g. canned responses in benchmarks)."""
+        with self._lock:
+            self._adapter = adapter
+            self._session = None
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _admit(self):
+        """Check the breaker and take a token; return the wait in seconds."""
+        if not self.breaker.allow():
+            self._count('circuit_rejected')
+            raise CircuitOpen(f'{self.name} circuit open')
+        wait = self.bucket.reserve(self.max_wait)
+        if wait is None:
+            self.breaker.release()
+            self._count('rate_limited')
+            raise RateLimited(f'{self.name} rate limit exceeded')
+        if wait:
+            self._count('throttled')
+        return wait
+
+    def _finish(self, started, ok):
+        elapsed = time.monotonic() - started
+        self.breaker.record(ok)
+        with self._lock:
+            self.counters['successes' if ok else 'failures'] += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+        for observer in observers:
+            observer(self.name, elapsed, ok)
+
+    def call(self, fn, key=None, is_failure=None):
+        """Run ``fn()`` under this upstream's limits; coalesce calls sharing ``key``.
+
+        ``is_failure(result)`` marks a returned value as a failure for the
+        circuit breaker (e.g. a 5xx response); exceptions always are.
+        """
+        if key is None:
+            return self._call(fn, is_failure)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count('coalesced')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._call(fn, is_failure)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _call(self, fn, is_failure):
+        wait = self._admit()
+        if wait:
+            time.sleep(wait)
+        self._count('calls')
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception:
+            self._finish(started, False)
+            raise
+        self._finish(started, not (is_failure and is_failure(result)))
+        return result
+
+    def get(self, url, key=None, **kwargs):
+        """``requests.get`` through the pooled session; identical GETs are coalesced."""
+        if key is None:
+            params = kwargs.get('params') or {}
+            key = (url, tuple(sorted(params.items())), tuple(sorted((kwargs.get('headers') or {}).items())))
+        return self.call(lambda: self.session.get(url, **kwargs), key=key, is_failure=_server_error)
+
+    async def acall(self, factory, key=None, timeout=None):
+        """Async ``call`` for code running on an event loop (the agent's).
+
+        ``factory()`` returns the coroutine to run. Coalesced callers share one
+        task, which is only cancelled once every caller has gone away.
+
+        ``timeout`` (seconds, including any rate limit wait) is enforced here
+        rather than by the caller: a call that runs past it raises
+        ``asyncio.TimeoutError`` and counts as a failure for the circuit
+        breaker, whereas a caller cancelling its wait says nothing about the
+        upstream's health.
+        """
+        if key is None:
+            return await self._acall(factory, timeout)
+        flight = self._async_flights.get(key)
+        if flight is None:
+            flight = self._async_flights[key] = [asyncio.ensure_future(self._acall(factory, timeout)), 0]
+            flight[0].add_done_callback(lambda _: self._async_flights.pop(key, None))
+        else:
+            self._count('coalesced')
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        except asyncio.CancelledError:
+            flight[1] -= 1
+            if flight[1] == 0:
+                flight[0].cancel()
+            raise
+
+    async def _acall(self, factory, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # From here on every path must record or release, or a half-open
+        # trial slot taken by _admit would keep the circuit open for good
+        wait = self._admit()
+        started = None
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+            self._count('calls')
+            started = time.monotonic()
+            result = await asyncio.wait_for(factory(), None if deadline is None else max(0.0, deadline - started))
+        except asyncio.CancelledError:
+            # The caller gave up; that says nothing about the upstream's health
+            self.breaker.release()
+            raise
+        except Exception:
+            if started is None:
+                self.breaker.release()
+            else:
+                # Includes running past ``timeout``
+                self._finish(started, False)
+            raise
+        self._finish(started, True)
+        return result
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+            finished = counters['successes'] + counters['failures']
+            return {
+                **counters,
+                'in_flight': len(self._flights) + len(self._async_flights),
+                'circuit': self.breaker.state,
+                'consecutive_failures': self.breaker.failures,
+                'avg_latency_ms': round(self.latency_total / finished * 1000, 1) if finished else None,
+                'max_latency_ms': round(self.latency_max * 1000, 1),
+                'rate_per_sec': self.bucket.rate,
+                'burst': self.bucket.burst,
+            }
+
+
+def _server_error(response):
+    return response.status_code >= 500 or response.status_code == 429
+
+
+# Met.no asks for at most 20 requests/second per application
+metno = Upstream('metno', rate=5, burst=5, max_wait=10)
+youtube = Upstream('youtube', rate=5, burst=10, max_wait=2)
+# Agent runs last seconds, so the limit is on starts; waits are bounded by AGENT_TIMEOUT
+openai = Upstream('openai', rate=10, burst=20, max_wait=5, failure_threshold=5, reset_timeout=20)
+
+UPSTREAMS = {upstream.name: upstream for upstream in (metno, youtube, openai)}
+
+
+def metrics():
+    """Per-upstream counters for this worker process."""
+    return {name: upstream.metrics() for name, upstream in UPSTREAMS.items()}
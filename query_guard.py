@@ -0,0 +1,173 @@
+"""N+1 query detection and per-endpoint query budgets for development and tests.
+
+``QueryGuard(app)`` counts the SQL statements each request runs. Because
+statements are parameterised, a relationship loaded lazily inside a loop
+shows up as the same statement text executed again and again; once one
+exceeds ``SQL_REPEAT_THRESHOLD`` repetitions, or the request exceeds its
+query budget, the guard reports it together with the line of app code or
+template that issued the query.
+
+``SQL_N_PLUS_ONE`` (config or environment) chooses what happens:
+``'warn'`` logs a warning, ``'raise'`` raises ``QueryBudgetExceeded`` so the
+request fails, ``'off'`` disables the checks. Unset, it is ``'raise'`` when
+``TESTING`` is on, ``'warn'`` in debug mode and off otherwise. Raising waits
+until the view has returned (or the ``assert_max_queries`` block has ended),
+so the statement that crossed the limit never leaves a transaction half done.
+
+Budgets: ``SQL_QUERY_BUDGET`` applies to every endpoint; ``@query_budget(n)``
+on a view overrides it. In tests, ``with guard.assert_max_queries(n):``
+checks any block of code, with or without a request.
+"""
+import os
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    """Allow a view at most ``max_queries`` SQL statements per request."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+class _Tracker:
+    def __init__(self, mode, threshold, budget, label):
+        self.mode = mode
+        self.threshold = threshold
+        self.budget = budget
+        self.label = label
+        self.total = 0
+        self.statements = Counter()
+        self.problems = []
+
+    def record(self, statement):
+        self.total += 1
+        self.statements[statement] += 1
+        problems = []
+        if self.threshold and self.statements[statement] == self.threshold + 1:
+            problems.append(f"possible N+1 in {self.label}: statement repeated more than "
+                            f"{self.threshold} times: {_short(statement)}")
+        if self.budget is not None and self.total == self.budget + 1:
+            problems.append(f"{self.label} exceeded its budget of {self.budget} queries")
+        return problems
+
+    def check(self):
+        if self.problems:
+            raise QueryBudgetExceeded('; '.join(self.problems))
+
+    def summary(self):
+        repeated = ', '.join(f"{count}x {_short(statement, 80)}"
+                             for statement, count in self.statements.most_common(3) if count > 1)
+        return f"{self.total} queries" + (f" (most repeated: {repeated})" if repeated else '')
+
+
+class QueryGuard:
+    def __init__(self, app=None):
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_N_PLUS_ONE', os.environ.get('SQL_N_PLUS_ONE'))
+        app.config.setdefault('SQL_REPEAT_THRESHOLD', int(os.environ.get('SQL_REPEAT_THRESHOLD', 5)))
+        budget = os.environ.get('SQL_QUERY_BUDGET')
+        app.config.setdefault('SQL_QUERY_BUDGET', int(budget) if budget else None)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.extensions['query_guard'] = self
+
+    @staticmethod
+    def mode(app):
+        mode = app.config.get('SQL_N_PLUS_ONE')
+        if mode is None:
+            mode = 'raise' if app.testing else 'warn' if app.debug else 'off'
+        return None if mode == 'off' else mode
+
+    def _trackers(self):
+        if not hasattr(self._local, 'trackers'):
+            self._local.trackers = []
+        return self._local.trackers
+
+    def _before_request(self):
+        app = current_app
+        mode = self.mode(app)
+        self._local.request = None
+        if not mode:
+            return
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', app.config.get('SQL_QUERY_BUDGET'))
+        tracker = _Tracker(mode, app.config.get('SQL_REPEAT_THRESHOLD'), budget,
+                           f"{request.method} {request.endpoint or request.path}")
+        self._local.request = tracker
+        self._trackers().append(tracker)
+
+    def _after_request(self, response):
+        tracker = getattr(self._local, 'request', None)
+        if tracker is not None:
+            response.headers['X-SQL-Queries'] = str(tracker.total)
+            tracker.check()
+        return response
+
+    def _teardown_request(self, exc):
+        tracker = getattr(self._local, 'request', None)
+        if tracker is not None:
+            self._local.request = None
+            self._trackers().remove(tracker)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        trackers = getattr(self._local, 'trackers', None)
+        if not trackers:
+            return
+        for tracker in list(trackers):
+            for problem in tracker.record(statement):
+                message = f"{problem} [at {_caller()}]"
+                if tracker.mode == 'raise':
+                    # Raising here would abort the statement's caller midway
+                    tracker.problems.append(message)
+                else:
+                    current_app.logger.warning(message)
+
+    @contextmanager
+    def assert_max_queries(self, max_queries, repeat_threshold=None):
+        """Fail if the block runs more than ``max_queries`` statements.
+
+        ``repeat_threshold`` also fails it if one statement repeats more
+        often than that. Raises on leaving the block, unless the block
+        raised first.
+        """
+        tracker = _Tracker('raise', repeat_threshold, max_queries, 'block')
+        self._trackers().append(tracker)
+        try:
+            yield tracker
+        finally:
+            self._trackers().remove(tracker)
+        tracker.check()
+
+
+def _short(statement, limit=160):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit - 1] + '…'
+
+
+def _caller():
+    """Innermost frame from the app's own code or templates, e.g. ``app.py:512 in stats``."""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(APP_ROOT) and 'site-packages' not in filename \
+                and not filename.endswith(('query_guard.py', 'instrumentation.py')):
+            return f"{os.path.relpath(filename, APP_ROOT)}:{frame.lineno} in {frame.name}"
+    return 'unknown'
@@ -0,0 +1,257 @@
+import os
+import re
+import math
+import time
+import struct
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Shared cache file: every gunicorn worker reads and writes the same SQLite db
+CHAT_CACHE_PATH = os.environ.get(
+    'CHAT_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_cache.db')
+)
+# How long a cached answer stays valid (seconds)
+CHAT_CACHE_TTL = int(os.environ.get('CHAT_CACHE_TTL', 7 * 24 * 3600))
+# Least recently used entries are evicted beyond this many
+CHAT_CACHE_MAX_ENTRIES = int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', 2000))
+# Cosine similarity needed to reuse the answer to a differently worded
+# question; 0 (the default) disables the similarity index and only exact
+# matches hit. When enabled, each worker keeps a sparse in-memory copy of
+# the cached vectors (see _Index): about 7 MB for 2000 entries, loaded on
+# its first lookup and topped up with new entries on later ones. A miss then
+# spends around 10 ms scoring the entries that share trigrams with the
+# question, on the request thread
+CHAT_CACHE_SIMILARITY = float(os.environ.get('CHAT_CACHE_SIMILARITY', 0))
+# Size of the hashed character-trigram vectors used for similarity
+VECTOR_DIM = 512
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def cache_key(text):
+    return hashlib.sha256(normalize(text).encode()).hexdigest()
+
+
+def embed(text):
+    """Local embedding: L2-normalised hashed character trigrams of the words.
+
+    No model or API call; good enough to match rephrasings such as "how do
+    I waterstart" / "how to do a waterstart".
+    """
+    vector = [0.0] * VECTOR_DIM
+    for word in normalize(text).split():
+        padded = f' {word} '
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode()) % VECTOR_DIM] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _pack(vector):
+    return struct.pack(f'{VECTOR_DIM}f', *vector)
+
+
+def _unpack(blob):
+    return struct.unpack(f'{VECTOR_DIM}f', blob)
+
+
+def _connect():
+    conn = sqlite3.connect(CHAT_CACHE_PATH, timeout=5, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS chat_cache ('
+        ' key TEXT PRIMARY KEY,'
+        ' question TEXT NOT NULL,'
+        ' reply TEXT NOT NULL,'
+        ' vector BLOB,'
+        ' expires_at REAL NOT NULL,'
+        ' last_used REAL NOT NULL)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_chat_cache_last_used ON chat_cache (last_used)')
+    conn.execute('CREATE TABLE IF NOT EXISTS chat_cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    return conn
+
+
+def _count(conn, name):
+    conn.execute(
+        'INSERT INTO chat_cache_stats (name, value) VALUES (?, 1) '
+        'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+        (name,)
+    )
+
+
+def lookup(question):
+    """Return a cached reply for ``question`` or None; counts hits and misses.
+
+    Exact matches on the normalised text are tried first, then (if enabled)
+    the closest cached question above ``CHAT_CACHE_SIMILARITY``.
+    """
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            key = cache_key(question)
+            row = conn.execute(
+                'SELECT key, reply FROM chat_cache WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+            kind = 'exact_hits'
+            if row is None and CHAT_CACHE_SIMILARITY > 0:
+                row = _nearest(conn, embed(question), now)
+                kind = 'similar_hits'
+            if row is None:
+                _count(conn, 'misses')
+                return None
+            conn.execute('UPDATE chat_cache SET last_used = ? WHERE key = ?', (now, row[0]))
+            _count(conn, kind)
+            return row[1]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Chat cache read error: {e}")
+        return None
+
+
+class _Index:
+    """Per-process sparse copy of the cached question vectors.
+
+    Vectors are mostly zeros, so each is kept as ``{bucket: weight}`` with a
+    posting list per bucket; a lookup only touches entries sharing a bucket
+    with the question. Entries written by any worker are picked up by their
+    ``expires_at`` (insert time + TTL), and entries evicted or expired since
+    are dropped when a lookup finds them gone from the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.entries = {}
+        self.postings = {}
+        self.loaded_until = 0.0
+
+    def _add(self, key, sparse):
+        self._discard(key)
+        self.entries[key] = sparse
+        for bucket, weight in sparse.items():
+            self.postings.setdefault(bucket, {})[key] = weight
+
+    def _discard(self, key):
+        for bucket in self.entries.pop(key, ()):
+            self.postings[bucket].pop(key, None)
+
+    def refresh(self, conn):
+        with self.lock:
+            if len(self.entries) > 2 * CHAT_CACHE_MAX_ENTRIES:
+                self.reset()
+            for key, blob, expires_at in conn.execute(
+                'SELECT key, vector, expires_at FROM chat_cache WHERE expires_at >= ? AND vector IS NOT NULL',
+                (self.loaded_until,)
+            ):
+                self._add(key, {i: v for i, v in enumerate(_unpack(blob)) if v})
+                self.loaded_until = max(self.loaded_until, expires_at)
+
+    def ranked(self, vector):
+        """Keys scoring at least ``CHAT_CACHE_SIMILARITY`` against ``vector``, best first."""
+        scores = {}
+        with self.lock:
+            for bucket, weight in enumerate(vector):
+                if weight:
+                    for key, stored in self.postings.get(bucket, {}).items():
+                        scores[key] = scores.get(key, 0.0) + weight * stored
+        return sorted((key for key, score in scores.items() if score >= CHAT_CACHE_SIMILARITY),
+                      key=scores.get, reverse=True)
+
+    def discard(self, key):
+        with self.lock:
+            self._discard(key)
+
+
+_index = _Index()
+
+
+def _nearest(conn, vector, now):
+    _index.refresh(conn)
+    for key in _index.ranked(vector):
+        row = conn.execute('SELECT key, reply FROM chat_cache WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+        if row is not None:
+            return row
+        _index.discard(key)
+    return None
+
+
+def store(question, reply):
+    """Cache ``reply`` for ``question`` and evict expired / least recently used entries."""
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO chat_cache (key, question, reply, vector, expires_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (cache_key(question), normalize(question), reply, _pack(embed(question)),
+                 now + CHAT_CACHE_TTL, now)
+            )
+            conn.execute('DELETE FROM chat_cache WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'DELETE FROM chat_cache WHERE key IN ('
+                ' SELECT key FROM chat_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (CHAT_CACHE_MAX_ENTRIES,)
+            )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Chat cache write error: {e}")
+
+
+def stats():
+    """Hit/miss counters and current size, shared by all workers."""
+    try:
+        conn = _connect()
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM chat_cache_stats'))
+            entries = conn.execute('SELECT COUNT(*) FROM chat_cache').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Chat cache stats error: {e}")
+        return None
+    hits = counters.get('exact_hits', 0) + counters.get('similar_hits', 0)
+    lookups = hits + counters.get('misses', 0)
+    return {
+        'entries': entries,
+        'exact_hits': counters.get('exact_hits', 0),
+        'similar_hits': counters.get('similar_hits', 0),
+        'misses': counters.get('misses', 0),
+        'hit_rate': round(hits / lookups, 3) if lookups else None,
+        'similarity_threshold': CHAT_CACHE_SIMILARITY,
+        'ttl': CHAT_CACHE_TTL,
+        'max_entries': CHAT_CACHE_MAX_ENTRIES,
+    }
+
+
+def clear():
+    try:
+        conn = _connect()
+        try:
+            conn.execute('DELETE FROM chat_cache')
+            conn.execute('DELETE FROM chat_cache_stats')
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Chat cache clear error: {e}")
+    # Other workers drop their copies of the cleared entries as lookups find them gone
+    with _index.lock:
+        _index.reset()
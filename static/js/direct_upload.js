@@ -0,0 +1,87 @@
+// Direct-to-S3 uploads. Files in inputs marked data-direct-upload are sent
+// straight to S3 with presigned requests (/api/uploads/*) and replaced by
+// hidden "uploaded_keys" fields, so the form post carries no media bytes.
+
+function postJSON(url, data) {
+    return fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(data)
+    }).then(response => response.json());
+}
+
+async function uploadParts(file, upload) {
+    const parts = [];
+    for (const part of upload.parts) {
+        const start = (part.part_number - 1) * upload.part_size;
+        const response = await fetch(part.url, { method: 'PUT', body: file.slice(start, start + upload.part_size) });
+        if (!response.ok) {
+            throw new Error(`Upload of ${file.name} failed (part ${part.part_number})`);
+        }
+        parts.push({ part_number: part.part_number, etag: response.headers.get('ETag') });
+    }
+    return parts;
+}
+
+async function presignedUpload(file) {
+    const upload = await postJSON('/api/uploads/presign', {
+        filename: file.name,
+        content_type: file.type || 'application/octet-stream',
+        size: file.size
+    });
+    if (!upload.success) {
+        throw new Error(upload.error || `Could not upload ${file.name}`);
+    }
+
+    if (upload.method === 'post') {
+        const body = new FormData();
+        Object.entries(upload.fields).forEach(([name, value]) => body.append(name, value));
+        body.append('file', file);
+        const response = await fetch(upload.url, { method: 'POST', body: body });
+        if (!response.ok) {
+            throw new Error(`Upload of ${file.name} failed`);
+        }
+        return upload.key;
+    }
+
+    try {
+        const parts = await uploadParts(file, upload);
+        const done = await postJSON('/api/uploads/complete', { key: upload.key, upload_id: upload.upload_id, parts: parts });
+        if (!done.success) {
+            throw new Error(done.error || `Upload of ${file.name} failed`);
+        }
+    } catch (error) {
+        postJSON('/api/uploads/abort', { key: upload.key, upload_id: upload.upload_id });
+        throw error;
+    }
+    return upload.key;
+}
+
+// Upload the form's direct-upload files, then swap them for their keys.
+// If anything fails the inputs are left alone and the files go with the
+// normal form post instead.
+async function directUploadFiles(form) {
+    const inputs = Array.from(form.querySelectorAll('input[type="file"][data-direct-upload]'))
+        .filter(input => input.files.length > 0);
+    if (inputs.length === 0) {
+        return;
+    }
+    try {
+        for (const input of inputs) {
+            const keys = await Promise.all(Array.from(input.files).map(presignedUpload));
+            keys.forEach(key => {
+                const hidden = document.createElement('input');
+                hidden.type = 'hidden';
+                hidden.name = 'uploaded_keys';
+                hidden.value = key;
+                form.appendChild(hidden);
+            });
+            // Disabled inputs are left out of the form post
+            input.disabled = true;
+        }
+    } catch (error) {
+        console.error('Direct upload failed, sending files with the form:', error);
+        form.querySelectorAll('input[name="uploaded_keys"]').forEach(hidden => hidden.remove());
+        inputs.forEach(input => { input.disabled = false; });
+    }
+}
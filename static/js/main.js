@@ -112,3 +112,73 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 });
+
+// Stream a chat reply from /agent/api/chat/stream (Server-Sent Events over a
+// POST). onDelta gets each text fragment as it arrives, onDone the full reply.
+// Browsers without streaming fetch bodies fall back to /agent/api/chat.
+function streamChat(message, { onDelta, onDone, onError }) {
+    const request = {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message: message })
+    };
+
+    if (!window.ReadableStream || !window.TextDecoder) {
+        return fetch('/agent/api/chat', request)
+            .then(response => response.json())
+            .then(data => data.error ? onError(data.error) : onDone(data.reply))
+            .catch(error => onError(error.message));
+    }
+
+    return fetch('/agent/api/chat/stream', request).then(response => {
+        if (!response.ok || !response.body) {
+            return response.json().then(data => onError(data.error || response.statusText));
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let finished = false;
+
+        function handleEvent(block) {
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (!data) {
+                return; // keep-alive comment
+            }
+            const payload = JSON.parse(data);
+            if (event === 'done') {
+                finished = true;
+                onDone(payload.reply);
+            } else if (event === 'error') {
+                finished = true;
+                onError(payload.error);
+            } else {
+                onDelta(payload.delta);
+            }
+        }
+
+        function read() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    if (!finished) {
+                        onError('La conexión se cerró antes de terminar la respuesta.');
+                    }
+                    return;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                const blocks = buffer.split('\n\n');
+                buffer = blocks.pop();
+                blocks.forEach(handleEvent);
+                return read();
+            });
+        }
+        return read();
+    }).catch(error => onError(error.message));
+}
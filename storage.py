@@ -0,0 +1,311 @@
+"""S3 media uploads.
+
+One boto3 client is shared by every request and upload thread, and
+multi-file uploads run concurrently on a small thread pool. With
+``S3_UPLOAD_MODE=deferred`` the request only buffers the files and writes
+placeholder rows; the pool finishes the uploads after the response is sent.
+
+Deferred jobs live only in the worker's memory: a restart, deploy or crash
+before they finish loses those uploads. Their rows stay ``pending`` until
+they are older than ``S3_PENDING_TIMEOUT`` minutes, when reading the session
+(or ``flask media expire-pending``) marks them ``failed``.
+"""
+import io
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+# boto3 itself is imported with the first client: it adds ~0.2 s to every worker's start
+from botocore.exceptions import BotoCoreError, ClientError
+from flask import current_app
+from werkzeug.utils import secure_filename
+import media
+
+logger = logging.getLogger(__name__)
+
+# Concurrent uploads per worker process; also the size of the client's HTTP pool
+UPLOAD_WORKERS = int(os.environ.get('S3_UPLOAD_WORKERS', 8))
+# 'inline' uploads during the request, 'deferred' hands them to the queue
+UPLOAD_MODE = os.environ.get('S3_UPLOAD_MODE', 'inline')
+# Minutes after which a deferred upload that never finished counts as lost
+PENDING_UPLOAD_TIMEOUT = int(os.environ.get('S3_PENDING_TIMEOUT', 30))
+
+_client = None
+_client_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_s3_client():
+    """Return the process-wide S3 client, creating it on first use.
+
+    boto3 clients are thread-safe and keep their own connection pool, so one
+    client serves every request thread and upload worker. ``S3_ENDPOINT_URL``
+    points it at a local stand-in (moto server, MinIO) instead of AWS.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            import boto3
+            from botocore.config import Config
+            config = current_app.config
+            _client = boto3.client(
+                's3',
+                aws_access_key_id=config.get('S3_KEY'),
+                aws_secret_access_key=config.get('S3_SECRET'),
+                region_name=config.get('S3_REGION'),
+                endpoint_url=config.get('S3_ENDPOINT_URL'),
+                config=Config(max_pool_connections=UPLOAD_WORKERS, retries={'max_attempts': 3, 'mode': 'standard'}),
+            )
+        return _client
+
+
+def _get_executor():
+    # Created lazily so each gunicorn worker owns its threads after forking
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='s3-upload')
+        return _executor
+
+
+def object_url(bucket, key):
+    endpoint = current_app.config.get('S3_ENDPOINT_URL')
+    if endpoint:
+        return f"{endpoint.rstrip('/')}/{bucket}/{key}"
+    return f"https://{bucket}.s3.{current_app.config.get('S3_REGION')}.amazonaws.com/{key}"
+
+
+def new_key(filename):
+    return secure_filename(f"{uuid4().hex}_{filename}")
+
+
+class BufferedUpload:
+    """An uploaded file read into memory so it outlives the request."""
+
+    def __init__(self, file_obj):
+        self.filename = file_obj.filename
+        self.content_type = file_obj.content_type
+        self.data = file_obj.read()
+        self.key = new_key(file_obj.filename)
+
+
+def _put(client, bucket, upload):
+    try:
+        client.upload_fileobj(
+            io.BytesIO(upload.data),
+            bucket,
+            upload.key,
+            ExtraArgs={'ContentType': upload.content_type}
+        )
+    except (BotoCoreError, ClientError) as e:
+        logger.error(f"S3 upload of {upload.filename} failed: {e}")
+        return False
+    return True
+
+
+def _put_derivatives(client, bucket, key, data, url_base):
+    """Upload resized variants of an image; return their variants JSON or None.
+
+    Failures here never fail the upload itself: the original is still served.
+    """
+    derivatives = media.make_derivatives(data)
+    stored = []
+    for name, body, content_type, width in derivatives:
+        try:
+            client.put_object(Bucket=bucket, Key=media.variant_name(key, name), Body=body,
+                              ContentType=content_type, CacheControl='public, max-age=31536000, immutable')
+        except (BotoCoreError, ClientError) as e:
+            logger.error(f"S3 upload of {name} for {key} failed: {e}")
+            continue
+        stored.append((name, body, content_type, width))
+    variants = media.variants_from(stored, lambda name: media.variant_name(url_base, name))
+    return json.dumps(variants) if variants else None
+
+
+def _store(client, bucket, upload, url):
+    """Upload a file plus, for images, its derivatives.
+
+    Returns ``(ok, variants)``; ``variants`` is None for videos and for
+    images that could not be resized.
+    """
+    if not _put(client, bucket, upload):
+        return False, None
+    variants = None
+    if media.is_image(upload.filename):
+        variants = _put_derivatives(client, bucket, upload.key, upload.data, url)
+    return True, variants
+
+
+class StoredFile:
+    def __init__(self, url, variants):
+        self.url = url
+        self.variants = variants
+
+
+def upload_files(files, bucket):
+    """Upload several files concurrently; return a StoredFile per file, in input order.
+
+    A failed upload yields None in its slot, like ``upload_file_to_s3``.
+    """
+    uploads = [BufferedUpload(f) for f in files]
+    if not uploads:
+        return []
+    client = get_s3_client()
+    urls = [object_url(bucket, upload.key) for upload in uploads]
+    results = _get_executor().map(lambda args: _store(client, bucket, *args), zip(uploads, urls))
+    return [StoredFile(url, variants) if ok else None for url, (ok, variants) in zip(urls, results)]
+
+
+def upload_file(file_obj, bucket):
+    stored = upload_files([file_obj], bucket)[0]
+    return stored.url if stored else None
+
+
+def defer_uploads(files, bucket):
+    """Buffer files for uploading after the request has returned.
+
+    Each returned job already knows the URL its object will have, so the
+    caller can write placeholder rows straight away, set ``job.row_id`` and
+    hand the jobs to ``start_deferred`` once those rows are committed.
+    """
+    jobs = []
+    for f in files:
+        upload = BufferedUpload(f)
+        jobs.append(DeferredUpload(upload, bucket, object_url(bucket, upload.key)))
+    return jobs
+
+
+class DeferredUpload:
+    def __init__(self, upload, bucket, url):
+        self.upload = upload
+        self.bucket = bucket
+        self.url = url
+        self.row_id = None
+        self.variants = None
+
+
+def start_deferred(jobs, on_done):
+    """Queue the uploads; ``on_done(job, ok)`` runs in an app context afterwards.
+
+    ``job.variants`` holds the image derivatives by then (see media.py).
+    """
+    app = current_app._get_current_object()
+    client = get_s3_client()
+    executor = _get_executor()
+    for job in jobs:
+        executor.submit(_run_deferred, app, client, job, on_done)
+
+
+def _run_deferred(app, client, job, on_done):
+    ok, job.variants = _store(client, job.bucket, job.upload, job.url)
+    job.upload.data = None
+    with app.app_context():
+        try:
+            on_done(job, ok)
+        except Exception:
+            logger.exception('Recording deferred upload %s failed', job.upload.key)
+
+
+# Direct uploads: the browser sends media straight to S3 with presigned
+# requests, so video bytes never pass through a gunicorn worker. The bucket
+# needs a CORS rule allowing POST/PUT from the site and exposing ``ETag``.
+PRESIGN_EXPIRES = 3600
+# Larger files use a multipart upload with one presigned PUT per part
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+MAX_DIRECT_UPLOAD_BYTES = int(os.environ.get('S3_MAX_UPLOAD_BYTES', 500 * 1024 * 1024))
+
+
+def direct_upload_key(user_id, filename):
+    """Keys are namespaced per user so completions can check ownership."""
+    return f"uploads/{user_id}/{new_key(filename)}"
+
+
+def owns_key(user_id, key):
+    return key.startswith(f"uploads/{user_id}/") and '..' not in key
+
+
+def presign_upload(bucket, key, content_type, size):
+    """Describe how the browser should upload ``size`` bytes to ``key``.
+
+    Small files get a presigned POST whose policy pins the content type and
+    allows at most the declared ``size``; larger ones get a multipart upload id and a presigned PUT per part.
+    """
+    client = get_s3_client()
+    if size <= MULTIPART_THRESHOLD:
+        post = client.generate_presigned_post(
+            bucket, key,
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, size]],
+            ExpiresIn=PRESIGN_EXPIRES,
+        )
+        return {'method': 'post', 'key': key, 'url': post['url'], 'fields': post['fields']}
+
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+    part_count = -(-size // MULTIPART_PART_SIZE)
+    parts = [
+        {'part_number': number, 'url': client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': number},
+            ExpiresIn=PRESIGN_EXPIRES,
+        )}
+        for number in range(1, part_count + 1)
+    ]
+    return {'method': 'multipart', 'key': key, 'upload_id': upload_id,
+            'part_size': MULTIPART_PART_SIZE, 'parts': parts}
+
+
+def complete_multipart(bucket, key, upload_id, parts):
+    """``parts`` is ``[{'part_number': n, 'etag': '...'}, ...]`` as sent by the browser."""
+    get_s3_client().complete_multipart_upload(
+        Bucket=bucket, Key=key, UploadId=upload_id,
+        MultipartUpload={'Parts': sorted(
+            ({'PartNumber': int(p['part_number']), 'ETag': p['etag']} for p in parts),
+            key=lambda p: p['PartNumber'],
+        )},
+    )
+
+
+def abort_multipart(bucket, key, upload_id):
+    get_s3_client().abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+
+
+def stat_object(bucket, key):
+    """Size in bytes of an uploaded object, or None if it is not there."""
+    try:
+        return get_s3_client().head_object(Bucket=bucket, Key=key)['ContentLength']
+    except ClientError:
+        return None
+
+
+def start_derivatives(bucket, key, on_done):
+    """Build derivatives for an object the browser uploaded directly.
+
+    Runs on the upload pool: downloads the original, uploads the variants
+    and calls ``on_done(variants)`` in an app context.
+    """
+    if not media.is_image(key):
+        return
+    app = current_app._get_current_object()
+    client = get_s3_client()
+    url = object_url(bucket, key)
+    _get_executor().submit(_run_derivatives, app, client, bucket, key, url, on_done)
+
+
+def _run_derivatives(app, client, bucket, key, url, on_done):
+    try:
+        data = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except (BotoCoreError, ClientError) as e:
+        logger.error(f"Fetching {key} for derivatives failed: {e}")
+        return
+    variants = _put_derivatives(client, bucket, key, data, url)
+    if not variants:
+        return
+    with app.app_context():
+        try:
+            on_done(variants)
+        except Exception:
+            logger.exception('Recording derivatives for %s failed', key)
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.py and the file caches read these at import time
+_scratch = tempfile.mkdtemp(prefix='wingman-tests-')
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['WEATHER_CACHE_PATH'] = os.path.join(_scratch, 'weather_cache.db')
+os.environ['CHAT_CACHE_PATH'] = os.path.join(_scratch, 'chat_cache.db')
+os.environ['FRAGMENT_CACHE_PATH'] = os.path.join(_scratch, 'fragment_cache.db')
+os.environ['METRICS_DIR'] = os.path.join(_scratch, 'metrics')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app import app as flask_app  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The app on a fresh in-memory database; TESTING puts the query guard in raise mode."""
+    flask_app.config.update(TESTING=True, SQL_N_PLUS_ONE=None)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def seeded(app):
+    from benchmarks.seed import seed
+    seed(db, users=6, sessions_per_user=5, skills=5, products=3, log=lambda *args: None)
+    db.session.commit()
+    return app
+
+
+@pytest.fixture
+def admin_client(seeded):
+    client = seeded.test_client()
+    with client.session_transaction() as sess:
+        # User 1 is the seeded admin
+        sess['user_id'] = 1
+        sess['is_admin'] = True
+    return client
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import socket
+
+import pytest
+
+import agent
+import outbound
+import response_cache
+from benchmarks.stubs import StubRunner
+
+
+class FakeRunner(StubRunner):
+    """StubRunner that also records whether its run was cancelled."""
+
+    latency = 0.01
+    cancelled = []
+
+    @classmethod
+    async def run(cls, agent_, agent_input, context=None):
+        try:
+            return await super().run(agent_, agent_input, context=context)
+        except asyncio.CancelledError:
+            cls.cancelled.append(agent_input)
+            raise
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'AGENT_RUNNER', FakeRunner)
+    monkeypatch.setattr(FakeRunner, 'latency', 0.01)
+    monkeypatch.setattr(FakeRunner, 'cancelled', [])
+    # A fresh breaker and bucket per test
+    monkeypatch.setattr(outbound, 'openai', outbound.Upstream('openai', rate=100, burst=100, failure_threshold=2))
+    response_cache.clear()
+    return app.test_client()
+
+
+def slow_agent(monkeypatch, timeout=0.2):
+    monkeypatch.setattr(agent, 'AGENT_TIMEOUT', timeout)
+    monkeypatch.setattr(FakeRunner, 'latency', 5)
+
+
+def sse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n') if not line.startswith(':'))
+        events.append((lines.get('event', 'message'), json.loads(lines['data'])))
+    return events
+
+
+def test_chat_replies_through_the_runner_and_caches_the_answer(client):
+    response = client.post('/agent/api/chat', json={'message': '¿Cómo hago el waterstart?'})
+    assert response.status_code == 200
+    assert response.get_json() == {'reply': 'Mantén el ala alta y la mirada al frente.'}
+
+    again = client.post('/agent/api/chat', json={'message': 'como hago el waterstart'})
+    assert again.get_json()['cached'] is True
+    assert outbound.openai.metrics()['calls'] == 1
+
+
+def test_chat_timeout_is_a_504_and_an_upstream_failure(client, monkeypatch):
+    slow_agent(monkeypatch)
+
+    for _ in range(2):
+        response = client.post('/agent/api/chat', json={'message': 'hola'})
+        assert response.status_code == 504
+
+    assert outbound.openai.metrics()['failures'] == 2
+    # Two timeouts open the circuit: the next question is refused without calling OpenAI
+    response = client.post('/agent/api/chat', json={'message': 'hola'})
+    assert response.status_code == 503
+    assert outbound.openai.metrics()['circuit_rejected'] == 1
+
+
+def test_chat_client_disconnect_is_a_499_and_cancels_the_run(client, monkeypatch):
+    slow_agent(monkeypatch, timeout=10)
+    server_side, client_side = socket.socketpair()
+    client_side.close()
+    try:
+        response = client.post('/agent/api/chat', json={'message': 'hola'},
+                               environ_overrides={'gunicorn.socket': server_side})
+    finally:
+        server_side.close()
+
+    assert response.status_code == 499
+    # The cancellation reaches the runner on the agent loop shortly after
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), agent.get_loop()).result(1)
+    assert FakeRunner.cancelled == ['hola']
+    assert outbound.openai.metrics()['failures'] == 0
+    assert outbound.openai.breaker.failures == 0
+
+
+def test_chat_stream_sends_deltas_then_the_reply(client):
+    response = client.post('/agent/api/chat/stream', json={'message': '¿Qué ala uso con levante?'})
+
+    assert response.mimetype == 'text/event-stream'
+    events = sse_events(response.get_data(as_text=True))
+    assert [data['delta'] for kind, data in events if kind == 'message'] == ['Mantén ', 'el ', 'ala ', 'alta.']
+    assert events[-1] == ('done', {'reply': 'Mantén el ala alta.'})
+
+
+def test_chat_stream_timeout_is_an_error_event_and_an_upstream_failure(client, monkeypatch):
+    slow_agent(monkeypatch)
+
+    response = client.post('/agent/api/chat/stream', json={'message': 'hola'})
+
+    kind, data = sse_events(response.get_data(as_text=True))[-1]
+    assert kind == 'error' and 'tardó demasiado' in data['error']
+    assert outbound.openai.metrics()['failures'] == 1
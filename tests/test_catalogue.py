@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+import catalogue
+from models import db, Product, ProductImage
+
+
+@pytest.fixture
+def statements(app):
+    """SQL statements run on ``db.engine``, with the pool connection each one used and the pool checkouts."""
+    engine = db.engine
+    log = {'statements': [], 'checkouts': 0}
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        log['statements'].append((statement.split(None, 1)[0].upper(), conn.connection.dbapi_connection,
+                                  conn.engine.pool))
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        log['checkouts'] += 1
+
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine.pool, 'checkout', checkout)
+    yield log
+    event.remove(engine, 'after_cursor_execute', after_cursor_execute)
+    event.remove(engine.pool, 'checkout', checkout)
+
+
+def of_kind(log, kind):
+    return [s for s in log['statements'] if s[0] == kind]
+
+
+def test_product_models_share_the_app_metadata():
+    metadata = {model.metadata for model in (Product, ProductImage)}
+    assert len(metadata) == 1
+    assert metadata.pop() is db.metadata
+
+
+def test_product_and_images_insert_on_one_pooled_connection(app, statements):
+    product = catalogue.create_product(
+        images=[('https://cdn.example/a.jpg', None), ('https://cdn.example/b.jpg', None)],
+        name='Wing 5m', description='Freeride wing', price=Decimal('899.00'), category='Wings')
+    catalogue.add_images(product, [('https://cdn.example/c.jpg', None)])
+    db.session.commit()
+
+    inserts = of_kind(statements, 'INSERT')
+    assert inserts
+    assert len({id(dbapi_connection) for _, dbapi_connection, _ in inserts}) == 1
+    assert all(pool is db.engine.pool for _, _, pool in inserts)
+    assert statements['checkouts'] == 1
+    assert [img.image_url for img in product.images] == [
+        'https://cdn.example/a.jpg', 'https://cdn.example/b.jpg', 'https://cdn.example/c.jpg']
+
+
+def test_remove_images_is_one_delete(app, statements):
+    product = catalogue.create_product(
+        images=[(f'https://cdn.example/{i}.jpg', None) for i in range(4)],
+        name='Board 90l', description='Foil board', price=Decimal('1200.00'))
+    db.session.commit()
+    removed_ids = [img.id for img in product.images[:3]]
+    kept_id = product.images[3].id
+    statements['statements'].clear()
+
+    assert catalogue.remove_images(product.id, removed_ids) == 3
+    db.session.commit()
+
+    assert len(of_kind(statements, 'DELETE')) == 1
+    assert [img.id for img in db.session.query(ProductImage).filter_by(product_id=product.id)] == [kept_id]
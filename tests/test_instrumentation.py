@@ -0,0 +1,28 @@
+import pytest
+import instrumentation
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_metrics_open_to_localhost_without_token(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+
+
+def test_metrics_hidden_from_remote_without_token(client):
+    response = client.get('/metrics', environ_overrides={'REMOTE_ADDR': '203.0.113.5'})
+    assert response.status_code == 404
+
+
+def test_metrics_token_required_when_set(client, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'METRICS_TOKEN', 'secret')
+    remote = {'REMOTE_ADDR': '203.0.113.5'}
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', environ_overrides=remote,
+                      headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', environ_overrides=remote,
+                      headers={'Authorization': 'Bearer secret'}).status_code == 200
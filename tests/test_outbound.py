@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import outbound
+from outbound import CircuitBreaker, CircuitOpen, RateLimited, TokenBucket, Upstream
+
+
+def upstream(**kwargs):
+    options = dict(rate=100, burst=100, max_wait=1, failure_threshold=2, reset_timeout=0.05)
+    options.update(kwargs)
+    return Upstream('test', **options)
+
+
+def open_circuit(up):
+    for _ in range(up.breaker.failure_threshold):
+        with pytest.raises(ValueError):
+            up.call(_fail)
+    assert up.breaker.state == 'open'
+
+
+def _fail():
+    raise ValueError('upstream error')
+
+
+def test_token_bucket_allows_a_burst_then_spaces_calls():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve(max_wait=1) == 0
+    assert bucket.reserve(max_wait=1) == 0
+    assert bucket.reserve(max_wait=1) == pytest.approx(0.1, abs=0.02)
+    # The next token is further away than we are willing to wait
+    assert bucket.reserve(max_wait=0.1) is None
+
+
+def test_circuit_breaker_opens_then_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record(False)
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open' and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open'
+
+
+def test_open_circuit_and_rate_limit_fail_fast():
+    up = upstream()
+    open_circuit(up)
+    with pytest.raises(CircuitOpen):
+        up.call(lambda: 'never runs')
+
+    limited = upstream(rate=1, burst=1, max_wait=0)
+    assert limited.call(lambda: 'ok') == 'ok'
+    with pytest.raises(RateLimited):
+        limited.call(lambda: 'ok')
+    assert limited.metrics()['rate_limited'] == 1
+
+
+def test_sync_calls_with_the_same_key_are_coalesced():
+    up = upstream()
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return 'forecast'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(up.call(slow, key='tarifa'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while up.metrics()['coalesced'] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert results == ['forecast'] * 5
+    assert len(calls) == 1
+    assert up.metrics()['in_flight'] == 0
+
+
+def test_async_calls_with_the_same_key_are_coalesced():
+    up = upstream()
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'reply'
+
+    async def main():
+        return await asyncio.gather(*(up.acall(answer, key='same question') for _ in range(4)))
+
+    assert asyncio.run(main()) == ['reply'] * 4
+    assert len(calls) == 1
+    assert up.metrics()['coalesced'] == 3
+
+
+def test_async_call_past_its_timeout_counts_as_a_failure():
+    up = upstream()
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    for _ in range(up.breaker.failure_threshold):
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(up.acall(hang, timeout=0.02))
+
+    assert up.metrics()['failures'] == 2
+    assert up.breaker.state == 'open'
+
+
+def test_caller_cancelling_does_not_count_as_a_failure():
+    up = upstream()
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def main():
+        task = asyncio.ensure_future(up.acall(hang))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert up.metrics()['failures'] == 0 and up.breaker.failures == 0
+
+
+def test_cancelled_trial_while_throttled_gives_back_the_slot():
+    up = upstream(max_wait=5)
+    open_circuit(up)
+    time.sleep(0.06)
+    # An empty bucket, so the half-open trial call has to wait for a token
+    up.bucket = TokenBucket(rate=1, burst=1)
+    up.bucket.reserve(max_wait=0)
+
+    async def cancelled_trial():
+        task = asyncio.ensure_future(up.acall(lambda: asyncio.sleep(0, 'ok')))
+        await asyncio.sleep(0.02)
+        assert up.breaker._trial
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled_trial())
+    assert not up.breaker._trial
+    assert up.breaker.allow()
+
+
+def test_last_coalesced_caller_leaving_cancels_the_shared_call():
+    up = upstream()
+    cancelled = []
+
+    async def hang():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        callers = [asyncio.ensure_future(up.acall(hang, key='k')) for _ in range(2)]
+        await asyncio.sleep(0.02)
+        callers[0].cancel()
+        await asyncio.sleep(0.02)
+        assert not cancelled
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == [1]
+    assert up.metrics()['in_flight'] == 0
+    assert up.breaker.failures == 0
+
+
+def test_observers_see_every_finished_call(monkeypatch):
+    seen = []
+    monkeypatch.setattr(outbound, 'observers', [lambda name, seconds, ok: seen.append((name, ok))])
+    up = upstream()
+    up.call(lambda: 'ok')
+    with pytest.raises(ValueError):
+        up.call(_fail)
+    assert seen == [('test', True), ('test', False)]
@@ -0,0 +1,65 @@
+import pytest
+
+from models import db, User
+from query_guard import QueryBudgetExceeded
+
+
+@pytest.fixture
+def guard(app):
+    return app.extensions['query_guard']
+
+
+def test_admin_dashboard_within_budget(admin_client):
+    response = admin_client.get('/admin/dashboard')
+    assert response.status_code == 200
+    assert int(response.headers['X-SQL-Queries']) <= 5
+
+
+def test_admin_sessions_within_budget(admin_client):
+    for url in ('/admin/sessions', '/admin/sessions/user/2', '/admin/sessions?from=2020-01-01'):
+        response = admin_client.get(url)
+        assert response.status_code == 200, url
+        assert int(response.headers['X-SQL-Queries']) <= 5, url
+
+
+def test_over_budget_view_fails_after_it_returns(admin_client, monkeypatch):
+    view = admin_client.application.view_functions['admin.admin_dashboard']
+    monkeypatch.setattr(view, 'query_budget', 1)
+    with pytest.raises(QueryBudgetExceeded, match=r'admin\.admin_dashboard exceeded its budget of 1 queries'):
+        admin_client.get('/admin/dashboard')
+
+
+def test_warn_mode_logs_instead_of_failing(admin_client, monkeypatch, caplog):
+    view = admin_client.application.view_functions['admin.admin_dashboard']
+    monkeypatch.setattr(view, 'query_budget', 1)
+    admin_client.application.config['SQL_N_PLUS_ONE'] = 'warn'
+    response = admin_client.get('/admin/dashboard')
+    assert response.status_code == 200
+    assert 'exceeded its budget of 1 queries' in caplog.text
+
+
+def test_assert_max_queries_raises_when_the_block_ends(guard):
+    with pytest.raises(QueryBudgetExceeded, match='block exceeded its budget of 1 queries'):
+        with guard.assert_max_queries(1):
+            for i in range(3):
+                db.session.add(User(username=f'u{i}', email=f'u{i}@example.com', password='x'))
+                db.session.flush()
+    # Every statement in the block still ran
+    assert db.session.query(User).count() == 3
+
+
+def test_assert_max_queries_flags_repeated_statements(guard):
+    db.session.add_all(User(username=f'u{i}', email=f'u{i}@example.com', password='x') for i in range(4))
+    db.session.commit()
+    ids = [user_id for user_id, in db.session.query(User.id)]
+    db.session.expire_all()
+    with pytest.raises(QueryBudgetExceeded, match='possible N\\+1'):
+        with guard.assert_max_queries(10, repeat_threshold=2):
+            for user_id in ids:
+                db.session.query(User).filter_by(id=user_id).one()
+
+
+def test_assert_max_queries_passes_within_budget(guard):
+    with guard.assert_max_queries(1) as tracker:
+        db.session.query(User).count()
+    assert tracker.total == 1
@@ -0,0 +1,179 @@
+import base64
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pytest
+from moto import mock_aws
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import app as app_module
+import media
+import storage
+from models import db, User, Session, SessionImage
+
+BUCKET = 'wingman-test'
+
+
+@pytest.fixture
+def s3(app, monkeypatch):
+    """A moto S3 bucket, a fresh shared client and a one-thread upload pool (so jobs finish in order)."""
+    app.config.update(S3_BUCKET=BUCKET, S3_REGION='us-east-1', S3_KEY='testing', S3_SECRET='testing',
+                      S3_ENDPOINT_URL=None)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(storage, '_client', None)
+    monkeypatch.setattr(storage, '_executor', executor)
+    with mock_aws():
+        client = storage.get_s3_client()
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+        executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def training_session(app):
+    user = User(username='rider', email='rider@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    training = Session(user_id=user.id, date=date(2026, 10, 1), sport_type='wingfoil', duration=60)
+    db.session.add(training)
+    db.session.commit()
+    return training
+
+
+def png(name='photo.png', size=(1200, 800)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (30, 120, 200)).save(buffer, 'PNG')
+    return FileStorage(io.BytesIO(buffer.getvalue()), filename=name, content_type='image/png')
+
+
+def video(name='clip.mp4'):
+    return FileStorage(io.BytesIO(b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 64), filename=name,
+                       content_type='video/mp4')
+
+
+def keys(client):
+    return {obj['Key'] for obj in client.list_objects_v2(Bucket=BUCKET).get('Contents', [])}
+
+
+def wait_for_uploads():
+    # The pool has one thread, so a job queued last finishes after all earlier ones
+    storage._get_executor().submit(lambda: None).result(timeout=30)
+
+
+def test_upload_files_stores_originals_and_image_variants(s3):
+    stored = storage.upload_files([png(), video()], BUCKET)
+
+    image, clip = stored
+    image_key, clip_key = image.url.rsplit('/', 1)[1], clip.url.rsplit('/', 1)[1]
+    assert image_key.endswith('_photo.png') and clip_key.endswith('_clip.mp4')
+    assert json.loads(image.variants) and clip.variants is None
+    stored_keys = keys(s3)
+    assert {image_key, clip_key} <= stored_keys
+    assert media.variant_name(image_key, 'thumb.jpg') in stored_keys
+
+
+def test_upload_files_returns_none_for_failed_uploads(s3):
+    s3.delete_bucket(Bucket=BUCKET)
+    assert storage.upload_files([video()], BUCKET) == [None]
+
+
+def test_deferred_upload_marks_the_row_ready(s3, training_session, monkeypatch):
+    monkeypatch.setattr(storage, 'UPLOAD_MODE', 'deferred')
+    failed, jobs = app_module.add_session_images(training_session.id, [png()])
+    db.session.commit()
+    image = db.session.query(SessionImage).one()
+    assert failed == [] and image.status == 'pending' and image.url == jobs[0].url
+
+    app_module.start_session_uploads(jobs)
+    wait_for_uploads()
+
+    db.session.expire_all()
+    image = db.session.query(SessionImage).one()
+    assert image.status == 'ready'
+    assert image.variants and json.loads(image.variants)
+    assert jobs[0].upload.key in keys(s3)
+    # The buffered bytes are released once the upload is done
+    assert jobs[0].upload.data is None
+
+
+def test_deferred_upload_that_fails_marks_the_row_failed(s3, training_session, monkeypatch):
+    monkeypatch.setattr(storage, 'UPLOAD_MODE', 'deferred')
+    _, jobs = app_module.add_session_images(training_session.id, [video()])
+    db.session.commit()
+    s3.delete_bucket(Bucket=BUCKET)
+
+    app_module.start_session_uploads(jobs)
+    wait_for_uploads()
+
+    db.session.expire_all()
+    assert db.session.query(SessionImage.status).scalar() == 'failed'
+
+
+def test_stale_pending_uploads_expire(app, training_session):
+    stale = datetime.utcnow() - timedelta(minutes=storage.PENDING_UPLOAD_TIMEOUT + 5)
+    db.session.add_all([
+        SessionImage(session_id=training_session.id, url='https://s3/lost.jpg', status='pending', created_at=stale),
+        SessionImage(session_id=training_session.id, url='https://s3/new.jpg', status='pending'),
+        SessionImage(session_id=training_session.id, url='https://s3/done.jpg', status='ready', created_at=stale),
+    ])
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['media', 'expire-pending'])
+
+    assert 'Marked 1 stale pending upload(s) as failed.' in result.output
+    statuses = dict(db.session.query(SessionImage.url, SessionImage.status))
+    assert statuses == {'https://s3/lost.jpg': 'failed', 'https://s3/new.jpg': 'pending',
+                        'https://s3/done.jpg': 'ready'}
+
+
+def test_session_page_expires_its_stale_pending_uploads(app, training_session):
+    stale = datetime.utcnow() - timedelta(minutes=storage.PENDING_UPLOAD_TIMEOUT + 5)
+    db.session.add(SessionImage(session_id=training_session.id, url='https://s3/lost.jpg', status='pending',
+                                created_at=stale))
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = training_session.user_id
+
+    response = client.get(f'/training/session/{training_session.id}')
+
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert db.session.query(SessionImage.status).scalar() == 'failed'
+
+
+def logged_in(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    return client
+
+
+def test_presigned_post_allows_only_the_declared_size(app, s3, training_session):
+    client = logged_in(app, training_session.user_id)
+
+    response = client.post('/api/uploads/presign',
+                           json={'filename': 'clip.mp4', 'content_type': 'video/mp4', 'size': 1234})
+
+    upload = response.get_json()
+    assert upload['method'] == 'post'
+    policy = json.loads(base64.b64decode(upload['fields']['policy']))
+    assert ['content-length-range', 1, 1234] in policy['conditions']
+
+
+def test_completing_the_same_upload_twice_adds_one_row(app, s3, training_session):
+    client = logged_in(app, training_session.user_id)
+    key = storage.direct_upload_key(training_session.user_id, 'clip.mp4')
+    s3.put_object(Bucket=BUCKET, Key=key, Body=b'video', ContentType='video/mp4')
+    body = {'key': key, 'target': 'session', 'target_id': training_session.id}
+
+    first = client.post('/api/uploads/complete', json=body)
+    second = client.post('/api/uploads/complete', json=body)
+
+    assert first.status_code == 200 and first.get_json()['success']
+    assert second.status_code == 400
+    assert second.get_json()['error'] == 'Upload already attached'
+    assert db.session.query(SessionImage).count() == 1
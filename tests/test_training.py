@@ -0,0 +1,20 @@
+from app import training_summary_totals
+from models import db, User, TrainingSummary
+
+
+def test_top_location_ignores_emptied_summary_rows(app):
+    user = User(username='rider', email='rider@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add_all([
+        TrainingSummary(user_id=user.id, sport_type='wingfoil', location='Tarifa', sessions=0, minutes=0),
+        TrainingSummary(user_id=user.id, sport_type='wingfoil', location='Bolonia', sessions=2, minutes=120),
+    ])
+    db.session.commit()
+    assert training_summary_totals(user.id)['top_location'] == 'Bolonia'
+
+    db.session.query(TrainingSummary).filter_by(location='Bolonia').update({'sessions': 0, 'minutes': 0})
+    db.session.commit()
+    totals = training_summary_totals(user.id)
+    assert totals['top_location'] is None
+    assert totals['sessions'] == 0
@@ -0,0 +1,462 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+import requests
+import outbound
+
+logger = logging.getLogger(__name__)
+
+# Met.no locationforecast (free API, requires an identifying User-Agent)
+MET_NO_URL = 'https://api.met.no/weatherapi/locationforecast/2.0/compact'
+MET_NO_HEADERS = {'User-Agent': 'WingmanApp/1.0 (contact@wingman.example)'}
+
+# Tarifa, the spot shown on the home page
+TARIFA = (36.0111, -5.6077)
+
+# Known spots. ``bands`` are the wind directions (degrees the wind blows from,
+# inclusive, may wrap through north) that work at that spot; ``aliases`` are
+# matched against free-text Session.location / User.location values.
+SPOTS = {
+    'tarifa': {
+        'name': 'Tarifa', 'lat': 36.0111, 'lon': -5.6077,
+        'bands': [(45, 135), (225, 315)],
+        'aliases': ['tarifa', 'los lances', 'balneario', 'valdevaqueros', 'punta paloma'],
+    },
+    'bolonia': {
+        'name': 'Bolonia', 'lat': 36.0870, 'lon': -5.7740,
+        'bands': [(60, 120), (240, 300)],
+        'aliases': ['bolonia'],
+    },
+    'palmones': {
+        'name': 'Palmones', 'lat': 36.1740, 'lon': -5.4410,
+        'bands': [(45, 135)],
+        'aliases': ['palmones', 'algeciras', 'getares'],
+    },
+    'el-palmar': {
+        'name': 'El Palmar', 'lat': 36.2270, 'lon': -6.0700,
+        'bands': [(180, 330)],
+        'aliases': ['el palmar', 'palmar', 'zahora', 'conil', 'caños de meca'],
+    },
+    'cadiz': {
+        'name': 'Cádiz', 'lat': 36.5200, 'lon': -6.2900,
+        'bands': [(200, 340)],
+        'aliases': ['cadiz', 'cádiz', 'santa maria del mar', 'la caleta', 'cortadura'],
+    },
+}
+
+# Rideable wind for wingfoil, in km/h (roughly 11-32 knots)
+RIDEABLE_MIN_KMH = 20
+RIDEABLE_MAX_KMH = 60
+# Shorter windows are not worth driving to the beach for (hours)
+MIN_WINDOW_HOURS = 2
+
+# Shared cache file: every gunicorn worker reads and writes the same SQLite db
+WEATHER_CACHE_PATH = os.environ.get(
+    'WEATHER_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weather_cache.db')
+)
+# Fallback freshness when Met.no does not send an Expires header (seconds)
+WEATHER_DEFAULT_TTL = int(os.environ.get('WEATHER_DEFAULT_TTL', 1800))
+# How often the background thread checks whether the cache has expired (seconds)
+WEATHER_REFRESH_INTERVAL = int(os.environ.get('WEATHER_REFRESH_INTERVAL', 60))
+# Upstream timeout; only ever paid by the background thread, never by a request
+WEATHER_FETCH_TIMEOUT = 10
+# A worker that starts a refresh holds the lease this long so others skip it
+WEATHER_LEASE_SECONDS = 60
+
+# Map Met.no symbol codes to Bootstrap Icons
+# (Add more mappings as needed based on https://api.met.no/weatherapi/weathericon/2.0/documentation)
+SYMBOL_TO_ICON = {
+    'clearsky_day': 'bi-sun-fill',
+    'clearsky_night': 'bi-moon-stars-fill',
+    'fair_day': 'bi-cloud-sun-fill',
+    'fair_night': 'bi-cloud-moon-fill',
+    'partlycloudy_day': 'bi-cloud-sun-fill',
+    'partlycloudy_night': 'bi-cloud-moon-fill',
+    'cloudy': 'bi-cloud-fill',
+    'rain': 'bi-cloud-rain-fill',
+    'lightrain': 'bi-cloud-drizzle-fill',
+    'heavyrain': 'bi-cloud-rain-heavy-fill',
+    'sleet': 'bi-cloud-sleet-fill',
+    'snow': 'bi-cloud-snow-fill',
+    'fog': 'bi-cloud-fog2-fill',
+    # Add more complex conditions if desired
+    'rainshowers_day': 'bi-cloud-rain-fill',
+    'rainshowers_night': 'bi-cloud-rain-fill',
+    'snowshowers_day': 'bi-cloud-snow-fill',
+    'snowshowers_night': 'bi-cloud-snow-fill',
+}
+DEFAULT_ICON = 'bi-thermometer-half'  # Fallback icon
+
+
+def default_weather():
+    """Weather dict shown while nothing has been fetched yet."""
+    return {
+        'current': {'icon': DEFAULT_ICON, 'temp': '--', 'description': 'Unavailable'},
+        'wind':    {'icon': 'bi-wind',  'speed': '--', 'direction': '--'},
+        'water':   {'icon': 'bi-water', 'temp': '--', 'wave_height': '--'}
+    }
+
+
+def parse_forecast(data):
+    """Build the home page weather dict from a Met.no compact response."""
+    times = data.get('properties', {}).get('timeseries', [])
+    if not times:
+        return None
+    inst = times[0]['data']['instant']['details']
+    next_hour_summary = times[0]['data'].get('next_1_hours', {}).get('summary', {})
+    symbol_code = next_hour_summary.get('symbol_code')
+
+    # Simplified description for now, could map symbol_code to text later
+    description = symbol_code.replace('_', ' ').capitalize() if symbol_code else 'Current Conditions'
+    icon_class = SYMBOL_TO_ICON.get(symbol_code, DEFAULT_ICON)
+
+    temp = round(inst.get('air_temperature', 0))
+    ws = round(inst.get('wind_speed', 0) * 3.6)
+    wd = round(inst.get('wind_from_direction', 0))
+    return {
+        'current': {'icon': icon_class, 'temp': temp, 'description': description},
+        'wind':    {'icon': 'bi-wind', 'speed': ws, 'direction': f"{wd}°"},
+        'water':   {'icon': 'bi-water', 'temp': '--', 'wave_height': '--'}
+    }
+
+
+def spot_key(lat, lon):
+    # Met.no asks for at most 4 decimals so identical spots share one cache entry
+    return f"{round(lat, 4):.4f},{round(lon, 4):.4f}"
+
+
+def resolve_spot(location):
+    """Map a free-text location ("Los Lances, Tarifa") to a SPOTS slug, or None."""
+    if not location:
+        return None
+    text = location.strip().lower()
+    for slug, spot in SPOTS.items():
+        if any(alias in text for alias in spot['aliases']):
+            return slug
+    return None
+
+
+# --- Forecast index ---
+
+def compact_series(data):
+    """Reduce a Met.no timeseries to ``[epoch, wind_kmh, wind_dir, temp]`` rows."""
+    series = []
+    for entry in data.get('properties', {}).get('timeseries', []):
+        details = entry.get('data', {}).get('instant', {}).get('details', {})
+        if 'wind_speed' not in details:
+            continue
+        t = datetime.fromisoformat(entry['time'].replace('Z', '+00:00')).timestamp()
+        series.append([
+            int(t),
+            round(details['wind_speed'] * 3.6),
+            round(details.get('wind_from_direction', 0)),
+            round(details.get('air_temperature', 0)),
+        ])
+    return series
+
+
+def _in_bands(direction, bands):
+    for start, end in bands:
+        if start <= end and start <= direction <= end:
+            return True
+        if start > end and (direction >= start or direction <= end):
+            return True
+    return False
+
+
+def compute_windows(series, bands):
+    """Group consecutive rideable timesteps into windows.
+
+    Each row covers the time until the next one (Met.no switches from hourly
+    to 6-hourly steps further out), the last row covers one hour.
+    """
+    windows = []
+    current = None
+    for i, (t, speed, direction, _temp) in enumerate(series):
+        step_end = series[i + 1][0] if i + 1 < len(series) else t + 3600
+        rideable = RIDEABLE_MIN_KMH <= speed <= RIDEABLE_MAX_KMH and _in_bands(direction, bands)
+        if rideable:
+            seconds = step_end - t
+            if current is None:
+                current = {'start': t, 'end': step_end, 'speed_seconds': 0, 'max_speed': 0, 'directions': []}
+            current['end'] = step_end
+            current['speed_seconds'] += speed * seconds
+            current['max_speed'] = max(current['max_speed'], speed)
+            current['directions'].append(direction)
+        elif current is not None:
+            windows.append(current)
+            current = None
+    if current is not None:
+        windows.append(current)
+
+    result = []
+    for w in windows:
+        duration = w['end'] - w['start']
+        if duration < MIN_WINDOW_HOURS * 3600:
+            continue
+        result.append({
+            'start': w['start'],
+            'end': w['end'],
+            'avg_speed': round(w['speed_seconds'] / duration),
+            'max_speed': w['max_speed'],
+            'direction': round(sum(w['directions']) / len(w['directions'])),
+        })
+    return result
+
+
+def _best_window(windows, now, horizon):
+    """Pick the window with the most rideable km/h·hours inside ``[now, horizon]``."""
+    best = None
+    for w in windows:
+        start, end = max(w['start'], now), min(w['end'], horizon)
+        if end - start < MIN_WINDOW_HOURS * 3600:
+            continue
+        hours = (end - start) / 3600
+        score = hours * w['avg_speed']
+        if best is None or score > best['score']:
+            best = dict(w, start=start, end=end, hours=round(hours, 1), score=round(score))
+    return best
+
+
+# --- Shared SQLite cache ---
+
+def _connect():
+    conn = sqlite3.connect(WEATHER_CACHE_PATH, timeout=5, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS forecast_cache ('
+        ' spot TEXT PRIMARY KEY,'
+        ' weather TEXT,'
+        ' series TEXT,'
+        ' windows TEXT,'
+        ' last_modified TEXT,'
+        ' expires_at REAL NOT NULL DEFAULT 0,'
+        ' fetched_at REAL,'
+        ' lease_until REAL NOT NULL DEFAULT 0)'
+    )
+    _upgrade_schema(conn)
+    return conn
+
+
+_schema_checked = False
+
+
+def _upgrade_schema(conn):
+    # Cache files created before the multi-spot index lack the series columns
+    global _schema_checked
+    if _schema_checked:
+        return
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(forecast_cache)')}
+    for column in ('series', 'windows'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE forecast_cache ADD COLUMN {column} TEXT')
+    _schema_checked = True
+
+
+def read_cache(spot):
+    """Return the cached row for a spot as a dict, or None."""
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                'SELECT weather, last_modified, expires_at, fetched_at FROM forecast_cache WHERE spot = ?',
+                (spot,)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Weather cache read error: {e}")
+        return None
+    if not row:
+        return None
+    return {
+        'weather': json.loads(row[0]) if row[0] else None,
+        'last_modified': row[1],
+        'expires_at': row[2],
+        'fetched_at': row[3],
+    }
+
+
+def read_windows(spots):
+    """Return ``{spot: (windows, fetched_at)}`` for many spots in one query."""
+    if not spots:
+        return {}
+    placeholders = ','.join('?' for _ in spots)
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                f'SELECT spot, windows, fetched_at FROM forecast_cache WHERE spot IN ({placeholders})',
+                list(spots)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Weather cache read error: {e}")
+        return {}
+    return {spot: (json.loads(windows) if windows else [], fetched_at) for spot, windows, fetched_at in rows}
+
+
+def _acquire_lease(conn, spot, now):
+    """Claim the right to refresh a spot; only one worker wins per expiry."""
+    conn.execute('INSERT OR IGNORE INTO forecast_cache (spot) VALUES (?)', (spot,))
+    cur = conn.execute(
+        'UPDATE forecast_cache SET lease_until = ? WHERE spot = ? AND expires_at <= ? AND lease_until <= ?',
+        (now + WEATHER_LEASE_SECONDS, spot, now, now)
+    )
+    return cur.rowcount == 1
+
+
+def _parse_expires(value, now):
+    if value:
+        try:
+            return parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return now + WEATHER_DEFAULT_TTL
+
+
+def refresh_spot(lat, lon, bands=((0, 360),)):
+    """Fetch a spot from Met.no if its cache entry has expired.
+
+    Honours Met.no's caching rules: the request carries If-Modified-Since and
+    the next fetch is scheduled from the Expires header. The full timeseries is
+    stored compactly together with its precomputed wind windows, so readers
+    never parse the upstream JSON. Returns True when the cache was touched.
+    """
+    spot = spot_key(lat, lon)
+    now = time.time()
+    conn = _connect()
+    try:
+        if not _acquire_lease(conn, spot, now):
+            return False
+        row = conn.execute('SELECT last_modified FROM forecast_cache WHERE spot = ?', (spot,)).fetchone()
+        headers = dict(MET_NO_HEADERS)
+        if row and row[0]:
+            headers['If-Modified-Since'] = row[0]
+        try:
+            resp = outbound.metno.get(
+                MET_NO_URL, params={'lat': spot.split(',')[0], 'lon': spot.split(',')[1]},
+                headers=headers, timeout=WEATHER_FETCH_TIMEOUT
+            )
+            if resp.status_code == 304:
+                conn.execute(
+                    'UPDATE forecast_cache SET expires_at = ?, lease_until = 0 WHERE spot = ?',
+                    (_parse_expires(resp.headers.get('Expires'), now), spot)
+                )
+                return True
+            resp.raise_for_status()
+            data = resp.json()
+            weather = parse_forecast(data)
+            series = compact_series(data)
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            # Keep serving the stale entry; retry once the lease runs out
+            logger.error(f"Weather fetch error for {spot}: {e}")
+            return False
+        if weather is None:
+            return False
+        conn.execute(
+            'UPDATE forecast_cache SET weather = ?, series = ?, windows = ?, last_modified = ?,'
+            ' expires_at = ?, fetched_at = ?, lease_until = 0 WHERE spot = ?',
+            (json.dumps(weather), json.dumps(series, separators=(',', ':')),
+             json.dumps(compute_windows(series, bands), separators=(',', ':')),
+             resp.headers.get('Last-Modified'),
+             _parse_expires(resp.headers.get('Expires'), now), now, spot)
+        )
+        return True
+    finally:
+        conn.close()
+
+
+# --- Background refresher ---
+
+_refresher = None
+_refresher_lock = threading.Lock()
+_refresher_wakeup = threading.Event()
+
+
+def refresh_all():
+    """Batch-refresh every known spot whose cache entry has expired."""
+    refreshed = 0
+    for spot in SPOTS.values():
+        try:
+            if refresh_spot(spot['lat'], spot['lon'], spot['bands']):
+                refreshed += 1
+        except Exception as e:
+            logger.error(f"Weather refresher error for {spot['name']}: {e}")
+    return refreshed
+
+
+def _refresh_loop():
+    while True:
+        refresh_all()
+        _refresher_wakeup.wait(WEATHER_REFRESH_INTERVAL)
+        _refresher_wakeup.clear()
+
+
+def start_refresher():
+    """Start this process's refresh thread (idempotent, fork-safe).
+
+    The thread is started lazily from the first request rather than at import
+    time so every gunicorn worker gets its own thread after forking. Workers
+    coordinate through the lease column, so only one of them hits Met.no.
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is not None and _refresher.is_alive():
+            return
+        _refresher = threading.Thread(target=_refresh_loop, name='weather-refresher', daemon=True)
+        _refresher.start()
+
+
+def get_weather(lat=TARIFA[0], lon=TARIFA[1]):
+    """Return ``(weather, fetched_at)`` from the shared cache without touching the network.
+
+    Stale entries are served as-is while the background thread refreshes them.
+    ``fetched_at`` is a datetime, or None if nothing has been cached yet.
+    """
+    start_refresher()
+    cached = read_cache(spot_key(lat, lon))
+    if not cached or not cached['weather']:
+        _refresher_wakeup.set()
+        return default_weather(), None
+    if cached['expires_at'] <= time.time():
+        _refresher_wakeup.set()
+    return cached['weather'], datetime.fromtimestamp(cached['fetched_at'])
+
+
+def best_spots(slugs=None, hours=48):
+    """Rank spots by their best rideable window in the next ``hours``.
+
+    Reads only the precomputed window index, one cache query for all spots.
+    Returns a list of dicts, best first; spots without a window come last
+    with ``window`` set to None.
+    """
+    start_refresher()
+    slugs = [slug for slug in (slugs or SPOTS) if slug in SPOTS]
+    keys = {slug: spot_key(SPOTS[slug]['lat'], SPOTS[slug]['lon']) for slug in slugs}
+    cached = read_windows(list(keys.values()))
+    if len(cached) < len(keys):
+        _refresher_wakeup.set()
+    now = time.time()
+    horizon = now + hours * 3600
+    ranking = []
+    for slug in slugs:
+        windows, fetched_at = cached.get(keys[slug], ([], None))
+        best = _best_window(windows, now, horizon)
+        if best:
+            best['start'] = datetime.fromtimestamp(best['start']).isoformat()
+            best['end'] = datetime.fromtimestamp(best['end']).isoformat()
+        ranking.append({
+            'spot': slug,
+            'name': SPOTS[slug]['name'],
+            'window': best,
+            'updated': datetime.fromtimestamp(fetched_at).isoformat() if fetched_at else None,
+        })
+    ranking.sort(key=lambda r: r['window']['score'] if r['window'] else -1, reverse=True)
+    return ranking
@@ -0,0 +1,154 @@
+"""YouTube learning material: video ids and cached oEmbed details.
+
+Adding a link never waits on YouTube. The LearningMaterial row is created
+straight away with the video id and its standard thumbnail; the title comes
+from the ``youtube_video`` cache if the video is known, otherwise from an
+oEmbed lookup on a background thread. Each video is looked up once however
+many sessions link to it; ``flask youtube enrich`` fills in anything missing
+in bulk.
+"""
+import re
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+import outbound
+from models import db, LearningMaterial, YouTubeVideo
+
+logger = logging.getLogger(__name__)
+
+OEMBED_URL = 'https://www.youtube.com/oembed'
+OEMBED_TIMEOUT = 5
+# watch?v=, youtu.be/, /shorts/, /embed/ and /live/ links
+VIDEO_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def video_id(url):
+    """The 11-character video id of a YouTube link, or None."""
+    if 'youtube.com' not in (url or '') and 'youtu.be' not in (url or ''):
+        return None
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def default_thumbnail(vid):
+    """Thumbnail YouTube serves for every video; oEmbed returns the same URL."""
+    return f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg"
+
+
+def fetch_oembed(vid):
+    """Look a video up on oEmbed; return a new YouTubeVideo (not yet added).
+
+    Private and deleted videos come back with status 'missing' so they are
+    not asked for again. Network errors and 5xx responses raise
+    ``requests.exceptions.RequestException``.
+    """
+    response = outbound.youtube.get(
+        OEMBED_URL,
+        params={'url': f'https://www.youtube.com/watch?v={vid}', 'format': 'json'},
+        timeout=OEMBED_TIMEOUT
+    )
+    if response.status_code in (401, 403, 404):
+        return YouTubeVideo(video_id=vid, status='missing', fetched_at=datetime.utcnow())
+    response.raise_for_status()
+    data = response.json()
+    return YouTubeVideo(video_id=vid, title=data.get('title'),
+                        thumbnail_url=data.get('thumbnail_url') or default_thumbnail(vid),
+                        status='ok', fetched_at=datetime.utcnow())
+
+
+def apply_video(video, refresh=False):
+    """Copy a cached video's details onto the materials linking it.
+
+    Only materials still without a title are touched unless ``refresh``.
+    """
+    if video.status != 'ok' or not video.title:
+        return 0
+    query = db.session.query(LearningMaterial).filter(LearningMaterial.video_id == video.video_id)
+    if not refresh:
+        query = query.filter(LearningMaterial.title.is_(None))
+    return query.update({'title': video.title, 'thumbnail_url': video.thumbnail_url},
+                        synchronize_session=False)
+
+
+def new_material(session_id, url):
+    """A LearningMaterial for ``url``, filled from the cache when the video is known.
+
+    Returns None if the URL is not a YouTube video link. Materials without a
+    title still need ``start_enrichment`` once the caller has committed.
+    """
+    vid = video_id(url)
+    if vid is None:
+        return None
+    material = LearningMaterial(session_id=session_id, url=url, video_id=vid,
+                                thumbnail_url=default_thumbnail(vid))
+    video = db.session.get(YouTubeVideo, vid)
+    if video is not None and video.status == 'ok':
+        material.title = video.title
+        material.thumbnail_url = video.thumbnail_url or material.thumbnail_url
+    return material
+
+
+def enrich(video_ids, refresh=False):
+    """Make sure each video is cached and its materials are filled in.
+
+    With ``refresh`` cached videos are fetched again. Returns the number of
+    oEmbed lookups made; failures are logged and left for the next run.
+    """
+    fetched = 0
+    for vid in dict.fromkeys(video_ids):
+        video = db.session.get(YouTubeVideo, vid)
+        if video is None or refresh:
+            try:
+                video = db.session.merge(fetch_oembed(vid))
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error fetching YouTube oEmbed for {vid}: {e}")
+                continue
+            fetched += 1
+        apply_video(video, refresh=refresh)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker cached the same video meanwhile and fills its materials
+            db.session.rollback()
+    return fetched
+
+
+def _get_executor():
+    # Created lazily so each gunicorn worker owns its threads after forking
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='oembed')
+        return _executor
+
+
+def start_enrichment(video_ids):
+    """Run ``enrich`` for these videos after the request has returned."""
+    video_ids = [vid for vid in video_ids if vid]
+    if not video_ids:
+        return
+    app = current_app._get_current_object()
+    _get_executor().submit(_run_enrichment, app, video_ids)
+
+
+def _run_enrichment(app, video_ids):
+    with app.app_context():
+        try:
+            enrich(video_ids)
+        except Exception:
+            logger.exception('YouTube enrichment for %s failed', video_ids)
+
+
+def pending_video_ids(refresh=False):
+    """Video ids with materials still missing details (all linked videos with ``refresh``)."""
+    query = db.session.query(LearningMaterial.video_id).filter(LearningMaterial.video_id.isnot(None))
+    if not refresh:
+        query = query.filter(LearningMaterial.title.is_(None))
+    return [vid for (vid,) in query.distinct()]